@@ -0,0 +1,98 @@
+"""Generates the tile pyramid of a SpatiaLite table of random polygons
+(lon/lat) with geoalchemy.mvt and reports the number of tiles, their size and
+the time per zoom level.
+
+Requires pysqlite2 and SpatiaLite, like geoalchemy/tests/test_spatialite.py.
+
+Usage::
+
+    $ python benchmarks/mvt.py [number of polygons] [max zoom level] [path to libspatialite]
+"""
+import sys
+import random
+import time
+from math import cos, sin, pi, floor
+
+from sqlalchemy import create_engine, MetaData, Column, Integer, String
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+from pysqlite2 import dbapi2 as sqlite
+from geoalchemy import GeometryColumn, GeometryDDL, Polygon, WKTSpatialElement
+from geoalchemy.spatialite import SQLiteComparator
+from geoalchemy import mvt
+
+
+metadata = MetaData()
+Base = declarative_base(metadata=metadata)
+
+class Parcel(Base):
+    __tablename__ = 'parcels'
+
+    parcel_id = Column(Integer, primary_key=True)
+    parcel_name = Column(String)
+    parcel_geom = GeometryColumn(Polygon(2, srid=4326), comparator=SQLiteComparator)
+
+GeometryDDL(Parcel.__table__)
+
+
+def polygon(lon, lat, radius, vertices=20):
+    """A random star-shaped polygon around lon/lat."""
+    coords = []
+    for i in xrange(vertices):
+        angle = 2 * pi * i / vertices
+        r = radius * random.uniform(0.5, 1.0)
+        coords.append("%f %f" % (lon + r * cos(angle), lat + r * sin(angle)))
+    coords.append(coords[0])
+    return "POLYGON((%s))" % ",".join(coords)
+
+
+def fixture(session, count):
+    """Random polygons (0.01 to 0.1 degree) in a 10 x 5 degree area."""
+    random.seed(42)
+    for i in xrange(count):
+        lon, lat = random.uniform(5, 15), random.uniform(45, 50)
+        session.add(Parcel(parcel_name='parcel %d' % i,
+                           parcel_geom=WKTSpatialElement(polygon(lon, lat, random.uniform(0.01, 0.1)), 4326)))
+    session.commit()
+
+
+def tiles(z, bounds):
+    """The tiles x/y of zoom level z covering the mercator bounds."""
+    size = 2 * mvt._ORIGIN / 2 ** z
+    minx, miny, maxx, maxy = bounds
+    for x in xrange(int(floor((minx + mvt._ORIGIN) / size)), int(floor((maxx + mvt._ORIGIN) / size)) + 1):
+        for y in xrange(int(floor((mvt._ORIGIN - maxy) / size)), int(floor((mvt._ORIGIN - miny) / size)) + 1):
+            yield x, y
+
+
+def main(count=10000, max_zoom=10, spatialite='/usr/lib/libspatialite.so'):
+    engine = create_engine('sqlite://', module=sqlite)
+    connection = engine.raw_connection().connection
+    connection.enable_load_extension(True)
+    session = sessionmaker(bind=engine)()
+    session.execute("select load_extension('%s')" % spatialite)
+    session.execute("SELECT InitSpatialMetaData()")
+    connection.enable_load_extension(False)
+    metadata.create_all(engine)
+
+    start = time.time()
+    fixture(session, count)
+    print "%d polygons loaded in %.3f s" % (count, time.time() - start)
+
+    bounds = mvt._mercator(5, 45) + mvt._mercator(15, 50)
+    print "%-6s %8s %12s %12s %12s" % ("zoom", "tiles", "bytes", "time (s)", "ms / tile")
+    for z in xrange(int(max_zoom) + 1):
+        size = number = 0
+        start = time.time()
+        for x, y in tiles(z, bounds):
+            data = mvt.tile(session, Parcel.parcel_geom, z, x, y, properties=[Parcel.parcel_name])
+            size += len(data)
+            number += 1
+        elapsed = time.time() - start
+        print "%-6d %8d %12d %12.3f %12.2f" % (z, number, size, elapsed, 1000 * elapsed / number)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*([int(arg) for arg in args[:2]] + args[2:]))
@@ -0,0 +1,124 @@
+"""Compares the time to insert random points into a SpatiaLite table with a
+spatial index (the R*Tree is filled by triggers), the time to build the
+spatial index of a table that was filled without index, and the latency of
+bounding box queries, with the rows inserted in random order, in geohash
+order and in Hilbert curve order (geoalchemy.ordering).
+
+Requires pysqlite2 and SpatiaLite, like geoalchemy/tests/test_spatialite.py.
+No results are recorded yet: the benchmark has not been run against
+SpatiaLite, so it does not show yet that the ordering helps.
+
+Usage::
+
+    $ python benchmarks/ordering.py [number of points] [number of queries] [path to libspatialite]
+"""
+import sys
+import random
+import time
+
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, bindparam
+from sqlalchemy.orm import sessionmaker, mapper
+
+from pysqlite2 import dbapi2 as sqlite
+from geoalchemy import GeometryColumn, GeometryDDL, GeometryExtensionColumn, Point
+from geoalchemy.functions import functions
+from geoalchemy.query import SpatialQuery
+from geoalchemy.utils import to_wkb
+from geoalchemy.ordering import ordered
+
+
+EXTENT = (5, 45, 15, 50)
+
+
+def points(count):
+    """Random points around 100 centers, like addresses in towns."""
+    random.seed(42)
+    centers = [(random.uniform(5, 15), random.uniform(45, 50)) for i in xrange(100)]
+    result = []
+    for i in xrange(count):
+        x, y = random.choice(centers)
+        result.append((i + 1, (random.gauss(x, 0.1), random.gauss(y, 0.1))))
+    return result
+
+
+def create(metadata, name, spatial_index=True):
+    table = Table(name, metadata,
+                  Column('point_id', Integer, primary_key=True),
+                  GeometryExtensionColumn('point_geom', Point(2, srid=4326, spatial_index=spatial_index)))
+    GeometryDDL(table)
+
+    class Location(object):
+        pass
+    mapper(Location, table, properties={'point_geom': GeometryColumn(table.c.point_geom)})
+    return table, Location
+
+
+def insert(session, table, rows):
+    statement = table.insert().values({table.c.point_geom: functions._from_wkb(bindparam('wkb'), 4326)})
+    start = time.time()
+    for i in xrange(0, len(rows), 1000):
+        session.execute(statement, [{'point_id': pk, 'wkb': buffer(to_wkb({"type": "Point",
+                                                                         "coordinates": list(p)}))}
+                                    for (pk, p) in rows[i:i + 1000]])
+    session.commit()
+    return time.time() - start
+
+
+def build_index(session, table):
+    start = time.time()
+    session.execute("SELECT CreateSpatialIndex('%s', 'point_geom')" % table.name)
+    session.commit()
+    return time.time() - start
+
+
+def query(session, location, boxes):
+    start = time.time()
+    found = 0
+    for box in boxes:
+        found += session.query(location).in_bbox(box).count()
+    return time.time() - start, found
+
+
+def main(count=100000, queries=1000, spatialite='/usr/lib/libspatialite.so'):
+    engine = create_engine('sqlite://', module=sqlite)
+    connection = engine.raw_connection().connection
+    connection.enable_load_extension(True)
+    session = sessionmaker(bind=engine, query_cls=SpatialQuery)()
+    session.execute("select load_extension('%s')" % spatialite)
+    session.execute("SELECT InitSpatialMetaData()")
+    connection.enable_load_extension(False)
+
+    metadata = MetaData()
+    rows = points(count)
+    random.shuffle(rows)
+    orders = [("random", rows),
+              ("geohash", ordered(rows, 'geohash', key=lambda (pk, p): p)),
+              ("hilbert", ordered(rows, 'hilbert', key=lambda (pk, p): p, extent=EXTENT))]
+    tables = [create(metadata, "points_%s" % name) for (name, r) in orders]
+    unindexed = [create(metadata, "points_%s_unindexed" % name, spatial_index=False)[0]
+                 for (name, r) in orders]
+    metadata.create_all(engine)
+
+    random.seed(1)
+    boxes = []
+    for i in xrange(queries):
+        x, y = random.uniform(5, 15), random.uniform(45, 50)
+        boxes.append((x, y, x + 0.05, y + 0.05))
+
+    print "%d points, %d bounding box queries" % (count, queries)
+    print "%-10s %12s %12s %12s %12s %12s %10s" % ("order", "insert (s)", "load (s)", "index (s)",
+                                                    "query (s)", "ms / query", "rows")
+    for ((name, r), (table, location), other) in zip(orders, tables, unindexed):
+        # with the R*Tree filled by triggers
+        inserted = insert(session, table, r)
+        # without spatial index, which is built afterwards
+        loaded = insert(session, other, r)
+        indexed = build_index(session, other)
+        elapsed, found = query(session, location, boxes)
+        print "%-10s %12.3f %12.3f %12.3f %12.3f %12.3f %10d" % (name, inserted, loaded, indexed, elapsed,
+                                                                1000 * elapsed / queries, found)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*([int(arg) for arg in args[:2]] + args[2:]))
@@ -0,0 +1,57 @@
+"""Compares payload size and encode/decode time of WKB and TWKB for
+linestrings that look like GPS tracks (lon/lat, ~1m spacing between
+vertices, 7 decimal digits).
+
+Usage::
+
+    $ python benchmarks/twkb.py [number of linestrings] [points per linestring]
+"""
+import sys
+import random
+import time
+
+from geoalchemy.utils import from_wkb, to_wkb
+from geoalchemy.twkb import to_twkb, from_twkb
+
+
+def track(points):
+    """A random walk with slowly changing heading."""
+    x, y = random.uniform(-10, 10), random.uniform(40, 50)
+    dx, dy = 0.00001, 0.00001
+    coords = []
+    for i in xrange(points):
+        dx = max(-0.00005, min(0.00005, dx + random.gauss(0, 0.000005)))
+        dy = max(-0.00005, min(0.00005, dy + random.gauss(0, 0.000005)))
+        x, y = x + dx, y + dy
+        coords.append([round(x, 7), round(y, 7)])
+    return {"type": "LineString", "coordinates": coords}
+
+
+def timed(function, values):
+    start = time.time()
+    result = [function(value) for value in values]
+    return result, time.time() - start
+
+
+def main(count=1000, points=200):
+    random.seed(42)
+    geometries = [track(points) for i in xrange(count)]
+
+    wkbs, wkb_encode = timed(to_wkb, geometries)
+    wkb_decoded, wkb_decode = timed(from_wkb, wkbs)
+    wkb_size = sum(len(wkb) for wkb in wkbs)
+
+    print "%d linestrings with %d points" % (count, points)
+    print "%-14s %12s %8s %12s %12s" % ("format", "bytes", "ratio", "encode (s)", "decode (s)")
+    print "%-14s %12d %8.2f %12.3f %12.3f" % ("WKB", wkb_size, 1.0, wkb_encode, wkb_decode)
+
+    for precision in (7, 6, 5):
+        twkbs, twkb_encode = timed(lambda geom: to_twkb(geom, precision), geometries)
+        twkb_decoded, twkb_decode = timed(from_twkb, twkbs)
+        twkb_size = sum(len(twkb) for twkb in twkbs)
+        print "%-14s %12d %8.2f %12.3f %12.3f" % ("TWKB (prec %d)" % precision, twkb_size,
+                                                 float(wkb_size) / twkb_size, twkb_encode, twkb_decode)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
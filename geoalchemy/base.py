@@ -4,7 +4,8 @@ from sqlalchemy.sql.expression import ColumnClause, literal
 from sqlalchemy.types import UserDefinedType
 from sqlalchemy.ext.compiler import compiles
 
-from utils import from_wkt
+from utils import from_wkt, split_ewkt, make_ewkt, ewkb_srid, split_ewkb, make_ewkb, \
+    wkb_bounds, geometry_bounds
 from functions import functions, _get_function, BaseFunction
 
 # Base classes for geoalchemy
@@ -31,9 +32,9 @@ class SpatialElement(object):
         """
         if isinstance(self, WKTSpatialElement):
             # for WKTSpatialElement we don't need to make a new query
-            return self.desc 
+            return self.geom_wkt
         elif isinstance(self.desc, WKTSpatialElement):
-            return self.desc.desc
+            return self.desc.geom_wkt
         else:
             return session.scalar(self.wkt)       
 
@@ -53,12 +54,21 @@ class WKTSpatialElement(SpatialElement, expression.Function):
     is interpreted as 'GeomFromText(value)' or as the equivalent function in the 
     currently used database.
     
+    The value may also be given as Extended WKT (EWKT), e.g. 'SRID=4326;POINT(1 2)'.
+    In this case the embedded SRID is used instead of the parameter `srid`, and
+    databases that understand EWKT receive the value as a single parameter.
+    
     """
     
-    def __init__(self, desc, srid=4326, geometry_type='GEOMETRY'):
+    def __init__(self, desc, srid=None, geometry_type='GEOMETRY'):
         assert isinstance(desc, basestring)
         self.desc = desc
-        self.srid = srid
+        self.__wkt, embedded_srid = split_ewkt(desc)
+        self.extended = embedded_srid is not None
+        if self.extended:
+            self.srid = embedded_srid
+        else:
+            self.srid = 4326 if srid is None else srid
         self.geometry_type = geometry_type
         
         expression.Function.__init__(self, "")
@@ -66,11 +76,25 @@ class WKTSpatialElement(SpatialElement, expression.Function):
     @property
     def geom_wkt(self):
         # directly return WKT value
-        return self.desc
+        return self.__wkt
+    
+    @property
+    def geom_ewkt(self):
+        if self.extended:
+            return self.desc
+        return make_ewkt(self.__wkt, self.srid)
 
 @compiles(WKTSpatialElement)
 def __compile_wktspatialelement(element, compiler, **kw):
-    function = _get_function(element, compiler, (element.desc, element.srid), kw.get('within_columns_clause', False))
+    from geoalchemy.dialect import DialectManager 
+    database_dialect = DialectManager.get_spatial_dialect(compiler.dialect)
+    
+    if element.extended and database_dialect.get_function(functions._from_ewkt) is not None:
+        function = _get_function(functions._from_ewkt(), compiler, (element.desc,), 
+                                 kw.get('within_columns_clause', False))
+    else:
+        function = _get_function(element, compiler, (element.geom_wkt, element.srid), 
+                                 kw.get('within_columns_clause', False))
     
     return compiler.process(function)
 
@@ -82,24 +106,50 @@ class WKBSpatialElement(SpatialElement, expression.Function):
     is interpreted as 'GeomFromWKB(value)' or as the equivalent function in the 
     currently used database .
     
+    The value may also be given as Extended WKB (EWKB), as used by PostGIS. In 
+    this case the embedded SRID is used instead of the parameter `srid`, and 
+    databases that understand EWKB receive the value as a single parameter.
+    
     """
     
-    def __init__(self, desc, srid=4326, geometry_type='GEOMETRY'):
+    def __init__(self, desc, srid=None, geometry_type='GEOMETRY'):
         assert isinstance(desc, (basestring, buffer))
         self.desc = desc
-        self.srid = srid
+        embedded_srid = ewkb_srid(desc)
+        self.extended = embedded_srid is not None
+        if self.extended:
+            self.srid = embedded_srid
+        else:
+            self.srid = 4326 if srid is None else srid
         self.geometry_type = geometry_type
         
         expression.Function.__init__(self, "")
 
+    @property
+    def geom_wkb(self):
+        # return the WKB value without an embedded SRID
+        if self.extended:
+            return split_ewkb(self.desc)[0]
+        return self.desc
+    
+    @property
+    def geom_ewkb(self):
+        if self.extended:
+            return self.desc
+        return make_ewkb(self.desc, self.srid)
+
 @compiles(WKBSpatialElement)
 def __compile_wkbspatialelement(element, compiler, **kw):
     from geoalchemy.dialect import DialectManager 
     database_dialect = DialectManager.get_spatial_dialect(compiler.dialect)
     
-    function = _get_function(element, compiler, (database_dialect.bind_wkb_value(element), 
-                                                 element.srid),
-                                                 kw.get('within_columns_clause', False))
+    if element.extended and database_dialect.get_function(functions._from_ewkb) is not None:
+        function = _get_function(functions._from_ewkb(), compiler, (element.desc,), 
+                                 kw.get('within_columns_clause', False))
+    else:
+        function = _get_function(element, compiler, (database_dialect.bind_wkb_value(element), 
+                                                     element.srid),
+                                                     kw.get('within_columns_clause', False))
     
     return compiler.process(function)
 
@@ -135,17 +185,39 @@ class PersistentSpatialElement(SpatialElement):
     @property    
     def geom_wkb(self):
         if self.desc is not None and isinstance(self.desc, WKBSpatialElement):
-            return self.desc.desc
+            return self.desc.geom_wkb
         else:
             return None
     
     @property    
     def geom_wkt(self):
         if self.desc is not None and isinstance(self.desc, WKTSpatialElement):
-            return self.desc.desc
+            return self.desc.geom_wkt
         else:
             return None
 
+    @property
+    def bounds(self):
+        """The bounding box (minx, miny, maxx, maxy) of the geometry, computed 
+        from the loaded WKB (or WKT) value without querying the database. 
+        The value is cached, ``None`` is returned for empty geometries.
+        
+        """
+        try:
+            return self.__dict__['_bounds']
+        except KeyError:
+            pass
+        
+        if self.geom_wkb is not None:
+            bounds = wkb_bounds(self.geom_wkb)
+        elif self.geom_wkt is not None:
+            bounds = geometry_bounds(from_wkt(self.geom_wkt))
+        else:
+            raise Exception("The geometry of %r is not available in Python" % (self, ))
+        
+        self.__dict__['_bounds'] = bounds
+        return bounds
+
 class GeometryBase(UserDefinedType):
     """Base Geometry column type for all spatial databases.
     """
@@ -153,11 +225,13 @@ class GeometryBase(UserDefinedType):
     name = 'GEOMETRY'
 
     def __init__(self, dimension=2, srid=4326, spatial_index=True,
-                 wkt_internal=False, **kwargs):
+                 wkt_internal=False, ewkb_internal=False, precision=None, **kwargs):
         self.dimension = dimension
         self.srid = srid
         self.spatial_index = spatial_index
         self.wkt_internal = wkt_internal
+        self.ewkb_internal = ewkb_internal
+        self.precision = precision
         self.kwargs = kwargs
         super(GeometryBase, self).__init__()
 
@@ -188,7 +262,9 @@ class GeometryBase(UserDefinedType):
     def adapt(self, cls, **kwargs):
         return cls(dimension=self.dimension, srid=self.srid,
                    spatial_index=self.spatial_index,
-                   wkt_internal=self.wkt_internal, **self.kwargs)
+                   wkt_internal=self.wkt_internal,
+                   ewkb_internal=self.ewkb_internal,
+                   precision=self.precision, **self.kwargs)
 
 # ORM integration
 
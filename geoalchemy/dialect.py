@@ -3,10 +3,11 @@ from sqlalchemy.dialects.sqlite.base import SQLiteDialect
 from sqlalchemy.dialects.mysql.base import MySQLDialect
 from sqlalchemy.dialects.oracle.base import OracleDialect
 from sqlalchemy.dialects.mssql.base import MSDialect
-from sqlalchemy import func
+from sqlalchemy import func, select
 from geoalchemy.functions import functions
 from geoalchemy.base import WKTSpatialElement, WKBSpatialElement,\
     DBSpatialElement
+from geoalchemy.utils import to_wkt
 
 class SpatialDialect(object):
     """This class bundles all required classes and methods to support 
@@ -21,6 +22,9 @@ class SpatialDialect(object):
                    WKTSpatialElement : 'GeomFromText',
                    functions.wkb: 'AsBinary',
                    WKBSpatialElement : 'GeomFromWKB',
+                   functions._from_ewkt : None,
+                   functions._from_ewkb : None,
+                   functions._from_wkb : 'GeomFromWKB',
                    DBSpatialElement : '',
                    functions.dimension : 'Dimension',
                    functions.srid : 'SRID',
@@ -41,6 +45,8 @@ class SpatialDialect(object):
                    functions.buffer : 'Buffer',
                    functions.convex_hull : 'ConvexHull',
                    functions.envelope : 'Envelope',
+                   functions.simplify : 'Simplify',
+                   functions.snap_to_grid : 'SnapToGrid',
                    functions.start_point : 'StartPoint',
                    functions.end_point : 'EndPoint',
                    functions.transform : 'Transform',
@@ -61,7 +67,14 @@ class SpatialDialect(object):
                    functions.collect : None,
                    functions.extent : None,
                    functions._within_distance: lambda compiler, geom1, geom2, dist:
-                                                   func.DWithin(geom1, geom2, dist)
+                                                   func.DWithin(geom1, geom2, dist),
+                   functions._bbox_intersects: lambda compiler, geom1, geom2:
+                                                   func.MBRIntersects(geom1, geom2),
+                   functions._knn_distance: lambda compiler, geom1, geom2:
+                                                func.Distance(geom1, geom2),
+                   functions._knn_filter: lambda compiler, geom1, geom2, k: geom1 != None,
+                   functions._xmin: 'MbrMinX',
+                   functions._ymin: 'MbrMinY'
                   }
     
     def get_function(self, function_class):
@@ -138,15 +151,120 @@ class SpatialDialect(object):
         the value of base.WKBSpatialElement into a query.
         
         """
-        return None if wkb_element is None else wkb_element.desc
+        return None if wkb_element is None else wkb_element.geom_wkb
     
-    def handle_ddl_after_create(self, bind, table, column):
+    def evaluate_many(self, session, function_class, elements, arguments, batch_size=250):
+        """This method is called from functions.evaluate_many() to evaluate a function 
+        for a list of geometries. It returns the results in the order of the geometries.
+        
+        The default implementation selects one column per geometry, so that a 
+        single row has to be fetched. Because databases limit the number of columns 
+        and parameters of a query (e.g. 1000 columns for Oracle, 2100 parameters for 
+        SQL Server, 999 parameters for older SQLite versions), a query is sent for 
+        every `batch_size` geometries. The default of 250 stays below these limits 
+        for functions with up to three arguments.
+        
+        """
+        results = []
+        for i in xrange(0, len(elements), batch_size):
+            query = select([function_class(element, *arguments) 
+                            for element in elements[i:i + batch_size]])
+            results.extend(session.execute(query).fetchone())
+        return results
+    
+    def handle_ddl_after_create(self, bind, table, column, create_index=True):
         """This method is called after the mapped table was created in the database
-        by SQLAlchemy. It is used to create a geometry column for the created table.
+        by SQLAlchemy. It is used to create a geometry column for the created table,
+        and its spatial index unless ``create_index`` is False (the index is then
+        built later by :meth:`build_spatial_indexes`).
         
         """
         pass
     
+    def inline_geometry_columns(self, bind):
+        """Returns True if the geometry columns are created with the ``CREATE
+        TABLE`` statement (and dropped with the table) instead of being added by
+        :meth:`handle_ddl_after_create`.
+        
+        """
+        return False
+    
+    def handle_ddl_after_create_inline(self, bind, table, columns):
+        """This method is called after a table with inline geometry columns was
+        created. It creates the spatial indexes of the geometry ``columns``.
+        
+        """
+        self.build_spatial_indexes(bind, [(table, c) for c in columns if c.type.spatial_index])
+    
+    def spatial_index_ddl(self, table, column, concurrently=False):
+        """Returns the list of statements that create the spatial index of a
+        geometry column. The index options are keyword arguments of the geometry
+        type, prefixed with the name of the dialect, e.g.
+        ``Geometry(2, postgis_index_method='brin')``.
+        
+        ``concurrently`` is set when the index is built on a table that is
+        already filled (and not in the transaction that created the table),
+        see :meth:`build_spatial_indexes`.
+        
+        """
+        return []
+    
+    def spatial_indexes_ddl(self, indexes, concurrently=False):
+        """Returns the list of statements that create the spatial indexes of
+        ``indexes``, a list of ``(table, column)`` pairs of tables that were
+        created before.
+        
+        """
+        statements = []
+        for (table, column) in indexes:
+            statements.extend(self.spatial_index_ddl(table, column, concurrently))
+        return statements
+    
+    def build_spatial_indexes(self, bind, indexes, parallel=1, concurrently=False):
+        """Builds the spatial indexes of ``indexes`` (see :meth:`spatial_indexes_ddl`)
+        at once. ``parallel`` is the number of connections that build the indexes
+        at the same time, for the databases that support it. ``concurrently``
+        is set when the tables are already filled, so that the databases that
+        support it build the indexes without locking the tables against writes.
+        
+        """
+        for statement in self.spatial_indexes_ddl(indexes, concurrently):
+            bind.execute(statement)
+    
+    def estimated_extent(self, session, column):
+        """Returns the extent ``(minx, miny, maxx, maxy)`` of the geometry ``column``
+        as estimated from the statistics or the spatial index, without reading the
+        table, or None if it is not known.
+        
+        """
+        raise NotImplementedError("Estimated extents are not supported by %s"
+                                  % self.__class__.__name__)
+    
+    def estimated_count(self, session, column, bbox):
+        """Returns the estimated number of rows whose geometry intersects the
+        bounding box ``bbox`` (``(minx, miny, maxx, maxy)``). By default the
+        bounding boxes that intersect ``bbox`` are counted with the spatial index.
+        
+        """
+        minx, miny, maxx, maxy = bbox
+        polygon = to_wkt({"type": "Polygon", "coordinates": [
+            [[minx, miny], [minx, maxy], [maxx, maxy], [maxx, miny], [minx, miny]]]}, 15)
+        query = select([func.count()],
+                       functions._bbox_intersects(column, WKTSpatialElement(polygon, column.type.srid)),
+                       from_obj=[column.table])
+        return session.execute(query).fetchone()[0]
+    
+    def reflect_geometry_columns(self, bind, schema=None):
+        """Returns the geometry columns of all tables in ``schema`` (the default
+        schema if None) as ``(table name, column name, geometry type name,
+        dimension, srid, spatial index)`` tuples, read from the catalog of the
+        spatial database with a single query. The srid is None if the database
+        does not store it per column.
+        
+        """
+        raise NotImplementedError("Reflection of geometry columns is not supported by %s"
+                                  % self.__class__.__name__)
+    
     def handle_ddl_before_drop(self, bind, table, column):
         """This method is called after the mapped table was deleted from the database
         by SQLAlchemy. It can be used to delete the geometry column.
@@ -221,6 +221,45 @@ def check_comparison(function, within_column_clause, returns_boolean, compare_va
 class functions:
     """Functions that implement OGC SFS or SQL/MM and that are supported by most databases
     """
+
+    @staticmethod
+    def evaluate_many(session, elements, function_class, *arguments, **kwargs):
+        """Evaluates a function (e.g. ``functions.area``) for many geometries with a 
+        single query, instead of one query per geometry::
+        
+            areas = functions.evaluate_many(session, [l.lake_geom for l in lakes], functions.area)
+            
+        `elements` may contain geometries loaded from the database, WKT/WKB elements or 
+        WKT strings. Further `arguments` are passed to every function call, e.g. 
+        ``functions.evaluate_many(session, roads, functions.point_n, 2)``. The results are 
+        returned in the order of `elements`, ``None`` for ``None``.
+        
+        The keyword argument `batch_size` limits the number of geometries per query. 
+        PostGIS sends all geometries in one query by default, the other databases 
+        send a query per 250 geometries, see :meth:`SpatialDialect.evaluate_many`.
+        
+        """
+        from geoalchemy.base import SpatialElement, WKTSpatialElement
+        from geoalchemy.dialect import DialectManager
+        
+        geometries = []
+        for element in elements:
+            if isinstance(element, basestring) and WKT_REGEX.match(element):
+                element = WKTSpatialElement(element)
+            elif isinstance(element, SpatialElement) and isinstance(element.desc, SpatialElement):
+                # geometries loaded from the database
+                element = element.desc
+            geometries.append(element)
+        
+        values = [geometry for geometry in geometries if geometry is not None]
+        results = []
+        if values:
+            database_dialect = DialectManager.get_spatial_dialect(session.get_bind(None).dialect)
+            results = database_dialect.evaluate_many(session, function_class, values, arguments,
+                                                     **kwargs)
+        
+        results = iter(results)
+        return [None if geometry is None else results.next() for geometry in geometries]
     
     class wkt(BaseFunction):
         """AsText(g)"""
@@ -307,6 +346,24 @@ class functions:
         """Envelope(g)"""
         pass
     
+    class simplify(ReturnsGeometryFunction):
+        """Simplify(g, tolerance)
+        
+        Simplifies the geometry with the Douglas-Peucker algorithm. PostGIS 
+        uses ST_SimplifyPreserveTopology, which does not create invalid 
+        geometries.
+        
+        *Not supported in MySQL.*
+        """
+        pass
+    
+    class snap_to_grid(ReturnsGeometryFunction):
+        """SnapToGrid(g, size)
+        
+        *Only supported in PostgreSQL/PostGIS and SpatiaLite.*
+        """
+        pass
+    
     class start_point(ReturnsGeometryFunction):
         """StartPoint(g)"""
         pass
@@ -371,6 +428,21 @@ class functions:
         """Intersection(g1, g2)"""
         pass
 
+    class _from_ewkt(BaseFunction):
+        """GeomFromEWKT(ewkt): used for WKTSpatialElement values with an
+           embedded SRID, for dialects that support EWKT."""
+        pass
+
+    class _from_ewkb(BaseFunction):
+        """GeomFromEWKB(ewkb): used for WKBSpatialElement values with an
+           embedded SRID, for dialects that support EWKB."""
+        pass
+
+    class _from_wkb(BaseFunction):
+        """GeomFromWKB(wkb, srid): used for WKB values that are passed as
+           bind parameters, e.g. in bulk inserts."""
+        pass
+
     class _within_distance(BaseFunction):
         """A specific DWithin(g1, g2, d) implementation, for dialects
            that either don't support DWithin (MySQL, Spatialite), or
@@ -378,6 +450,34 @@ class functions:
            implementations (Oracle)."""
         pass
     
+    class _bbox_intersects(BaseFunction):
+        """Tests if the bounding boxes of g1 and g2 intersect, using the 
+           spatial index of the database (e.g. g1 && g2 in PostGIS)."""
+        pass
+    
+    class _knn_distance(BaseFunction):
+        """The distance between g1 and g2 to order by in nearest neighbour
+           queries, in a form that can use the spatial index of the database
+           (e.g. g1 <-> g2 in PostGIS 2)."""
+        pass
+    
+    class _knn_filter(BaseFunction):
+        """The condition of a nearest neighbour query for the k geometries
+           nearest to g2 (e.g. SDO_NN in Oracle, g1 IS NOT NULL for the other
+           databases). k is None if the query has other conditions, which
+           the database applies after the nearest neighbour search."""
+        pass
+    
+    class _xmin(BaseFunction):
+        """The minimum x coordinate of the bounding box of g (MbrMinX(g) in
+           Spatialite)."""
+        pass
+    
+    class _ymin(BaseFunction):
+        """The minimum y coordinate of the bounding box of g (MbrMinY(g) in
+           Spatialite)."""
+        pass
+    
     class union(ReturnsGeometryFunction):
         """Union(geometry set)
 
@@ -426,6 +526,40 @@ def __compile__within_distance(element, compiler, **kw):
                  parse_clause(arguments.pop(0), compiler),
                  arguments.pop(0), *arguments))
 
+@compiles(functions._bbox_intersects)
+def __compile__bbox_intersects(element, compiler, **kw):
+    from geoalchemy.dialect import DialectManager 
+    database_dialect = DialectManager.get_spatial_dialect(compiler.dialect)
+    function = database_dialect.get_function(functions._bbox_intersects)
+    arguments = list(element.arguments)
+    return compiler.process(
+        function(compiler,
+                 parse_clause(arguments.pop(0), compiler),
+                 parse_clause(arguments.pop(0), compiler)))
+
+@compiles(functions._knn_distance)
+def __compile__knn_distance(element, compiler, **kw):
+    from geoalchemy.dialect import DialectManager 
+    database_dialect = DialectManager.get_spatial_dialect(compiler.dialect)
+    function = database_dialect.get_function(functions._knn_distance)
+    arguments = list(element.arguments)
+    return compiler.process(
+        function(compiler,
+                 parse_clause(arguments.pop(0), compiler),
+                 parse_clause(arguments.pop(0), compiler)))
+
+@compiles(functions._knn_filter)
+def __compile__knn_filter(element, compiler, **kw):
+    from geoalchemy.dialect import DialectManager 
+    database_dialect = DialectManager.get_spatial_dialect(compiler.dialect)
+    function = database_dialect.get_function(functions._knn_filter)
+    arguments = list(element.arguments)
+    return compiler.process(
+        function(compiler,
+                 parse_clause(arguments.pop(0), compiler),
+                 parse_clause(arguments.pop(0), compiler),
+                 arguments.pop(0)))
+
 class _WKBType(TypeDecorator):
     """A helper type which makes sure that the WKB sequence returned from queries like 
     'session.scalar(r.road_geom.wkb)', has the same type as the attribute 'geom_wkb' which
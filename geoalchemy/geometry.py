@@ -1,16 +1,30 @@
 import warnings
+from copy import copy
+from weakref import WeakKeyDictionary
 
-from sqlalchemy import Column, Table, exc
-from sqlalchemy.orm import column_property
-from sqlalchemy.orm.interfaces import AttributeExtension
+from sqlalchemy import Column, Table, exc, select, type_coerce
+from sqlalchemy.orm import column_property, attributes
+from sqlalchemy.orm.interfaces import AttributeExtension, StrategizedOption
+from sqlalchemy.orm.session import _state_session
+from sqlalchemy.orm.strategies import ColumnLoader, DeferredColumnLoader
 from sqlalchemy.sql.expression import Alias
 from sqlalchemy.sql import expression
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.dialects.postgresql.base import PGDialect
 
-from geoalchemy.base import GeometryBase, _to_gis, SpatialComparator
+from geoalchemy.base import GeometryBase, _to_gis, SpatialComparator, WKBSpatialElement, \
+    WKTSpatialElement
 from geoalchemy.dialect import DialectManager
-from geoalchemy.functions import functions
+from geoalchemy.functions import functions, BaseFunction
+from geoalchemy.utils import from_wkb, to_wkb, round_coordinates, element_geometry
+
+try:
+    # SQLAlchemy 0.7
+    from sqlalchemy.orm.interfaces import _reduce_path
+except ImportError:
+    # the loader strategies of SQLAlchemy 0.6 and 0.8 take other arguments,
+    # the query options simplify() and quantize() are not supported
+    _reduce_path = None
 
 class Geometry(GeometryBase):
     """Geometry column type. This is the base class for all other
@@ -22,9 +36,16 @@ class Geometry(GeometryBase):
     """
     
     def result_processor(self, dialect, coltype=None):
+        # databases that can not snap to a grid, return the full precision
+        round_result = self.precision is not None and not _supports_snap_to_grid(dialect)
+        
         def process(value):
             if value is not None:
-                return DialectManager.get_spatial_dialect(dialect).process_result(value, self)
+                element = DialectManager.get_spatial_dialect(dialect).process_result(value, self)
+                if round_result and isinstance(element.desc, WKBSpatialElement):
+                    geom = round_coordinates(from_wkb(element.desc.geom_wkb), self.precision)
+                    element.desc.desc = buffer(to_wkb(geom))
+                return element
             else:
                 return value
         return process
@@ -56,6 +77,18 @@ class MultiPolygon(Geometry):
 class GeometryCollection(Geometry):
     name = 'GEOMETRYCOLLECTION'
 
+@compiles(Geometry)
+def __compile_geometry_type(element, compiler, **kw):
+    return element.get_col_spec()
+
+@compiles(Geometry, 'postgresql')
+def __compile_postgis_geometry_type(element, compiler, **kw):
+    """PostGIS 2 type modifiers, e.g. ``geometry(POINTZ,4326)``."""
+    name = element.name + {3: 'Z', 4: 'ZM'}.get(element.dimension, '')
+    if element.srid is None:
+        return 'geometry(%s)' % name
+    return 'geometry(%s,%d)' % (name, element.srid)
+
 class GeometryDDL(object):
     """A DDL extension which integrates SQLAlchemy table create/drop 
     methods with AddGeometryColumn/DropGeometryColumn functions of
@@ -69,6 +102,14 @@ class GeometryDDL(object):
 
         sometable.create()
     
+    With PostGIS 2 the geometry columns are part of the ``CREATE TABLE``
+    statement (e.g. ``geometry(POINT,4326)``), and the spatial indexes are
+    created afterwards, see :meth:`SpatialDialect.inline_geometry_columns`.
+    
+    If ``deferred_indexes`` (a :class:`DeferredSpatialIndexes`) is given, the
+    spatial indexes are not created with the table, but added to
+    ``deferred_indexes``.
+    
     """
 
     try:
@@ -82,7 +123,8 @@ class GeometryDDL(object):
         use_event = True
         columns_attribute = 'columns'
     
-    def __init__(self, table):
+    def __init__(self, table, deferred_indexes=None):
+        self.deferred_indexes = deferred_indexes
         if self.use_event:
             self._event.listen(table, 'before_create', self.before_create)
             self._event.listen(table, 'before_drop', self.before_drop)
@@ -96,6 +138,17 @@ class GeometryDDL(object):
         
     def __call__(self, event, table, bind):
         spatial_dialect = DialectManager.get_spatial_dialect(bind.dialect)
+        inline = spatial_dialect.inline_geometry_columns(bind)
+        if inline:
+            if event == 'after-create':
+                gis_cols = [c for c in table.c if isinstance(c.type, Geometry)]
+                if self.deferred_indexes is None:
+                    spatial_dialect.handle_ddl_after_create_inline(bind, table, gis_cols)
+                else:
+                    self.deferred_indexes.add(table, gis_cols)
+            # the geometry columns are created and dropped with the table
+            return
+
         if event in ('before-create', 'before-drop'):
             """Remove geometry column from column list (table._columns), so that it 
             does not show up in the create statement ("create table tab (..)"). 
@@ -114,9 +167,12 @@ class GeometryDDL(object):
         elif event == 'after-create':
             setattr(table, self.columns_attribute, self._stack.pop())
             
-            for c in table.c:
-                if isinstance(c.type, Geometry):
-                    spatial_dialect.handle_ddl_after_create(bind, table, c)
+            gis_cols = [c for c in table.c if isinstance(c.type, Geometry)]
+            for c in gis_cols:
+                spatial_dialect.handle_ddl_after_create(bind, table, c,
+                                                        create_index=self.deferred_indexes is None)
+            if self.deferred_indexes is not None:
+                self.deferred_indexes.add(table, gis_cols)
 
         elif event == 'after-drop':
             setattr(table, self.columns_attribute, self._stack.pop())
@@ -134,23 +190,284 @@ class GeometryDDL(object):
         self('after-drop', target, connection)
 
 
+class DeferredSpatialIndexes(object):
+    """Collects the spatial indexes of the tables created with
+    ``GeometryDDL(table, deferred_indexes=...)`` and builds them all at once
+    after ``metadata.create_all()``, e.g. to create a schema quickly::
+    
+        indexes = DeferredSpatialIndexes(metadata, parallel=4)
+        for table in metadata.sorted_tables:
+            GeometryDDL(table, deferred_indexes=indexes)
+        
+        metadata.create_all(engine)
+    
+    SpatiaLite vacuums the database once instead of after every index. With
+    PostGIS the indexes are built by ``parallel`` connections of the engine.
+    Without ``metadata``, :meth:`build` has to be called after the tables
+    were created, e.g. after a bulk load with ``concurrently=True``.
+    
+    """
+    
+    def __init__(self, metadata=None, parallel=1):
+        self.parallel = parallel
+        self.pending = []
+        if metadata is not None:
+            if GeometryDDL.use_event:
+                GeometryDDL._event.listen(metadata, 'after_create', self.after_create)
+            else:
+                metadata.ddl_listeners['after-create'].append(self)
+    
+    def add(self, table, columns):
+        """Adds the spatial indexes of the geometry ``columns`` of ``table``."""
+        self.pending.extend((table, c) for c in columns if c.type.spatial_index)
+    
+    def build(self, bind, concurrently=False):
+        """Builds the pending spatial indexes. ``concurrently`` is set when
+        the tables are already filled, see
+        :meth:`SpatialDialect.build_spatial_indexes`.
+        """
+        pending, self.pending = self.pending, []
+        if pending:
+            spatial_dialect = DialectManager.get_spatial_dialect(bind.dialect)
+            spatial_dialect.build_spatial_indexes(bind, pending, self.parallel, concurrently)
+    
+    def __call__(self, event, target, bind):
+        self.build(bind)
+    
+    def after_create(self, target, connection, **kw):
+        self.build(connection)
+
+
 class SpatialAttribute(AttributeExtension):
     """Intercepts 'set' events on a mapped instance attribute and 
-    converts the incoming value to a GIS expression.
+    converts the incoming value to a GIS expression. If the geometry type
+    has a `precision`, the value is snapped to its grid.
     
     """
     
     def set(self, state, value, oldvalue, initiator):
-        return _to_gis(value, self.__get_srid(initiator))
+        type_ = self.__get_type(initiator)
+        srid = getattr(type_, 'srid', None)
+        return _quantize_value(_to_gis(value, srid), getattr(type_, 'precision', None))
  
-    def __get_srid(self, initiator):
-        """Returns the SRID used for the geometry column that is connected
+    def __get_type(self, initiator):
+        """Returns the type of the geometry column that is connected
         to this SpatialAttribute instance."""
         try:
-            return initiator.parent_token.columns[0].type.srid
+            return initiator.parent_token.columns[0].type
         except Exception:
             return None
  
+class SpatialDeferredColumnLoader(DeferredColumnLoader):
+    """Loader strategy for geometry columns defined with ``deferred=True``.
+    
+    When the geometry of an instance is accessed for the first time, the 
+    geometries of all instances of the same class that were loaded into the 
+    session, and whose geometry is not loaded yet, are loaded with one query 
+    per `batch_size` instances (``SELECT pk, AsBinary(geom) FROM table WHERE 
+    pk IN (..)``), instead of one query per instance.
+    
+    Classes with a composite primary key, or whose primary key is not in the 
+    table of the geometry column, are loaded instance by instance.
+    
+    """
+    
+    batch_size = 500
+    
+    def __init__(self, *args, **kwargs):
+        DeferredColumnLoader.__init__(self, *args, **kwargs)
+        # {session: {state: True}}, the loaded instances without geometry
+        self.__pending = WeakKeyDictionary()
+    
+    def create_row_processor(self, context, *args):
+        processors = DeferredColumnLoader.create_row_processor(self, context, *args)
+        new_execute = processors[0]
+        key = self.key
+        pending = self.__pending.setdefault(context.session, WeakKeyDictionary())
+        
+        def remember_pending(state, dict_, row):
+            new_execute(state, dict_, row)
+            if key not in dict_:
+                pending[state] = True
+        return (remember_pending, ) + tuple(processors[1:])
+    
+    def _load_for_state(self, state, passive):
+        if not state.key:
+            return attributes.ATTR_EMPTY
+        
+        if not _sql_ok(passive):
+            return attributes.PASSIVE_NO_RESULT
+        
+        mapper = state.manager.mapper
+        session = _state_session(state)
+        column = self.columns[0]
+        if session is None or self.group or len(mapper.primary_key) != 1 or \
+                mapper.primary_key[0].table is not column.table:
+            return DeferredColumnLoader._load_for_state(self, state, passive)
+        
+        key = self.key
+        pk = mapper.primary_key[0]
+        pending = self.__pending.get(session, {})
+        states = [state]
+        for s in pending.keys():
+            del pending[s]
+            if s is not state and s.key is not None and s.obj() is not None and \
+                    s.manager.mapper is mapper and \
+                    key not in s.dict and _state_session(s) is session:
+                states.append(s)
+        
+        for i in xrange(0, len(states), self.batch_size):
+            batch = dict((s.key[1][0], s) for s in states[i:i + self.batch_size])
+            query = select([pk, column], pk.in_(batch.keys()), use_labels=True)
+            for (identity, geometry) in session.execute(query, mapper=mapper):
+                attributes.set_committed_value(batch[identity].obj(), key, geometry)
+        
+        if key not in state.dict:
+            return DeferredColumnLoader._load_for_state(self, state, passive)
+        return attributes.ATTR_WAS_SET
+
+def _sql_ok(passive):
+    """Returns True if the attribute may be loaded with a query."""
+    if hasattr(attributes, 'SQL_OK'):
+        # SQLAlchemy 0.8 passes flags
+        return bool(passive & attributes.SQL_OK)
+    return passive is not attributes.PASSIVE_NO_FETCH
+
+
+def _supports_snap_to_grid(dialect):
+    try:
+        return DialectManager.get_spatial_dialect(dialect).get_function(functions.snap_to_grid) is not None
+    except NotImplementedError:
+        return False
+
+def _snap_to_grid(geometry, precision, dialect):
+    """Snaps the geometry to a grid of `precision` decimal digits, if the
+    database supports it."""
+    if precision is not None and _supports_snap_to_grid(dialect):
+        return functions.snap_to_grid(geometry, 10 ** -precision)
+    return geometry
+
+class _QuantizedGeometry(BaseFunction):
+    """_QuantizedGeometry(g, precision): `g` snapped to a grid for databases
+    that support it, otherwise `g`."""
+    pass
+
+@compiles(_QuantizedGeometry)
+def __compile_quantized_geometry(element, compiler, **kw):
+    geometry, precision = element.arguments
+    return compiler.process(_snap_to_grid(geometry, precision, compiler.dialect))
+
+def _quantize_value(value, precision):
+    """Snaps a geometry value, which is assigned to a mapped attribute, to a 
+    grid of `precision` decimal digits. WKT and WKB values are rounded in 
+    Python, other SQL expressions (e.g. a transformed geometry) are snapped 
+    by the database if it supports ``SnapToGrid``."""
+    if precision is None or value is None:
+        return value
+    if isinstance(value, (WKTSpatialElement, WKBSpatialElement)):
+        geom = round_coordinates(element_geometry(value), precision)
+        return WKBSpatialElement(buffer(to_wkb(geom)), value.srid, value.geometry_type)
+    if isinstance(value, expression.ClauseElement):
+        return _QuantizedGeometry(value, precision)
+    return value
+
+
+class SpatialColumnLoader(ColumnLoader):
+    """Loader strategy used by the :func:`simplify` and :func:`quantize` query
+    options, selects e.g. ``AsBinary(Simplify(column, tolerance))`` instead 
+    of ``AsBinary(column)``.
+    
+    """
+    
+    def setup_query(self, context, entity, path, reduced_path, adapter, 
+                    column_collection, **kwargs):
+        path = reduced_path + (self.key, )
+        column = self.columns[0]
+        if adapter:
+            column = adapter.columns[column]
+        
+        geometry = column
+        tolerance = context.attributes.get(('simplify', path))
+        if tolerance is not None:
+            geometry = functions.simplify(geometry, tolerance)
+        
+        # the geometry is always selected as WKB
+        type_ = copy(column.type)
+        type_.wkt_internal = type_.ewkb_internal = False
+        type_.precision = context.attributes.get(('quantize', path), type_.precision)
+        if type_.precision is not None:
+            geometry = _QuantizedGeometry(geometry, type_.precision)
+        
+        selected = type_coerce(functions.wkb(geometry), type_)
+        context.attributes[('selected_geometry', path)] = selected
+        column_collection.append(selected)
+    
+    def create_row_processor(self, context, path, reduced_path, mapper, row, adapter):
+        key = self.key
+        selected = context.attributes.get(('selected_geometry', reduced_path + (self.key, )))
+        if selected is not None and selected in row:
+            def fetch_col(state, dict_, row):
+                dict_[key] = row[selected]
+            return fetch_col, None, None
+        return ColumnLoader.create_row_processor(self, context, path, reduced_path, 
+                                                 mapper, row, adapter)
+
+class _SpatialColumnOption(StrategizedOption):
+    
+    def __init__(self, key, name, value):
+        super(_SpatialColumnOption, self).__init__(key)
+        self.name = name
+        self.value = value
+    
+    def process_query_property(self, query, paths, mappers):
+        super(_SpatialColumnOption, self).process_query_property(query, paths, mappers)
+        query._attributes[(self.name, _reduce_path(paths[-1]))] = self.value
+    
+    def get_strategy_class(self):
+        return SpatialColumnLoader
+
+def _spatial_column_option(key, name, value):
+    if _reduce_path is None:
+        raise NotImplementedError("The query option %s() requires SQLAlchemy 0.7" % name)
+    return _SpatialColumnOption((key, ), name, value)
+
+def simplify(key, tolerance):
+    """Query option which loads a simplified geometry (see 
+    :class:`~geoalchemy.functions.functions.simplify`), for example to send 
+    less data to map clients at low zoom levels::
+    
+        lakes = session.query(Lake).options(simplify(Lake.lake_geom, 0.01)).all()
+    
+    Note that instances which are already present in the session keep their 
+    geometry, and that the simplified geometry should not be saved back.
+    
+    The option requires SQLAlchemy 0.7, with other versions it raises
+    ``NotImplementedError``.
+    
+    """
+    return _spatial_column_option(key, 'simplify', tolerance)
+
+def quantize(key, precision):
+    """Query option which snaps the loaded geometry to a grid of `precision` 
+    decimal digits, see also the `precision` argument of :class:`Geometry`::
+    
+        lakes = session.query(Lake).options(quantize(Lake.lake_geom, 6)).all()
+    
+    PostGIS and SpatiaLite snap the geometry with ``SnapToGrid``, so that less 
+    data is transferred. For the other databases the coordinates are rounded 
+    when the geometry is loaded.
+    
+    The option only affects the loaded geometries. Geometries that are 
+    assigned to a mapped attribute are snapped to the `precision` of the 
+    geometry type (not to the precision of this option) before they are 
+    saved.
+    
+    Like :func:`simplify`, the option requires SQLAlchemy 0.7.
+    
+    """
+    return _spatial_column_option(key, 'quantize', precision)
+
+
 class GeometryExtensionColumn(Column):
     pass
         
@@ -158,13 +475,23 @@ class GeometryExtensionColumn(Column):
 def compile_column(element, compiler, **kw):
     if isinstance(element.table, (Table, Alias)):
         if kw.has_key("within_columns_clause") and kw["within_columns_clause"] == True:
+            geometry = _snap_to_grid(element, element.type.precision, compiler.dialect)
             if element.type.wkt_internal:
                 if isinstance(compiler.dialect, PGDialect):
-                    return compiler.process(functions.wkt(element))
+                    return compiler.process(functions.wkt(geometry))
                 warnings.warn("WKT Internal GeometryColumn type not "
                     "compatible with %s dialect. Defaulting back to WKB"
                     % compiler.dialect.name, exc.SAWarning)
-            return compiler.process(functions.wkb(element))
+            elif element.type.ewkb_internal:
+                if isinstance(compiler.dialect, PGDialect):
+                    # PostGIS returns the raw column as hex-encoded EWKB
+                    if geometry is element:
+                        return compiler.visit_column(element, **kw)
+                    return compiler.process(geometry)
+                warnings.warn("EWKB Internal GeometryColumn type not "
+                    "compatible with %s dialect. Defaulting back to WKB"
+                    % compiler.dialect.name, exc.SAWarning)
+            return compiler.process(functions.wkb(geometry))
         
     return compiler.visit_column(element, **kw)
      
@@ -180,12 +507,19 @@ def GeometryColumn(*args, **kw):
     This method can also be used for non-declarative mappings to 
     set the properties for a geometry column when defining the mapping.
     
+    With ``deferred=True`` the geometry is not loaded with the instance, but 
+    on first access, for all instances of the class in the session at once 
+    (see :class:`SpatialDeferredColumnLoader`). Use ``undefer()`` to load it 
+    with the query.
+    
     """
     if kw.has_key("comparator"):
         comparator = kw.pop("comparator")
     else:
         comparator = SpatialComparator
     
+    deferred = kw.pop("deferred", False)
+    
     if isinstance(args[0], GeometryExtensionColumn):
         # if used for non-declarative, use the column of the table definition
         column = args[0]
@@ -194,9 +528,13 @@ def GeometryColumn(*args, **kw):
         # if used for declarative, create a new column
         column = GeometryExtensionColumn(*args, **kw) 
     
-    return column_property(
+    prop = column_property(
         column, 
         extension=SpatialAttribute(), 
-        comparator_factory=comparator
+        comparator_factory=comparator,
+        deferred=deferred
     )
+    if deferred:
+        prop.strategy_class = SpatialDeferredColumnLoader
+    return prop
 
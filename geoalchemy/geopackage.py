@@ -0,0 +1,432 @@
+u"""
+:mod:`geoalchemy.geopackage` -- GeoPackage import and export
+============================================================
+
+`GeoPackage <http://www.geopackage.org/spec120/>`_ files are SQLite
+databases whose geometries are stored as WKB behind a small binary header
+(magic, flags, SRS id and an optional envelope). This module reads and writes
+GeoPackage feature tables with Python's ``sqlite3`` module, the header is
+encoded and decoded in Python (:func:`to_gpkg`, :func:`from_gpkg`).
+
+Features of a mapped class are written with :func:`write_features`, which
+streams the rows of the database in batches, and read with
+:func:`read_features` or imported into a mapped class with
+:func:`import_features`::
+
+    >>> from geoalchemy import geopackage
+    >>> geopackage.write_features(session, Lake.lake_geom, 'lakes.gpkg',
+    ...                           properties=[Lake.lake_name])
+    >>> geopackage.import_features(session, 'lakes.gpkg', Lake.lake_geom,
+    ...                            bbox=(-89, 42, -88, 43))
+
+The R-tree spatial index extension (``rtree_<table>_<column>``) is filled in
+bulk from the envelopes of the geometry headers after the features have been
+written, see :func:`build_rtree`; it is used to filter features by bounding
+box when reading. The triggers of the extension, which keep the index up to
+date when the table is changed later, are created as well. They call the
+``ST_*`` functions defined by the GeoPackage specification (e.g. provided by
+SpatiaLite or GDAL), they are not needed by this module.
+
+Spatial reference systems other than EPSG:4326 are registered with the
+definition ``undefined``.
+"""
+import sqlite3
+import struct
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import select, Integer, Float, Numeric, Boolean, Date, DateTime
+from sqlalchemy.orm import object_mapper
+
+from geoalchemy.base import WKBSpatialElement
+from geoalchemy.functions import functions
+from geoalchemy.utils import wkb_bounds
+
+_MAGIC = 'GP'
+_LITTLE_ENDIAN = 0x01
+_EMPTY = 0x10
+# number of doubles of the envelope for the envelope contents indicator
+_ENVELOPE_SIZES = {0: 0, 1: 4, 2: 6, 3: 6, 4: 8}
+
+_APPLICATION_ID = 0x47504B47
+_USER_VERSION = 10200
+
+_WGS84 = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+          'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+          'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,'
+          'AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]')
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, "
+    "srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL, "
+    "organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)",
+    "CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, "
+    "data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', "
+    "last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+    "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, "
+    "CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))",
+    "CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, "
+    "column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, "
+    "z TINYINT NOT NULL, m TINYINT NOT NULL, "
+    "CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), "
+    "CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), "
+    "CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))",
+    "CREATE TABLE IF NOT EXISTS gpkg_extensions (table_name TEXT, column_name TEXT, "
+    "extension_name TEXT NOT NULL, definition TEXT NOT NULL, scope TEXT NOT NULL, "
+    "CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))",
+    "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('Undefined cartesian SRS', -1, 'NONE', "
+    "-1, 'undefined', 'undefined cartesian coordinate reference system')",
+    "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('Undefined geographic SRS', 0, 'NONE', "
+    "0, 'undefined', 'undefined geographic coordinate reference system')",
+    "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES ('WGS 84 geodetic', 4326, 'EPSG', 4326, "
+    "'%s', 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid')" % _WGS84
+]
+
+# (name suffix, definition) of the triggers of the R-tree extension, {t},
+# {c}, {i} and {r} are the quoted names of the table, the geometry column,
+# the id column and the R-tree
+_RTREE_TRIGGERS = [
+    ("insert", "AFTER INSERT ON {t} "
+     "WHEN (new.{c} NOT NULL AND NOT ST_IsEmpty(NEW.{c})) BEGIN "
+     "INSERT OR REPLACE INTO {r} VALUES (NEW.{i}, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), "
+     "ST_MinY(NEW.{c}), ST_MaxY(NEW.{c})); END"),
+    ("update1", "AFTER UPDATE OF {c} ON {t} "
+     "WHEN OLD.{i} = NEW.{i} AND (NEW.{c} NOTNULL AND NOT ST_IsEmpty(NEW.{c})) BEGIN "
+     "INSERT OR REPLACE INTO {r} VALUES (NEW.{i}, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), "
+     "ST_MinY(NEW.{c}), ST_MaxY(NEW.{c})); END"),
+    ("update2", "AFTER UPDATE OF {c} ON {t} "
+     "WHEN OLD.{i} = NEW.{i} AND (NEW.{c} ISNULL OR ST_IsEmpty(NEW.{c})) BEGIN "
+     "DELETE FROM {r} WHERE id = OLD.{i}; END"),
+    ("update3", "AFTER UPDATE ON {t} "
+     "WHEN OLD.{i} != NEW.{i} AND (NEW.{c} NOTNULL AND NOT ST_IsEmpty(NEW.{c})) BEGIN "
+     "DELETE FROM {r} WHERE id = OLD.{i}; "
+     "INSERT OR REPLACE INTO {r} VALUES (NEW.{i}, ST_MinX(NEW.{c}), ST_MaxX(NEW.{c}), "
+     "ST_MinY(NEW.{c}), ST_MaxY(NEW.{c})); END"),
+    ("update4", "AFTER UPDATE ON {t} "
+     "WHEN OLD.{i} != NEW.{i} AND (NEW.{c} ISNULL OR ST_IsEmpty(NEW.{c})) BEGIN "
+     "DELETE FROM {r} WHERE id IN (OLD.{i}, NEW.{i}); END"),
+    ("delete", "AFTER DELETE ON {t} "
+     "WHEN old.{c} NOT NULL BEGIN "
+     "DELETE FROM {r} WHERE id = OLD.{i}; END")
+]
+
+
+# GeoPackage binary header
+
+def to_gpkg(wkb, srs_id=0, envelope=True):
+    """Returns the GeoPackage geometry blob of a WKB value. If ``envelope`` is
+    set, the bounding box of the geometry is written into the header.
+    """
+    wkb = str(wkb)
+    bounds = wkb_bounds(wkb)
+    flags = _LITTLE_ENDIAN
+    if bounds is None:
+        flags |= _EMPTY
+        header = struct.pack('<2sBBi', _MAGIC, 0, flags, srs_id)
+    elif envelope:
+        flags |= 1 << 1
+        minx, miny, maxx, maxy = bounds
+        header = struct.pack('<2sBBi4d', _MAGIC, 0, flags, srs_id, minx, maxx, miny, maxy)
+    else:
+        header = struct.pack('<2sBBi', _MAGIC, 0, flags, srs_id)
+    return header + wkb
+
+def _read_header(data):
+    """Returns ``(srs_id, envelope, empty, size)`` of the header of a
+    GeoPackage geometry blob, where ``envelope`` is ``(minx, maxx, miny,
+    maxy, ..)`` or ``None``.
+    """
+    if data[:2] != _MAGIC:
+        raise Exception("Not a GeoPackage geometry: invalid magic number %r" % data[:2])
+    flags = ord(data[3])
+    byte_order = '<' if flags & _LITTLE_ENDIAN else '>'
+    indicator = (flags >> 1) & 0x07
+    if indicator not in _ENVELOPE_SIZES:
+        raise Exception("Invalid envelope contents indicator %d" % indicator)
+    count = _ENVELOPE_SIZES[indicator]
+    srs_id = struct.unpack(byte_order + 'i', data[4:8])[0]
+    envelope = None
+    if count:
+        envelope = struct.unpack(byte_order + '%dd' % count, data[8:8 + 8 * count])
+    return srs_id, envelope, bool(flags & _EMPTY), 8 + 8 * count
+
+def from_gpkg(data):
+    """Returns ``(wkb, srs_id)`` of a GeoPackage geometry blob."""
+    data = str(data)
+    srs_id, envelope, empty, size = _read_header(data)
+    return data[size:], srs_id
+
+def gpkg_bounds(data):
+    """Returns the bounding box ``(minx, miny, maxx, maxy)`` of a GeoPackage
+    geometry blob, read from the header if it contains an envelope (otherwise
+    computed from the WKB), or ``None`` for empty geometries.
+    """
+    data = str(data)
+    srs_id, envelope, empty, size = _read_header(data)
+    if empty:
+        return None
+    if envelope is not None:
+        return envelope[0], envelope[2], envelope[1], envelope[3]
+    return wkb_bounds(data[size:])
+
+
+# GeoPackage files
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+def _connect(path):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("PRAGMA application_id = %d" % _APPLICATION_ID)
+        connection.execute("PRAGMA user_version = %d" % _USER_VERSION)
+        for statement in _SCHEMA:
+            connection.execute(statement)
+    return connection
+
+def _column_type(column):
+    """Returns the GeoPackage data type of a column."""
+    if hasattr(column, '__clause_element__'):
+        column = column.__clause_element__()
+    type_ = column.type
+    if isinstance(type_, Boolean):
+        return 'BOOLEAN'
+    if isinstance(type_, Integer):
+        return 'INTEGER'
+    if isinstance(type_, (Float, Numeric)):
+        return 'DOUBLE'
+    if isinstance(type_, DateTime):
+        return 'DATETIME'
+    if isinstance(type_, Date):
+        return 'DATE'
+    return 'TEXT'
+
+def _value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+def _geometry_column(column):
+    """Returns the mapped class, the attribute key and the table column of a
+    mapped geometry attribute.
+    """
+    return column.class_, column.key, column.property.columns[0]
+
+def build_rtree(connection, table, column, id_column='fid'):
+    """(Re)builds the R-tree spatial index ``rtree_<table>_<column>`` of a
+    feature table of an open GeoPackage (``sqlite3``) connection in bulk,
+    from the envelopes in the geometry headers, and registers the
+    ``gpkg_rtree_index`` extension and its triggers.
+    """
+    rtree = 'rtree_%s_%s' % (table, column)
+    exists = connection.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (rtree, )).fetchone()
+    if exists:
+        connection.execute("DELETE FROM %s" % _quote(rtree))
+    else:
+        connection.execute("CREATE VIRTUAL TABLE %s USING rtree(id, minx, maxx, miny, maxy)"
+                           % _quote(rtree))
+        for (suffix, trigger) in _RTREE_TRIGGERS:
+            connection.execute("CREATE TRIGGER %s %s" % (
+                _quote('%s_%s' % (rtree, suffix)),
+                trigger.format(t=_quote(table), c=_quote(column), i=_quote(id_column), r=_quote(rtree))))
+        connection.execute("INSERT OR REPLACE INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)",
+                           (table, column, 'gpkg_rtree_index',
+                            'http://www.geopackage.org/spec120/#extension_rtree', 'write-only'))
+
+    def entries():
+        for (fid, data) in connection.execute("SELECT %s, %s FROM %s WHERE %s IS NOT NULL"
+                                              % (_quote(id_column), _quote(column), _quote(table),
+                                                 _quote(column))):
+            bounds = gpkg_bounds(data)
+            if bounds is not None:
+                yield fid, bounds[0], bounds[2], bounds[1], bounds[3]
+
+    connection.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?)" % _quote(rtree), entries())
+
+def write_features(session, column, path, properties=(), table=None, batch_size=1000):
+    """Writes the rows of the mapped class of the geometry attribute ``column``
+    (e.g. ``Lake.lake_geom``) as feature table ``table`` (by default the table
+    name) into the GeoPackage ``path``, which is created if it does not exist.
+    An existing feature table of the same name is replaced.
+
+    ``properties`` are the further columns that are written. The primary key of
+    the class is used as feature id if it is a single integer column. The rows
+    are fetched in batches of ``batch_size`` rows. Returns the number of
+    written features.
+    """
+    class_, key, geometry_column = _geometry_column(column)
+    srid = geometry_column.type.srid
+    table = table or geometry_column.table.name
+    geometry_name = geometry_column.name
+    properties = [p.__clause_element__() if hasattr(p, '__clause_element__') else p
+                  for p in properties]
+
+    primary_key = list(geometry_column.table.primary_key.columns)
+    if len(primary_key) == 1 and isinstance(primary_key[0].type, Integer):
+        fid = primary_key[0]
+    else:
+        fid = None
+
+    names = [p.key for p in properties]
+    columns = ['fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL', '%s %s' % (_quote(geometry_name),
+                                                                         geometry_column.type.name)]
+    columns.extend('%s %s' % (_quote(name), _column_type(p)) for (name, p) in zip(names, properties))
+    insert = "INSERT INTO %s (%s) VALUES (%s)" % (
+        _quote(table), ", ".join(_quote(name) for name in ['fid', geometry_name] + names),
+        ", ".join('?' * (len(names) + 2)))
+
+    query = select(([fid] if fid is not None else []) + [functions.wkb(geometry_column)] + properties)
+    connection = _connect(path)
+    try:
+        with connection:
+            connection.execute("DROP TABLE IF EXISTS %s" % _quote(table))
+            connection.execute("DROP TABLE IF EXISTS %s" % _quote('rtree_%s_%s' % (table, geometry_name)))
+            connection.execute("DELETE FROM gpkg_extensions WHERE table_name = ?", (table, ))
+            connection.execute("DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (table, ))
+            connection.execute("DELETE FROM gpkg_contents WHERE table_name = ?", (table, ))
+            if srid not in (-1, 0, 4326):
+                connection.execute("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES "
+                                   "(?, ?, 'EPSG', ?, 'undefined', NULL)", ('EPSG:%d' % srid, srid, srid))
+            connection.execute("CREATE TABLE %s (%s)" % (_quote(table), ", ".join(columns)))
+
+            count = 0
+            extent = None
+            result = session.execute(query)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                values = []
+                for row in rows:
+                    row = list(row)
+                    feature_id = row.pop(0) if fid is not None else None
+                    wkb = row.pop(0)
+                    data = None
+                    if wkb is not None:
+                        data = to_gpkg(wkb, srid)
+                        bounds = gpkg_bounds(data)
+                        if bounds is not None:
+                            if extent is None:
+                                extent = bounds
+                            else:
+                                extent = (min(extent[0], bounds[0]), min(extent[1], bounds[1]),
+                                          max(extent[2], bounds[2]), max(extent[3], bounds[3]))
+                        data = sqlite3.Binary(data)
+                    values.append([feature_id, data] + [_value(v) for v in row])
+                connection.executemany(insert, values)
+                count += len(values)
+
+            connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, "
+                               "min_x, min_y, max_x, max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, ?)",
+                               (table, table) + tuple(extent or (None, ) * 4) + (srid, ))
+            connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, 0)",
+                               (table, geometry_name, geometry_column.type.name, srid,
+                                int(geometry_column.type.dimension > 2)))
+            build_rtree(connection, table, geometry_name)
+        return count
+    finally:
+        connection.close()
+
+def _feature_table(connection, table):
+    """Returns the table name, geometry column name and SRS id of a feature
+    table, by default of the first feature table.
+    """
+    query = ("SELECT g.table_name, g.column_name, g.srs_id FROM gpkg_geometry_columns g "
+             "JOIN gpkg_contents c ON c.table_name = g.table_name WHERE c.data_type = 'features'")
+    if table is not None:
+        row = connection.execute(query + " AND g.table_name = ?", (table, )).fetchone()
+    else:
+        row = connection.execute(query + " ORDER BY g.table_name").fetchone()
+    if row is None:
+        raise Exception("No feature table %s in the GeoPackage" % (table or ''))
+    return row
+
+def read_features(path, table=None, bbox=None):
+    """Yields the features of the feature table ``table`` (by default the first
+    feature table) of the GeoPackage ``path`` as ``(fid, properties, wkb,
+    srs_id)`` tuples, where ``properties`` is a dictionary of the further
+    columns and ``wkb`` is ``None`` for features without geometry.
+
+    If ``bbox`` (``(minx, miny, maxx, maxy)``) is given, only features whose
+    bounding box intersects ``bbox`` are returned, using the R-tree index if
+    the table has one, otherwise the envelopes of the geometry headers.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        table, column, srs_id = _feature_table(connection, table)
+        rtree = 'rtree_%s_%s' % (table, column)
+        use_rtree = bbox is not None and connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (rtree, )).fetchone() is not None
+
+        cursor = connection.execute("SELECT * FROM %s LIMIT 0" % _quote(table))
+        names = [d[0] for d in cursor.description]
+        id_column = names[0]
+        for name in names:
+            if name.lower() == 'fid':
+                id_column = name
+        query = "SELECT * FROM %s" % _quote(table)
+        parameters = ()
+        if use_rtree:
+            query += (" WHERE %s IN (SELECT id FROM %s WHERE maxx >= ? AND minx <= ? "
+                      "AND maxy >= ? AND miny <= ?)" % (_quote(id_column), _quote(rtree)))
+            parameters = (bbox[0], bbox[2], bbox[1], bbox[3])
+
+        for row in connection.execute(query, parameters):
+            row = dict(zip(names, row))
+            fid = row.pop(id_column)
+            data = row.pop(column)
+            wkb = None
+            feature_srs_id = srs_id
+            if data is not None:
+                if bbox is not None and not use_rtree:
+                    bounds = gpkg_bounds(data)
+                    if bounds is None or bounds[2] < bbox[0] or bounds[0] > bbox[2] or \
+                            bounds[3] < bbox[1] or bounds[1] > bbox[3]:
+                        continue
+                wkb, feature_srs_id = from_gpkg(data)
+            elif bbox is not None:
+                continue
+            yield fid, row, wkb, feature_srs_id
+    finally:
+        connection.close()
+
+def import_features(session, path, column, table=None, bbox=None, batch_size=1000):
+    """Imports the features of a GeoPackage feature table (see
+    :func:`read_features`) as instances of the mapped class of the geometry
+    attribute ``column``. Columns of the feature table are assigned to the
+    attributes of the same name, others are ignored. The instances are added
+    to ``session`` and flushed (and expunged) in batches of ``batch_size``.
+    Returns the number of imported features.
+    """
+    class_, key, geometry_column = _geometry_column(column)
+    mapper = None
+    batch = []
+    count = 0
+    for fid, properties, wkb, srs_id in read_features(path, table, bbox):
+        instance = class_()
+        if mapper is None:
+            mapper = object_mapper(instance)
+        for name, value in properties.iteritems():
+            if name != key and mapper.has_property(name):
+                setattr(instance, name, value)
+        if wkb is not None:
+            if srs_id <= 0:
+                srs_id = geometry_column.type.srid
+            setattr(instance, key, WKBSpatialElement(buffer(wkb), srs_id))
+        session.add(instance)
+        batch.append(instance)
+        if len(batch) >= batch_size:
+            count += _flush(session, batch)
+    if batch:
+        count += _flush(session, batch)
+    return count
+
+def _flush(session, batch):
+    session.flush()
+    count = len(batch)
+    for instance in batch:
+        session.expunge(instance)
+    del batch[:]
+    return count
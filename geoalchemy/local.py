@@ -0,0 +1,244 @@
+u"""
+:mod:`geoalchemy.local` -- Local evaluation of spatial functions
+================================================================
+
+Spatial functions called on geometries whose value is known in Python
+(:class:`~geoalchemy.base.WKTSpatialElement`,
+:class:`~geoalchemy.base.WKBSpatialElement` and geometries loaded from the
+database) can be evaluated without a query to the database. This is opt-in:
+use :func:`scalar` instead of ``session.scalar``::
+
+    >>> from geoalchemy import local
+    >>> local.scalar(session, WKTSpatialElement('POINT(1 2)').x)
+    1.0
+    >>> local.scalar(session, lake.lake_geom.centroid.x)
+    -88.7562431711851
+
+Functions that are not supported locally, or that are called with arguments
+that are only known to the database (columns, subqueries), are sent to the
+database with ``session.scalar``.
+
+The following functions are supported: ``x``, ``y``, ``area``, ``length``,
+``centroid``, ``envelope``, ``num_points``, ``point_n``, ``start_point``,
+``end_point``, ``dimension``, ``is_closed`` and ``geometry_type``. Note that
+the results may differ from the results of the database:
+
+* All computations are planar, in the units of the coordinate system of the
+  geometry. Databases that compute lengths and areas on the spheroid for
+  geodetic coordinate systems (e.g. Oracle) return different values.
+* ``geometry_type`` returns the upper-case OGC name, e.g. ``'POINT'``.
+* Functions returning a geometry return a
+  :class:`~geoalchemy.base.WKBSpatialElement` instead of the database
+  specific value.
+"""
+from itertools import izip
+from math import hypot
+
+from sqlalchemy.sql.expression import ClauseElement
+
+from geoalchemy.base import SpatialElement, PersistentSpatialElement, \
+    WKTSpatialElement, WKBSpatialElement
+from geoalchemy.functions import functions, BaseFunction, \
+    ReturnsGeometryFunction, WKT_REGEX
+from geoalchemy.utils import element_geometry, geometry_bounds, geometry_components, to_wkb
+
+
+# Geometry helpers, working on GeoJSON-like geometries
+
+def _ring_area(ring):
+    """Signed area of a ring (shoelace formula)."""
+    return sum(a[0] * b[1] - b[0] * a[1] for (a, b) in izip(ring, ring[1:])) / 2.0
+
+def _line_length(line):
+    return sum(hypot(b[0] - a[0], b[1] - a[1]) for (a, b) in izip(line, line[1:]))
+
+def _x(geom):
+    if geom["type"] == "Point" and geom["coordinates"]:
+        return geom["coordinates"][0]
+    return None
+
+def _y(geom):
+    if geom["type"] == "Point" and geom["coordinates"]:
+        return geom["coordinates"][1]
+    return None
+
+def _area(geom):
+    area = 0.0
+    for (geom_type, coords) in geometry_components(geom):
+        if geom_type == "Polygon":
+            area += abs(_ring_area(coords[0])) - sum(abs(_ring_area(ring)) for ring in coords[1:])
+    return area
+
+def _length(geom):
+    return sum(_line_length(coords) for (geom_type, coords) in geometry_components(geom)
+               if geom_type == "LineString")
+
+def _centroid(geom):
+    """Centroid of the components with the highest dimension: area weighted for
+    polygons, length weighted for lines and the mean for points.
+    """
+    components = list(geometry_components(geom))
+    weight = sx = sy = 0.0
+
+    for (geom_type, coords) in components:
+        if geom_type == "Polygon":
+            for i, ring in enumerate(coords):
+                area = _ring_area(ring)
+                if area == 0:
+                    continue
+                # holes are subtracted, whatever their orientation is
+                sign = (1.0 if i == 0 else -1.0) * (1.0 if area > 0 else -1.0)
+                for (a, b) in izip(ring, ring[1:]):
+                    cross = a[0] * b[1] - b[0] * a[1]
+                    sx += sign * (a[0] + b[0]) * cross / 6.0
+                    sy += sign * (a[1] + b[1]) * cross / 6.0
+                weight += sign * area
+    if weight != 0:
+        return {"type": "Point", "coordinates": [sx / weight, sy / weight]}
+
+    for (geom_type, coords) in components:
+        if geom_type == "Polygon":
+            coords = coords[0]
+        if geom_type in ("LineString", "Polygon"):
+            for (a, b) in izip(coords, coords[1:]):
+                length = hypot(b[0] - a[0], b[1] - a[1])
+                sx += length * (a[0] + b[0]) / 2.0
+                sy += length * (a[1] + b[1]) / 2.0
+                weight += length
+    if weight != 0:
+        return {"type": "Point", "coordinates": [sx / weight, sy / weight]}
+
+    points = []
+    for (geom_type, coords) in components:
+        if geom_type == "Point":
+            points.append(coords)
+        elif geom_type == "LineString":
+            points.extend(coords)
+        else:
+            points.extend(coords[0])
+    if not points:
+        return None
+    return {"type": "Point", "coordinates": [sum(p[0] for p in points) / len(points),
+                                             sum(p[1] for p in points) / len(points)]}
+
+def _envelope(geom):
+    bounds = geometry_bounds(geom)
+    if bounds is None:
+        return None
+    minx, miny, maxx, maxy = bounds
+    if minx == maxx and miny == maxy:
+        return {"type": "Point", "coordinates": [minx, miny]}
+    if minx == maxx or miny == maxy:
+        return {"type": "LineString", "coordinates": [[minx, miny], [maxx, maxy]]}
+    return {"type": "Polygon", "coordinates": [[[minx, miny], [minx, maxy], [maxx, maxy],
+                                                [maxx, miny], [minx, miny]]]}
+
+def _num_points(geom):
+    if geom["type"] == "LineString":
+        return len(geom["coordinates"])
+    return None
+
+def _linestring_point(geom, index):
+    if geom["type"] == "LineString" and -len(geom["coordinates"]) <= index < len(geom["coordinates"]):
+        return {"type": "Point", "coordinates": geom["coordinates"][index]}
+    return None
+
+def _point_n(geom, n):
+    if n < 1:
+        return None
+    return _linestring_point(geom, n - 1)
+
+def _start_point(geom):
+    return _linestring_point(geom, 0)
+
+def _end_point(geom):
+    return _linestring_point(geom, -1)
+
+def _dimension(geom):
+    dimensions = {"Point": 0, "LineString": 1, "Polygon": 2}
+    return max([dimensions[geom_type] for (geom_type, coords) in geometry_components(geom)] or [0])
+
+def _is_closed(geom):
+    for (geom_type, coords) in geometry_components(geom):
+        if geom_type == "LineString" and coords[0][:2] != coords[-1][:2]:
+            return False
+    return True
+
+def _geometry_type(geom):
+    return geom["type"].upper()
+
+
+# function class: Python implementation, called with the geometry and the
+# further arguments of the function
+_functions = {
+              functions.x : _x,
+              functions.y : _y,
+              functions.area : _area,
+              functions.length : _length,
+              functions.centroid : _centroid,
+              functions.envelope : _envelope,
+              functions.num_points : _num_points,
+              functions.point_n : _point_n,
+              functions.start_point : _start_point,
+              functions.end_point : _end_point,
+              functions.dimension : _dimension,
+              functions.is_closed : _is_closed,
+              functions.geometry_type : _geometry_type
+             }
+
+
+def _geometry(argument):
+    """Returns the geometry and SRID of a function argument, raises
+    NotImplementedError if the geometry is not known in Python.
+    """
+    if isinstance(argument, BaseFunction):
+        if not isinstance(argument, ReturnsGeometryFunction):
+            raise NotImplementedError("'%s' does not return a geometry" % argument.__class__.__name__)
+        geom, srid = _evaluate(argument)
+        if geom is None:
+            raise NotImplementedError("'%s' returned an empty geometry" % argument.__class__.__name__)
+        return geom, srid
+
+    if isinstance(argument, basestring) and WKT_REGEX.match(argument):
+        argument = WKTSpatialElement(argument)
+    if isinstance(argument, PersistentSpatialElement):
+        argument = argument.desc
+    if isinstance(argument, (WKTSpatialElement, WKBSpatialElement)):
+        return element_geometry(argument), argument.srid
+
+    raise NotImplementedError("The geometry of %r is not known in Python" % (argument, ))
+
+def _evaluate(function):
+    try:
+        implementation = _functions[function.__class__]
+    except KeyError:
+        raise NotImplementedError("'%s' can not be evaluated locally" % function.__class__.__name__)
+
+    arguments = list(function.arguments)
+    if not arguments or [a for a in arguments[1:] if isinstance(a, (ClauseElement, SpatialElement))]:
+        raise NotImplementedError("'%s' is called with arguments that are not known in Python"
+                                  % function.__class__.__name__)
+
+    geom, srid = _geometry(arguments.pop(0))
+    return implementation(geom, *arguments), srid
+
+def evaluate(function):
+    """Evaluates a spatial function (e.g. ``functions.area(element)`` or
+    ``element.area``) in Python. Raises ``NotImplementedError`` if the function
+    or its arguments can not be evaluated locally.
+
+    """
+    value, srid = _evaluate(function)
+    if isinstance(function, ReturnsGeometryFunction) and value is not None:
+        return WKBSpatialElement(buffer(to_wkb(value)), srid)
+    return value
+
+def scalar(session, function):
+    """Evaluates a spatial function in Python if possible, otherwise the
+    function is executed with ``session.scalar(function)``.
+
+    """
+    try:
+        return evaluate(function)
+    except NotImplementedError:
+        return session.scalar(function)
@@ -3,7 +3,7 @@
 import warnings
 from sqlalchemy import func, cast, exc
 from sqlalchemy.types import VARBINARY
-from sqlalchemy.sql.expression import text
+from sqlalchemy.sql.expression import text, bindparam
 from sqlalchemy.ext.compiler import compiles
 from geoalchemy.base import WKBSpatialElement, WKTSpatialElement, PersistentSpatialElement, DBSpatialElement, SpatialComparator
 from geoalchemy.dialect import SpatialDialect
@@ -206,6 +206,7 @@ class MSSpatialDialect(SpatialDialect):
                    WKTSpatialElement: 'geometry::STGeomFromText',
                    functions.wkb: 'STAsBinary',
                    WKBSpatialElement : 'geometry::STGeomFromWKB',
+                   functions._from_wkb : 'geometry::STGeomFromWKB',
                    DBSpatialElement : CastDBSpatialElementFunction(),
                    functions.dimension : 'STDimension',
                    functions.srid : 'STSrid',
@@ -252,6 +253,22 @@ class MSSpatialDialect(SpatialDialect):
                    ms_functions.m : 'M',
                    ms_functions.make_valid : 'MakeValid',
                    ms_functions.reduce : 'Reduce',
+                   functions.simplify : 'Reduce',
+                   functions.snap_to_grid : None,
+                   functions._bbox_intersects : lambda compiler, geom1, geom2:
+                                                    ms_functions.filter(geom1, geom2),
+                   # the forms that SQL Server answers with the spatial index
+                   functions._within_distance : lambda compiler, geom1, geom2, distance, *args:
+                                                    functions.distance(geom1, geom2) <= distance,
+                   functions._knn_distance : lambda compiler, geom1, geom2:
+                                                 functions.distance(geom1, geom2),
+                   functions._knn_filter : lambda compiler, geom1, geom2, k:
+                                               functions.distance(geom1, geom2) != None,
+                   # the first point of the envelope is (minx, miny)
+                   functions._xmin : lambda params, within_column_clause:
+                                         functions.x(functions.point_n(functions.envelope(params[0]), 1)),
+                   functions._ymin : lambda params, within_column_clause:
+                                         functions.y(functions.point_n(functions.envelope(params[0]), 1)),
                    ms_functions.to_string : 'ToString',
                    ms_functions.z : 'Z'
                   }
@@ -293,6 +310,7 @@ class MSSpatialDialect(SpatialDialect):
                           ms_functions.instance_of,
                           ms_functions.make_valid,
                           ms_functions.reduce,
+                          functions.simplify,
                           ms_functions.to_string
                          )
     
@@ -310,7 +328,41 @@ class MSSpatialDialect(SpatialDialect):
     def process_result(self, value, type):
         return MSPersistentSpatialElement(WKBSpatialElement(value, type.srid))
     
-    def handle_ddl_after_create(self, bind, table, column):
+    def estimated_extent(self, session, column):
+        """Returns the bounding box of the spatial index of the column (see the
+        ``bounding_box`` argument of the geometry type), which is the extent the
+        data was expected to have.
+        """
+        sql = """SELECT TOP 1 t.bounding_box_xmin, t.bounding_box_ymin, t.bounding_box_xmax,
+                        t.bounding_box_ymax
+                 FROM sys.spatial_index_tessellations t
+                 JOIN sys.index_columns ic ON ic.object_id = t.object_id AND ic.index_id = t.index_id
+                 JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+                 WHERE t.object_id = OBJECT_ID(:table_name) AND c.name = :column_name"""
+        row = session.execute(text(sql), {'table_name': '%s.%s' % (column.table.schema or 'dbo',
+                                                                   column.table.name),
+                                          'column_name': column.name}).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return tuple(row)
+    
+    def reflect_geometry_columns(self, bind, schema=None):
+        """SQL Server stores the srid with every geometry, the srid is None
+        and the dimension 2.
+        """
+        sql = """SELECT t.name, c.name, 'GEOMETRY', 2, NULL,
+                   CASE WHEN EXISTS (SELECT 1 FROM sys.index_columns ic
+                                     JOIN sys.spatial_indexes si
+                                       ON si.object_id = ic.object_id AND si.index_id = ic.index_id
+                                     WHERE ic.object_id = c.object_id AND ic.column_id = c.column_id)
+                        THEN 1 ELSE 0 END
+                 FROM sys.columns c
+                 JOIN sys.tables t ON t.object_id = c.object_id
+                 JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+                 WHERE ty.name = 'geometry' AND SCHEMA_NAME(t.schema_id) = COALESCE(:schema, SCHEMA_NAME())"""
+        return bind.execute(text(sql, bindparams=[bindparam('schema', schema)])).fetchall()
+    
+    def handle_ddl_after_create(self, bind, table, column, create_index=True):
         nullable = "NOT NULL"
         if column.nullable:
             nullable = "NULL"
@@ -320,12 +372,38 @@ class MSSpatialDialect(SpatialDialect):
         
         if column.type.spatial_index:
             if "bounding_box" in column.type.kwargs:
-                bind.execute("CREATE SPATIAL INDEX [%s_%s] ON [%s].[%s]([%s]) WITH (BOUNDING_BOX = %s)" %
-                             (table.name, column.name, table.schema or 'dbo', table.name, column.name, column.type.kwargs["bounding_box"]))
+                if create_index:
+                    for statement in self.spatial_index_ddl(table, column):
+                        bind.execute(statement)
             else:
                 warnings.warn("No bounding_box given for '[%s].[%s].[%s]' no spatial index will be created." %
                               (table.schema or 'dbo', table.name, column.name), 
                               exc.SAWarning, stacklevel=3)
+    
+    def spatial_index_ddl(self, table, column, concurrently=False):
+        """Options of the index, besides ``bounding_box``:
+        
+        * ``mssql_tessellation``: ``'GEOMETRY_GRID'`` or ``'GEOMETRY_AUTO_GRID'``
+          (SQL Server 2012);
+        * ``mssql_grids``: the densities of the four grid levels, e.g.
+          ``('MEDIUM', 'MEDIUM', 'HIGH', 'HIGH')``;
+        * ``mssql_cells_per_object``: the maximum number of cells per object.
+        """
+        options = column.type.kwargs
+        if "bounding_box" not in options:
+            return []
+        settings = ["BOUNDING_BOX = %s" % options["bounding_box"]]
+        if options.get("mssql_grids"):
+            settings.append("GRIDS = (%s)" % ", ".join("LEVEL_%d = %s" % (i + 1, density) for 
+                                                       (i, density) in enumerate(options["mssql_grids"])))
+        if options.get("mssql_cells_per_object"):
+            settings.append("CELLS_PER_OBJECT = %d" % options["mssql_cells_per_object"])
+        using = ""
+        if options.get("mssql_tessellation"):
+            using = " USING %s" % options["mssql_tessellation"]
+        return ["CREATE SPATIAL INDEX [%s_%s] ON [%s].[%s]([%s])%s WITH (%s)" %
+                (table.name, column.name, table.schema or 'dbo', table.name, column.name, using,
+                 ", ".join(settings))]
             
     def is_member_function(self, function_class):
         return function_class in self.__member_functions
@@ -0,0 +1,512 @@
+u"""
+:mod:`geoalchemy.mvt` -- Mapbox Vector Tiles
+============================================
+
+:func:`tile` returns a `Mapbox Vector Tile
+<https://github.com/mapbox/vector-tile-spec>`_ with one layer containing the
+geometries of a geometry column that intersect the tile ``z/x/y`` of the
+Web Mercator (EPSG:3857) tile pyramid::
+
+    >>> from geoalchemy import mvt
+    >>> data = mvt.tile(session, Lake.lake_geom, 6, 16, 23,
+    ...                 properties=[Lake.lake_name])
+
+Only rows whose bounding box intersects the tile (extended by ``buffer``) are
+selected, using the spatial index of the column.
+
+With PostGIS (2.4 and newer) the tile is created by the database with
+``ST_AsMVTGeom`` and ``ST_AsMVT``. For the other databases the geometries are
+queried as WKB, transformed into tile coordinates, clipped to the tile extent
+and encoded in Python (see :func:`encode`). Clipping and rounding the
+coordinates to the tile grid takes the place of ``ST_AsMVTGeom``'s
+simplification; geometries are not simplified further.
+
+Geometry columns in EPSG:3857 and EPSG:4326 are converted in Python, columns in
+other coordinate systems are transformed to EPSG:3857 by the database.
+"""
+from itertools import izip
+from math import pi, log, tan, atan, exp
+import struct
+
+from sqlalchemy import select, func, literal_column
+
+from geoalchemy.base import WKTSpatialElement
+from geoalchemy.dialect import DialectManager
+from geoalchemy.functions import functions
+from geoalchemy.postgis import PGSpatialDialect, pg_functions
+from geoalchemy.twkb import _zigzag, _write_varint
+from geoalchemy.utils import from_wkb, to_wkt
+
+EARTH_RADIUS = 6378137.0
+_ORIGIN = pi * EARTH_RADIUS
+_MAX_LATITUDE = 85.0511287798066
+
+_MERCATOR_SRIDS = (3857, 900913)
+
+# geometry types of a feature
+_POINT = 1
+_LINESTRING = 2
+_POLYGON = 3
+
+# geometry commands
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+def tile_bounds(z, x, y):
+    """Returns the bounds ``(minx, miny, maxx, maxy)`` of the tile ``z/x/y`` in
+    Web Mercator (EPSG:3857) coordinates. The tile ``0/0/0`` covers the world,
+    ``y`` counts from the north.
+    """
+    size = 2 * _ORIGIN / 2 ** z
+    minx = -_ORIGIN + x * size
+    maxy = _ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+def _mercator(lon, lat):
+    lat = max(-_MAX_LATITUDE, min(_MAX_LATITUDE, lat))
+    return (lon * pi / 180.0 * EARTH_RADIUS,
+            log(tan(pi / 4.0 + lat * pi / 360.0)) * EARTH_RADIUS)
+
+def _lonlat(x, y):
+    return (x / EARTH_RADIUS * 180.0 / pi,
+            (2 * atan(exp(y / EARTH_RADIUS)) - pi / 2.0) * 180.0 / pi)
+
+
+# Geometry helpers, working on GeoJSON-like geometries
+
+def _map_points(coords, function):
+    if coords and isinstance(coords[0], (list, tuple)):
+        return [_map_points(c, function) for c in coords]
+    return function(coords)
+
+def _open_ring(ring):
+    if len(ring) > 1 and ring[0][:2] == ring[-1][:2]:
+        return ring[:-1]
+    return ring
+
+def _clip_segment(a, b, lo, hi):
+    """Liang-Barsky clipping of the segment a-b to the square lo..hi, returns
+    the clipped segment or None. Unclipped end points are returned as is.
+    """
+    t0, t1 = 0.0, 1.0
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    for p, q in ((-dx, a[0] - lo), (dx, hi - a[0]), (-dy, a[1] - lo), (dy, hi - a[1])):
+        if p == 0:
+            if q < 0:
+                return None
+        else:
+            r = float(q) / p
+            if p < 0:
+                if r > t1:
+                    return None
+                t0 = max(t0, r)
+            else:
+                if r < t0:
+                    return None
+                t1 = min(t1, r)
+    start = a if t0 == 0 else [a[0] + t0 * dx, a[1] + t0 * dy]
+    end = b if t1 == 1 else [a[0] + t1 * dx, a[1] + t1 * dy]
+    return start, end
+
+def _clip_line(line, lo, hi):
+    """Clips a line to the square lo..hi, returns a list of lines."""
+    lines = []
+    current = []
+    for a, b in izip(line, line[1:]):
+        segment = _clip_segment(a, b, lo, hi)
+        if segment is None:
+            continue
+        start, end = segment
+        if current and current[-1] is start:
+            current.append(end)
+        else:
+            if len(current) > 1:
+                lines.append(current)
+            current = [start, end]
+    if len(current) > 1:
+        lines.append(current)
+    return lines
+
+def _intersection(a, b, axis, bound):
+    t = float(bound - a[axis]) / (b[axis] - a[axis])
+    point = [a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1])]
+    point[axis] = bound
+    return point
+
+def _clip_ring(ring, lo, hi):
+    """Sutherland-Hodgman clipping of an (open) ring to the square lo..hi."""
+    points = ring
+    for axis in (0, 1):
+        for bound, sign in ((lo, 1), (hi, -1)):
+            if not points:
+                return points
+            output = []
+            previous = points[-1]
+            previous_inside = (previous[axis] - bound) * sign >= 0
+            for point in points:
+                inside = (point[axis] - bound) * sign >= 0
+                if inside != previous_inside:
+                    output.append(_intersection(previous, point, axis, bound))
+                if inside:
+                    output.append(point)
+                previous, previous_inside = point, inside
+            points = output
+    return points
+
+def _clip(geom, lo, hi):
+    """Clips a geometry to the square lo..hi, lines and polygons are returned
+    as MultiLineString and MultiPolygon.
+    """
+    geom_type = geom["type"]
+    if geom_type == "GeometryCollection":
+        return {"type": geom_type,
+                "geometries": [_clip(part, lo, hi) for part in geom["geometries"]]}
+
+    coords = geom["coordinates"]
+    if geom_type == "Point":
+        geom_type, coords = "MultiPoint", [coords] if coords else []
+    elif geom_type == "LineString":
+        geom_type, coords = "MultiLineString", [coords]
+    elif geom_type == "Polygon":
+        geom_type, coords = "MultiPolygon", [coords]
+
+    if geom_type == "MultiPoint":
+        coords = [p for p in coords if lo <= p[0] <= hi and lo <= p[1] <= hi]
+    elif geom_type == "MultiLineString":
+        coords = [part for line in coords for part in _clip_line(line, lo, hi)]
+    else:
+        polygons = []
+        for polygon in coords:
+            rings = [_clip_ring(_open_ring(ring), lo, hi) for ring in polygon]
+            if rings and rings[0]:
+                polygons.append([rings[0]] + [ring for ring in rings[1:] if ring])
+        coords = polygons
+    return {"type": geom_type, "coordinates": coords}
+
+def _to_tile(geom, bounds, extent, buffer, lonlat=False):
+    """Transforms a geometry in Web Mercator (or longitude/latitude if
+    ``lonlat`` is set) coordinates into tile coordinates and clips it to the
+    tile extent extended by ``buffer``.
+    """
+    minx, miny, maxx, maxy = bounds
+    sx = extent / (maxx - minx)
+    sy = extent / (maxy - miny)
+
+    def transform(point):
+        x, y = _mercator(point[0], point[1]) if lonlat else point[:2]
+        return [(x - minx) * sx, (maxy - y) * sy]
+
+    def project(geom):
+        if geom["type"] == "GeometryCollection":
+            # collections may be nested
+            return {"type": "GeometryCollection",
+                    "geometries": [project(part) for part in geom["geometries"]]}
+        return {"type": geom["type"], "coordinates": _map_points(geom["coordinates"], transform)}
+
+    return _clip(project(geom), -buffer, extent + buffer)
+
+
+# Protocol buffer encoding
+
+def _key(field, wire_type):
+    return (field << 3) | wire_type
+
+def _write_bytes(out, field, data):
+    _write_varint(out, _key(field, 2))
+    _write_varint(out, len(data))
+    out += data
+
+def _write_packed(out, field, values):
+    data = bytearray()
+    for value in values:
+        _write_varint(data, value)
+    _write_bytes(out, field, data)
+
+def _encode_value(value):
+    """Encodes a property value as ``Value`` message."""
+    out = bytearray()
+    if isinstance(value, bool):
+        _write_varint(out, _key(7, 0))
+        _write_varint(out, int(value))
+    elif isinstance(value, (int, long)):
+        if value >= 0:
+            _write_varint(out, _key(5, 0))
+            _write_varint(out, value)
+        else:
+            _write_varint(out, _key(6, 0))
+            _write_varint(out, _zigzag(value))
+    elif isinstance(value, float) or hasattr(value, 'as_tuple'):
+        _write_varint(out, _key(3, 1))
+        out += struct.pack('<d', float(value))
+    else:
+        if not isinstance(value, unicode):
+            value = unicode(str(value), 'utf-8')
+        _write_bytes(out, 1, bytearray(value.encode('utf-8')))
+    return str(out)
+
+
+class _Commands(object):
+    """Writes the geometry commands of a feature, keeping the cursor position
+    for the delta encoding.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.x = 0
+        self.y = 0
+
+    def _write_points(self, points):
+        for (x, y) in points:
+            self.values.append(_zigzag(x - self.x))
+            self.values.append(_zigzag(y - self.y))
+            self.x, self.y = x, y
+
+    def move_to(self, points):
+        self.values.append(_MOVE_TO | (len(points) << 3))
+        self._write_points(points)
+
+    def line_to(self, points):
+        self.values.append(_LINE_TO | (len(points) << 3))
+        self._write_points(points)
+
+    def close_path(self):
+        self.values.append(_CLOSE_PATH | (1 << 3))
+
+def _quantize(points):
+    """Rounds the coordinates to integers, removing repeated points."""
+    result = []
+    for point in points:
+        point = (int(round(point[0])), int(round(point[1])))
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+def _ring_area(ring):
+    return sum(a[0] * b[1] - b[0] * a[1] for (a, b) in izip(ring, ring[1:] + ring[:1])) / 2.0
+
+def _geometry_commands(geom):
+    """Returns the feature type and the geometry commands of a (non-collection)
+    geometry in tile coordinates, or None if nothing is left of the geometry
+    once rounded to the tile grid.
+
+    Rings are oriented as required by the specification: exterior rings have a
+    positive area in tile coordinates (clockwise, as the y axis points down),
+    interior rings a negative area.
+    """
+    geom_type = geom["type"]
+    coords = geom["coordinates"]
+    if not geom_type.startswith("Multi"):
+        geom_type, coords = "Multi" + geom_type, [coords] if coords else []
+    commands = _Commands()
+
+    if geom_type == "MultiPoint":
+        points = [(int(round(p[0])), int(round(p[1]))) for p in coords]
+        if points:
+            commands.move_to(points)
+        feature_type = _POINT
+    elif geom_type == "MultiLineString":
+        for line in coords:
+            line = _quantize(line)
+            if len(line) > 1:
+                commands.move_to(line[:1])
+                commands.line_to(line[1:])
+        feature_type = _LINESTRING
+    elif geom_type == "MultiPolygon":
+        for polygon in coords:
+            for i, ring in enumerate(polygon):
+                ring = _quantize(_open_ring(ring))
+                if len(ring) > 1 and ring[0] == ring[-1]:
+                    ring.pop()
+                area = _ring_area(ring) if len(ring) > 2 else 0
+                if area == 0:
+                    if i == 0:
+                        # without exterior ring the holes are dropped as well
+                        break
+                    continue
+                if (area > 0) != (i == 0):
+                    ring.reverse()
+                commands.move_to(ring[:1])
+                commands.line_to(ring[1:])
+                commands.close_path()
+        feature_type = _POLYGON
+    else:
+        raise Exception("Couldn't create MVT geometry from geometry of type %s" % geom["type"])
+
+    if not commands.values:
+        return None
+    return feature_type, commands.values
+
+def _collection_parts(geom):
+    """Merges the members of a geometry collection into one multi geometry
+    per feature type (MultiPoint, MultiLineString and MultiPolygon).
+    """
+    coords = {"MultiPoint": [], "MultiLineString": [], "MultiPolygon": []}
+    for member in geom["geometries"]:
+        if member["type"] == "GeometryCollection":
+            parts = _collection_parts(member)
+        else:
+            parts = [member]
+        for part in parts:
+            part_type, part_coords = part["type"], part["coordinates"]
+            if not part_type.startswith("Multi"):
+                part_type, part_coords = "Multi" + part_type, [part_coords] if part_coords else []
+            if part_type not in coords:
+                raise Exception("Couldn't create MVT geometry from geometry of type %s" % part["type"])
+            coords[part_type].extend(part_coords)
+    return [{"type": part_type, "coordinates": coords[part_type]}
+            for part_type in ("MultiPoint", "MultiLineString", "MultiPolygon") if coords[part_type]]
+
+def encode_layer(name, features, extent=4096):
+    """Encodes a ``Layer`` message.
+
+    ``features`` is a list of ``(geometry, properties)`` or ``(geometry,
+    properties, id)`` tuples, where ``geometry`` is a GeoJSON-like geometry in
+    tile coordinates (``0`` to ``extent``, the y axis pointing down) and
+    ``properties`` a dictionary. The coordinates are rounded to integers;
+    geometries (or parts of geometries) that collapse are left out. The
+    members of a geometry collection are merged into one feature per geometry
+    type; as feature ids have to be unique, only the first of these features
+    has the id. Properties with a value of ``None`` are skipped.
+    """
+    keys = {}
+    values = {}
+    body = bytearray()
+
+    for feature in features:
+        geom, properties = feature[:2]
+        feature_id = feature[2] if len(feature) > 2 else None
+        tags = []
+        for key, value in sorted((properties or {}).iteritems()):
+            if value is None:
+                continue
+            value = _encode_value(value)
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(value, len(values)))
+
+        if geom["type"] == "GeometryCollection":
+            parts = _collection_parts(geom)
+        else:
+            parts = [geom]
+        for part in parts:
+            encoded = _geometry_commands(part)
+            if encoded is None:
+                continue
+            out = bytearray()
+            if feature_id is not None:
+                _write_varint(out, _key(1, 0))
+                _write_varint(out, feature_id)
+                feature_id = None
+            if tags:
+                _write_packed(out, 2, tags)
+            _write_varint(out, _key(3, 0))
+            _write_varint(out, encoded[0])
+            _write_packed(out, 4, encoded[1])
+            _write_bytes(body, 2, out)
+
+    out = bytearray()
+    _write_varint(out, _key(15, 0))
+    _write_varint(out, 2)
+    _write_bytes(out, 1, bytearray(unicode(name).encode('utf-8')))
+    out += body
+    for key, index in sorted(keys.iteritems(), key=lambda item: item[1]):
+        _write_bytes(out, 3, bytearray(unicode(key).encode('utf-8')))
+    for value, index in sorted(values.iteritems(), key=lambda item: item[1]):
+        _write_bytes(out, 4, bytearray(value))
+    _write_varint(out, _key(5, 0))
+    _write_varint(out, extent)
+    return out
+
+def encode(layers, extent=4096):
+    """Encodes a tile. ``layers`` is a list of ``(name, features)`` tuples,
+    see :func:`encode_layer`. Returns the tile as string.
+    """
+    out = bytearray()
+    for name, features in layers:
+        _write_bytes(out, 3, encode_layer(name, features, extent))
+    return str(out)
+
+
+# Queries
+
+def _clause(column):
+    if hasattr(column, '__clause_element__'):
+        return column.__clause_element__()
+    return column
+
+def _envelope(bounds, srid):
+    """Returns the envelope of the given Web Mercator bounds in the coordinate
+    system of the geometry column.
+    """
+    minx, miny, maxx, maxy = bounds
+    target_srid = srid
+    if srid == 4326:
+        minx, miny = _lonlat(max(minx, -_ORIGIN), max(miny, -_ORIGIN))
+        maxx, maxy = _lonlat(min(maxx, _ORIGIN), min(maxy, _ORIGIN))
+    elif srid not in _MERCATOR_SRIDS:
+        srid = 3857
+    wkt = to_wkt({"type": "Polygon", "coordinates": [[[minx, miny], [minx, maxy], [maxx, maxy],
+                                                      [maxx, miny], [minx, miny]]]})
+    envelope = WKTSpatialElement(wkt, srid)
+    if srid != target_srid:
+        return functions.transform(envelope, target_srid)
+    return envelope
+
+def _pg_tile(session, column, properties, srid, bounds, envelope, layer, extent, buffer):
+    geometry = column
+    if srid not in _MERCATOR_SRIDS:
+        geometry = functions.transform(column, 3857)
+    mvt_geometry = pg_functions.mvt_geom(geometry, func.ST_MakeEnvelope(*(bounds + (3857, ))),
+                                         extent, buffer, True)
+    features = select([mvt_geometry.label('mvt_geometry')] + properties,
+                      functions._bbox_intersects(column, envelope)).alias('mvt_features')
+    query = select([func.ST_AsMVT(literal_column('mvt_features'), layer, extent, 'mvt_geometry')],
+                   from_obj=[features])
+    data = session.scalar(query)
+    if data is None:
+        return ''
+    return str(data)
+
+def tile(session, column, z, x, y, properties=(), layer=None, extent=4096, buffer=64):
+    """Returns the Mapbox Vector Tile ``z/x/y`` as string.
+
+    ``column`` is the geometry column (or mapped geometry attribute) of the
+    features, ``properties`` a list of further columns that are written as
+    feature properties, using the column names (or labels) as keys. ``layer``
+    is the name of the layer, by default the table name. ``extent`` is the
+    size of the tile grid and ``buffer`` the number of grid cells the
+    geometries extend beyond the tile edges.
+    """
+    column = _clause(column)
+    properties = [_clause(p) for p in properties]
+    srid = column.type.srid
+    if layer is None:
+        layer = column.table.name
+
+    bounds = tile_bounds(z, x, y)
+    margin = (bounds[2] - bounds[0]) * buffer / extent
+    envelope = _envelope((bounds[0] - margin, bounds[1] - margin,
+                          bounds[2] + margin, bounds[3] + margin), srid)
+
+    spatial_dialect = DialectManager.get_spatial_dialect(session.get_bind(None).dialect)
+    if isinstance(spatial_dialect, PGSpatialDialect):
+        return _pg_tile(session, column, properties, srid, bounds, envelope, layer, extent, buffer)
+
+    geometry = column
+    if srid not in _MERCATOR_SRIDS and srid != 4326:
+        geometry = functions.transform(column, 3857)
+    # functions.wkb() has the type _WKBType, whose result processor converts
+    # the driver value with process_wkb() of the dialect (e.g. an Oracle LOB)
+    query = select([functions.wkb(geometry)] + properties,
+                   functions._bbox_intersects(column, envelope))
+    keys = [p.key for p in properties]
+
+    features = []
+    for row in session.execute(query):
+        if row[0] is None:
+            continue
+        geom = _to_tile(from_wkb(row[0]), bounds, extent, buffer, lonlat=(srid == 4326))
+        features.append((geom, dict(izip(keys, row[1:]))))
+    return encode([(layer, features)], extent)
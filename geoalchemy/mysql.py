@@ -1,4 +1,4 @@
-from sqlalchemy import func
+from sqlalchemy import func, text, bindparam, case
 from geoalchemy.base import SpatialComparator, PersistentSpatialElement,\
     WKBSpatialElement
 from geoalchemy.dialect import SpatialDialect 
@@ -60,6 +60,19 @@ class mysql_functions(functions):
         """MBRContains(g1, g2)"""
         pass
 
+    @staticmethod
+    def _lower_left(geometry):
+        """The lower left corner (minx, miny) of the MBR of 'geometry'. Since 
+        MySQL 5.7.6 the envelope of a point is the point, and the envelope of 
+        a vertical or horizontal line is a line from its lower left to its 
+        upper right corner, instead of a polygon.
+        """
+        envelope = func.Envelope(geometry)
+        return case([('POINT', envelope), 
+                     ('LINESTRING', func.StartPoint(envelope))],
+                    value=func.GeometryType(envelope),
+                    else_=func.StartPoint(func.ExteriorRing(envelope)))
+    
     @staticmethod
     def _within_distance(compiler, geom1, geom2, distance, *args):
         """MySQL does not support the function distance, so we are doing
@@ -104,6 +117,8 @@ class MySQLSpatialDialect(SpatialDialect):
                    functions.transform : None,
                    functions.buffer : None,
                    functions.convex_hull : None,
+                   functions.simplify : None,
+                   functions.snap_to_grid : None,
                    functions.intersection : None,
                    functions.within_distance : None,
                    mysql_functions.mbr_equal : 'MBREqual',
@@ -113,7 +128,12 @@ class MySQLSpatialDialect(SpatialDialect):
                    mysql_functions.mbr_within : 'MBRWithin',
                    mysql_functions.mbr_overlaps : 'MBROverlaps',
                    mysql_functions.mbr_contains : 'MBRContains',
-                   functions._within_distance : mysql_functions._within_distance
+                   functions._within_distance : mysql_functions._within_distance,
+                   functions._knn_distance : None,
+                   functions._xmin : lambda params, within_column_clause:
+                                         func.X(mysql_functions._lower_left(params[0])),
+                   functions._ymin : lambda params, within_column_clause:
+                                         func.Y(mysql_functions._lower_left(params[0]))
                    }
 
     def _get_function_mapping(self):
@@ -122,16 +142,39 @@ class MySQLSpatialDialect(SpatialDialect):
     def process_result(self, value, type):
         return MySQLPersistentSpatialElement(WKBSpatialElement(value, type.srid))
     
-    def handle_ddl_after_create(self, bind, table, column):
+    def reflect_geometry_columns(self, bind, schema=None):
+        """MySQL only stores the geometry type of the columns, the srid is
+        None and the dimension 2.
+        """
+        sql = """SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, 2, NULL,
+                   EXISTS (SELECT 1 FROM information_schema.STATISTICS s
+                           WHERE s.TABLE_SCHEMA = c.TABLE_SCHEMA AND s.TABLE_NAME = c.TABLE_NAME
+                             AND s.COLUMN_NAME = c.COLUMN_NAME AND s.INDEX_TYPE = 'SPATIAL')
+                 FROM information_schema.COLUMNS c
+                 WHERE c.TABLE_SCHEMA = COALESCE(:schema, DATABASE())
+                   AND c.DATA_TYPE IN ('geometry', 'point', 'linestring', 'polygon', 'multipoint',
+                                       'multilinestring', 'multipolygon', 'geometrycollection')"""
+        return bind.execute(text(sql, bindparams=[bindparam('schema', schema)])).fetchall()
+    
+    def handle_ddl_after_create(self, bind, table, column, create_index=True):
+        """With ``Geometry(..., mysql_srid=True)``, the column is restricted to
+        the SRID of the geometry type (MySQL >= 8.0), which is required for the
+        spatial index to be used by the optimizer.
+        """
         if column.type.spatial_index or not column.nullable:
             # MySQL requires NOT NULL for spatial indexed columns
-            bind.execute("ALTER TABLE %s ADD %s %s NOT NULL" % 
-                            (table.name, column.name, column.type.name))
+            sql = "ALTER TABLE %s ADD %s %s NOT NULL" % (table.name, column.name, column.type.name)
         else:
-            bind.execute("ALTER TABLE %s ADD %s %s" % 
-                            (table.name, column.name, column.type.name))
+            sql = "ALTER TABLE %s ADD %s %s" % (table.name, column.name, column.type.name)
+        if column.type.kwargs.get('mysql_srid'):
+            sql += " SRID %d" % column.type.srid
+        bind.execute(sql)
         
-        if column.type.spatial_index:
-            bind.execute("CREATE SPATIAL INDEX idx_%s_%s ON %s(%s)" % 
-                            (table.name, column.name, table.name, column.name))
+        if column.type.spatial_index and create_index:
+            for statement in self.spatial_index_ddl(table, column):
+                bind.execute(statement)
+    
+    def spatial_index_ddl(self, table, column, concurrently=False):
+        return ["CREATE SPATIAL INDEX idx_%s_%s ON %s(%s)" % 
+                    (table.name, column.name, table.name, column.name)]
             
@@ -10,8 +10,10 @@ from geoalchemy.base import WKTSpatialElement, WKBSpatialElement
     
 import warnings
 from sqlalchemy.schema import Column
-from sqlalchemy.sql.expression import table, column, and_, text
+from sqlalchemy.sql.expression import table, column, and_, text, literal_column, \
+    TableClause, ColumnClause, Alias
 from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.ext.compiler import compiles
 
 """Currently cx_Oracle does not support the insertion of NULL values into geometry columns 
 as bind parameter, see http://sourceforge.net/mailarchive/forum.php?thread_name=AANLkTikNG4brmQJiua2FQS8zUwk8rNgLHoe6SZ32f1gQ%40mail.gmail.com&forum_name=cx-oracle-users
@@ -426,6 +428,8 @@ class OracleSpatialDialect(SpatialDialect):
                    WKTSpatialElement : 'MDSYS.SDO_GEOMETRY',
                    functions.wkb: 'SDO_UTIL.TO_WKBGEOMETRY',
                    WKBSpatialElement : 'MDSYS.SDO_GEOMETRY',
+                   functions._from_wkb : lambda params, within_column_clause:
+                                            func.MDSYS.SDO_GEOMETRY(func.TO_BLOB(params[0]), params[1]),
                    functions.dimension : ['MDSYS.ST_GEOMETRY.ST_DIMENSION', 'MDSYS.ST_GEOMETRY'],
                    functions.srid : ['MDSYS.OGC_SRID', 'MDSYS.ST_GEOMETRY'],
                    functions.geometry_type : ['MDSYS.OGC_GeometryType', 'MDSYS.ST_GEOMETRY'],
@@ -444,6 +448,8 @@ class OracleSpatialDialect(SpatialDialect):
                    functions.boundary : ST_GeometryFunction(func.MDSYS.ST_GEOMETRY.ST_Boundary, True),
                    functions.buffer : DimInfoFunction(func.SDO_GEOM.SDO_Buffer),
                    functions.convex_hull : DimInfoFunction(func.SDO_GEOM.SDO_ConvexHull),
+                   functions.simplify : 'SDO_UTIL.SIMPLIFY',
+                   functions.snap_to_grid : None,
                    functions.envelope : ST_GeometryFunction(func.MDSYS.ST_GEOMETRY.ST_Envelope, True),
                    functions.start_point : ST_GeometryFunction(func.MDSYS.OGC_StartPoint, True),
                    functions.end_point : ST_GeometryFunction(func.MDSYS.OGC_EndPoint, True),
@@ -510,7 +516,22 @@ class OracleSpatialDialect(SpatialDialect):
                    # same as functions.within_distance
                    oracle_functions.sdo_geom_sdo_within_distance : DimInfoFunction(func.SDO_GEOM.Within_Distance, returns_boolean=True),
 
-                   functions._within_distance : oracle_functions._within_distance
+                   functions._within_distance : oracle_functions._within_distance,
+                   functions._bbox_intersects : lambda compiler, geom1, geom2:
+                                                    func.SDO_FILTER(geom1, geom2) == 'TRUE',
+                   # SDO_NN and SDO_NN_DISTANCE are linked by the literal label 1
+                   functions._knn_distance : lambda compiler, geom1, geom2:
+                                                 func.SDO_NN_DISTANCE(literal_column('1')),
+                   # with other conditions, SDO_NN returns batches of candidates
+                   # until the ROWNUM limit of the query is reached
+                   functions._knn_filter : lambda compiler, geom1, geom2, k:
+                                               func.SDO_NN(geom1, geom2, 'sdo_num_res=%d' % k
+                                                           if k is not None else 'sdo_batch_size=0',
+                                                           literal_column('1')) == 'TRUE',
+                   functions._xmin : lambda params, within_column_clause:
+                                         func.SDO_GEOM.SDO_MIN_MBR_ORDINATE(params[0], 1),
+                   functions._ymin : lambda params, within_column_clause:
+                                         func.SDO_GEOM.SDO_MIN_MBR_ORDINATE(params[0], 2)
                   }
     
     __member_functions = (
@@ -552,7 +573,7 @@ class OracleSpatialDialect(SpatialDialect):
         """Append a transformation to BLOB using the Oracle function 'TO_BLOB'.
         """
         if wkb_element is not None and wkb_element.desc is not None:
-            return func.TO_BLOB(wkb_element.desc)
+            return func.TO_BLOB(wkb_element.geom_wkb)
         
         return None
 
@@ -570,6 +591,51 @@ class OracleSpatialDialect(SpatialDialect):
                                                 and_(OracleSpatialDialect.METADATA_TABLE.c.table_name == column.table.name.upper(),
                                                      OracleSpatialDialect.METADATA_TABLE.c.column_name == column.name.upper()))
 
+    def estimated_extent(self, session, column):
+        """Uses ``SDO_TUNE.EXTENT_OF``, which reads the root of the spatial index
+        if the column has one.
+        """
+        dialect = session.get_bind(None).dialect
+        name = dialect.denormalize_name(column.table.name)
+        if column.table.schema:
+            name = "%s.%s" % (dialect.denormalize_name(column.table.schema), name)
+        sql = """SELECT SDO_GEOM.SDO_MIN_MBR_ORDINATE(e, 1), SDO_GEOM.SDO_MIN_MBR_ORDINATE(e, 2),
+                        SDO_GEOM.SDO_MAX_MBR_ORDINATE(e, 1), SDO_GEOM.SDO_MAX_MBR_ORDINATE(e, 2)
+                 FROM (SELECT SDO_TUNE.EXTENT_OF(:table_name, :column_name) e FROM dual)"""
+        row = session.execute(text(sql), {'table_name': name,
+                                          'column_name': dialect.denormalize_name(column.name)}).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return tuple(row)
+    
+    def reflect_geometry_columns(self, bind, schema=None):
+        """Reads ``USER_SDO_GEOM_METADATA`` (or ``ALL_SDO_GEOM_METADATA`` for
+        another ``schema``), the geometry type is the layer type of the
+        spatial index.
+        """
+        views = {'views': 'USER', 'owner': '', 'index_owner': '', 'condition': ''}
+        if schema is not None:
+            views = {'views': 'ALL', 'owner': ' AND ii.table_owner = m.owner',
+                     'index_owner': ' AND im.sdo_index_owner = ii.index_owner',
+                     'condition': 'WHERE m.owner = :schema'}
+        sql = """SELECT m.table_name, m.column_name, im.sdo_layer_gtype,
+                   (SELECT COUNT(*) FROM TABLE(m.diminfo)), m.srid,
+                   CASE WHEN ii.index_name IS NULL THEN 0 ELSE 1 END
+                 FROM %(views)s_SDO_GEOM_METADATA m
+                 LEFT OUTER JOIN %(views)s_SDO_INDEX_INFO ii
+                   ON ii.table_name = m.table_name AND ii.column_name = m.column_name%(owner)s
+                 LEFT OUTER JOIN %(views)s_SDO_INDEX_METADATA im
+                   ON im.sdo_index_name = ii.index_name%(index_owner)s
+                 %(condition)s""" % views
+        params = {}
+        if schema is not None:
+            params['schema'] = bind.dialect.denormalize_name(schema)
+        rows = bind.execute(text(sql), **params).fetchall()
+        gtypes = {'LINE': 'LINESTRING', 'MULTILINE': 'MULTILINESTRING', 'COLLECTION': 'GEOMETRY'}
+        return [(bind.dialect.normalize_name(table_name), bind.dialect.normalize_name(column_name),
+                 gtypes.get(gtype, gtype or 'GEOMETRY'), dimension, srid, spatial_index)
+                for (table_name, column_name, gtype, dimension, srid, spatial_index) in rows]
+    
     def handle_ddl_before_drop(self, bind, table, column):
         bind.execute("DELETE FROM USER_SDO_GEOM_METADATA WHERE table_name = '%s' AND column_name = '%s'" %
                             (table.name.upper(), column.name.upper()))
@@ -577,7 +643,7 @@ class OracleSpatialDialect(SpatialDialect):
         if column.type.spatial_index and column.type.kwargs.has_key("diminfo"):
             bind.execute("DROP INDEX %s_%s_sidx" % (table.name, column.name))
           
-    def handle_ddl_after_create(self, bind, table, column):    
+    def handle_ddl_after_create(self, bind, table, column, create_index=True):    
         bind.execute("ALTER TABLE %s ADD %s %s" % 
                             (table.name, column.name, 'SDO_GEOMETRY'))
         
@@ -596,19 +662,46 @@ class OracleSpatialDialect(SpatialDialect):
                             "VALUES ('%s', '%s', %s, %s)" % 
                             (table.name, column.name, diminfo, column.type.srid))
             
-            if column.type.spatial_index:
-                bind.execute("CREATE INDEX %s_%s_sidx ON %s(%s) "\
-                             "INDEXTYPE IS MDSYS.SPATIAL_INDEX%s" % 
-                             (table.name, column.name, table.name, column.name, 
-                              self.__get_index_parameters(column.type)))
+            if column.type.spatial_index and create_index:
+                for statement in self.spatial_index_ddl(table, column):
+                    bind.execute(statement)
+    
+    def spatial_index_ddl(self, table, column, concurrently=False):
+        """Options of the index:
+        
+        * ``oracle_index_params``: further parameters as dictionary (or string), e.g.
+          ``{'sdo_indx_dims': 2, 'sdo_rtr_pctfree': 10}``;
+        * ``oracle_index_local``: create a local index on a partitioned table;
+        * ``oracle_index_parallel``: the degree of parallelism of the index creation.
+        
+        The index can only be created if a DIMINFO is given.
+        """
+        if not column.type.kwargs.has_key("diminfo"):
+            return []
+        options = column.type.kwargs
+        sql = "CREATE INDEX %s_%s_sidx ON %s(%s) INDEXTYPE IS MDSYS.SPATIAL_INDEX" % \
+                (table.name, column.name, table.name, column.name)
+        if options.get('oracle_index_local'):
+            sql += " LOCAL"
+        if options.get('oracle_index_parallel'):
+            sql += " PARALLEL %d" % options['oracle_index_parallel']
+        return [sql + self.__get_index_parameters(column.type)]
     
     def __get_index_parameters(self, type):
+        parameters = []
         type_name = self.__get_oracle_gtype(type)
+        if type_name is not None:
+            parameters.append('LAYER_GTYPE=%s' % type_name)
+        params = type.kwargs.get('oracle_index_params')
+        if isinstance(params, dict):
+            parameters.extend('%s=%s' % (key.upper(), params[key]) for key in sorted(params))
+        elif params:
+            parameters.append(params)
         
-        if type_name == None:
+        if not parameters:
             return ""
         else:
-            return " PARAMETERS ('LAYER_GTYPE=%s')" % type_name
+            return " PARAMETERS ('%s')" % " ".join(parameters)
     
     def __get_oracle_gtype(self, type):
         """Maps the GeoAlchemy types to SDO_GTYPE values:
@@ -625,3 +718,85 @@ class OracleSpatialDialect(SpatialDialect):
                 return None
             else:
                 return type.name
+
+
+class SDOJoin(TableClause):
+    """The table function ``TABLE(SDO_JOIN(...))``, which returns the pairs
+    of rowids (columns ``rowid1`` and ``rowid2``) of the rows of two tables
+    whose geometries are in the relation given by ``params`` (e.g.
+    ``'mask=INSIDE'``, see the Oracle documentation of ``SDO_JOIN``).
+
+    ``column1`` and ``column2`` are geometry columns or mapped geometry
+    attributes, both with a spatial index. To join a table with itself, use
+    the columns of two aliases of the table. SDO_JOIN compares the two
+    R-trees of the spatial indexes at once, which for joins between large
+    tables is much faster than testing ``SDO_RELATE`` row by row::
+
+        join = SDOJoin(spots.c.spot_location, lakes.c.lake_geom, 'mask=INSIDE')
+        select([spots.c.spot_id, lakes.c.lake_id],
+               and_(rowid(spots) == join.c.rowid1, rowid(lakes) == join.c.rowid2),
+               from_obj=[join])
+    """
+
+    def __init__(self, column1, column2, params='mask=ANYINTERACT', name='sdo_join'):
+        TableClause.__init__(self, name, column('rowid1'), column('rowid2'))
+        self.column1 = _geometry_column(column1)
+        self.column2 = _geometry_column(column2)
+        self.params = params
+
+def _geometry_column(column):
+    if hasattr(column, 'property'):
+        return column.property.columns[0]
+    return column
+
+def _quote_string(value):
+    return "'%s'" % value.replace("'", "''")
+
+@compiles(SDOJoin)
+def _compile_sdo_join(element, compiler, **kw):
+    def table_name(column):
+        # SDO_JOIN needs the names of the tables, not of their aliases
+        table = column.table
+        while isinstance(table, Alias):
+            table = table.original
+        name = compiler.dialect.denormalize_name(table.name)
+        if table.schema:
+            name = "%s.%s" % (compiler.dialect.denormalize_name(table.schema), name)
+        return name
+    arguments = [table_name(element.column1),
+                 compiler.dialect.denormalize_name(element.column1.name),
+                 table_name(element.column2),
+                 compiler.dialect.denormalize_name(element.column2.name),
+                 element.params]
+    sql = "TABLE(SDO_JOIN(%s))" % ", ".join(_quote_string(a) for a in arguments)
+    if kw.get('asfrom'):
+        sql += " " + compiler.preparer.quote(element.name, element.quote)
+    return sql
+
+def rowid(table):
+    """Returns the pseudo column ``ROWID`` of ``table``."""
+    return ColumnClause('rowid', table)
+
+def sdo_join(session, column1, column2, mask='ANYINTERACT', params=''):
+    """Returns a query of the pairs of instances ``(instance1, instance2)``
+    of the classes of the mapped geometry attributes ``column1`` and
+    ``column2`` (e.g. ``Spot.spot_location`` and ``Lake.lake_geom``) whose
+    geometries are in the relation ``mask`` (e.g. ``'INSIDE'`` for the spots
+    inside a lake), selected with :class:`SDOJoin`. Further parameters of
+    ``SDO_JOIN`` can be passed as ``params``, e.g. ``'distance=10
+    unit=meter'`` with the mask ``'ANYINTERACT'``::
+
+        pairs = sdo_join(session, Spot.spot_location, Lake.lake_geom, 'INSIDE').all()
+
+    The two classes have to be mapped to different tables.
+    """
+    table1 = _geometry_column(column1).table
+    table2 = _geometry_column(column2).table
+    if table1 is table2:
+        raise Exception("sdo_join() can not join a table with itself, use SDOJoin "
+                        "with aliases of the table instead")
+    join = SDOJoin(column1, column2, ('mask=%s %s' % (mask, params)).strip())
+    # the rowid pairs are read first, then the rows are fetched by rowid
+    from_clause = join.join(table1, rowid(table1) == join.c.rowid1) \
+                      .join(table2, rowid(table2) == join.c.rowid2)
+    return session.query(column1.class_, column2.class_).select_from(from_clause)
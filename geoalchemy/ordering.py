@@ -0,0 +1,325 @@
+u"""
+:mod:`geoalchemy.ordering` -- Space-filling curve ordering
+==========================================================
+
+Spatial indexes (GiST, R*Tree) and table scans are faster when rows that
+are near each other in space are also stored near each other. This module
+computes sortable keys along a space-filling curve from the bounding boxes
+of geometries, in Python:
+
+* :func:`hilbert`: the position of a point on a Hilbert curve over an
+  extent (e.g. the extent of the column), which preserves locality best;
+* :func:`geohash`: the geohash of a lon/lat point, a string that is also
+  meaningful outside of the database.
+
+The key of a geometry is the key of the center of its bounding box. The
+keys can be used to sort the rows of a bulk insert, so that the spatial
+index is built in curve order::
+
+    >>> from geoalchemy.ordering import ordered
+    >>> session.add_all(ordered(spots, key=lambda spot: spot.spot_location))
+
+to read a table in curve order, e.g. for exports (:func:`load_keys` and
+:func:`iter_ordered`), or to copy a table into a new table in curve order
+(:func:`cluster`), the equivalent of PostgreSQL's ``CLUSTER`` for a spatial
+order::
+
+    >>> from geoalchemy.ordering import cluster
+    >>> cluster(session, Spot.spot_location, spots_ordered)
+    >>> session.commit()
+"""
+import sys
+
+from sqlalchemy import select, and_, or_, Column, Integer, MetaData, Table
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.schema import CreateTable, DropTable
+from sqlalchemy.sql.expression import Executable, ClauseElement
+
+from geoalchemy.base import RawColumn, PersistentSpatialElement
+from geoalchemy.functions import functions
+from geoalchemy.geometry import Geometry
+from geoalchemy.utils import element_geometry, geometry_bounds, wkb_bounds, from_wkt
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lon, lat, precision=12):
+    """Returns the geohash of ``lon``/``lat`` with ``precision`` characters
+    (5 bits each, alternating longitude and latitude).
+    """
+    lon_range = [-180.0, 180.0]
+    lat_range = [-90.0, 90.0]
+    chars = []
+    bits = value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            interval, coordinate = lon_range, lon
+        else:
+            interval, coordinate = lat_range, lat
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def _cell(value, minimum, maximum, n):
+    if maximum <= minimum:
+        return 0
+    return max(0, min(n - 1, int((value - minimum) / (maximum - minimum) * n)))
+
+
+def hilbert(x, y, extent, order=16):
+    """Returns the position (from 0 to ``4 ** order - 1``) of the point
+    ``x``/``y`` on the Hilbert curve of the given ``order`` that fills the
+    bounding box ``extent`` (``(minx, miny, maxx, maxy)``). Points outside of
+    the extent are moved to its edge.
+    """
+    n = 1 << order
+    minx, miny, maxx, maxy = extent
+    x = _cell(x, minx, maxx, n)
+    y = _cell(y, miny, maxy, n)
+    d = 0
+    s = n >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant, so that the curve is continuous
+        if not ry:
+            if rx:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def _bounds(value):
+    """Returns the bounding box of a bounding box, a point ``(x, y)``, a WKT
+    string, a WKB value or a geometry element, or ``None`` for empty
+    geometries.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (tuple, list)):
+        if len(value) == 2:
+            return (value[0], value[1], value[0], value[1])
+        return tuple(value)
+    if isinstance(value, buffer):
+        return wkb_bounds(value)
+    if isinstance(value, basestring):
+        if value.lstrip()[:1].isalpha():
+            return geometry_bounds(from_wkt(value))
+        return wkb_bounds(value)
+    if isinstance(value, PersistentSpatialElement):
+        # loaded geometries cache their bounds
+        return value.bounds
+    geom = element_geometry(value)
+    if geom is None:
+        raise Exception("The bounding box of %r is not known in Python" % (value, ))
+    return geometry_bounds(geom)
+
+
+def _extent(bounds):
+    bounds = [b for b in bounds if b is not None]
+    if not bounds:
+        return (0, 0, 0, 0)
+    return (min(b[0] for b in bounds), min(b[1] for b in bounds),
+            max(b[2] for b in bounds), max(b[3] for b in bounds))
+
+
+class CurveKey(object):
+    """Computes the curve key of geometries (bounding boxes, points
+    ``(x, y)``, WKT, WKB or geometry elements) from the center of their
+    bounding box: ``curve`` is ``'hilbert'`` (over ``extent``, with the
+    given ``order``) or ``'geohash'`` (for lon/lat geometries, with
+    ``precision`` characters). Empty geometries have the key ``None``.
+    """
+
+    def __init__(self, curve='hilbert', extent=None, order=16, precision=12):
+        if curve not in ('hilbert', 'geohash'):
+            raise Exception("Unknown curve '%s', use 'hilbert' or 'geohash'" % curve)
+        if curve == 'hilbert' and extent is None:
+            raise Exception("The Hilbert curve requires the extent of the geometries")
+        self.curve = curve
+        self.extent = extent
+        self.order = order
+        self.precision = precision
+
+    def key(self, bounds):
+        """Returns the key of a bounding box."""
+        if bounds is None:
+            return None
+        x = (bounds[0] + bounds[2]) / 2.0
+        y = (bounds[1] + bounds[3]) / 2.0
+        if self.curve == 'geohash':
+            return geohash(x, y, self.precision)
+        return hilbert(x, y, self.extent, self.order)
+
+    def __call__(self, value):
+        return self.key(_bounds(value))
+
+
+def _sort_key(item):
+    # rows without geometry come last
+    key = item[0]
+    return (key is None, key)
+
+
+def ordered(values, curve='hilbert', key=None, extent=None, order=16, precision=12):
+    """Returns the list of ``values`` sorted along the curve, e.g. the
+    instances of a bulk insert. ``key`` returns the geometry of a value (by
+    default the value is the geometry). For the Hilbert curve, the extent
+    of all geometries is used if ``extent`` is not given.
+    """
+    values = list(values)
+    bounds = [_bounds(value if key is None else key(value)) for value in values]
+    if curve == 'hilbert' and extent is None:
+        extent = _extent(bounds)
+    curve_key = CurveKey(curve, extent, order, precision)
+    keyed = sorted(((curve_key.key(b), i) for (i, b) in enumerate(bounds)), key=_sort_key)
+    return [values[i] for (k, i) in keyed]
+
+
+def _geometry_column(column):
+    if hasattr(column, 'property'):
+        return column.property.columns[0]
+    return column
+
+
+def load_keys(session, column, curve='hilbert', extent=None, order=16, precision=12,
+              batch_size=10000):
+    """Returns the ``(key, primary key)`` pairs of all rows of the table of
+    ``column`` (a geometry column or mapped geometry attribute), sorted by
+    key. Only the bounding boxes are selected (in batches of ``batch_size``
+    rows); the primary key is a tuple for composite primary keys. For the
+    Hilbert curve, the extent of the column is used if ``extent`` is not
+    given.
+    """
+    column = _geometry_column(column)
+    primary_key = list(column.table.primary_key.columns)
+    result = session.execute(select(primary_key + [functions.wkb(functions.envelope(column))]))
+    rows = []
+    while True:
+        batch = result.fetchmany(batch_size)
+        if not batch:
+            break
+        for row in batch:
+            pk = row[0] if len(primary_key) == 1 else tuple(row[:len(primary_key)])
+            rows.append((pk, None if row[-1] is None else wkb_bounds(row[-1])))
+    if curve == 'hilbert' and extent is None:
+        extent = _extent(b for (pk, b) in rows)
+    curve_key = CurveKey(curve, extent, order, precision)
+    return sorted(((curve_key.key(b), pk) for (pk, b) in rows), key=_sort_key)
+
+
+def iter_ordered(session, column, batch_size=1000, keys=None, **kwargs):
+    """Iterates over the instances of the class of the mapped geometry
+    attribute ``column`` in curve order, with one query per ``batch_size``
+    instances. ``keys`` are the pairs of :func:`load_keys`, which are
+    loaded with the keyword arguments if not given.
+    """
+    if keys is None:
+        keys = load_keys(session, column, **kwargs)
+    mapper = class_mapper(column.class_)
+    primary_key = list(mapper.primary_key)
+    for start in xrange(0, len(keys), batch_size):
+        chunk = [pk for (key, pk) in keys[start:start + batch_size]]
+        if len(primary_key) == 1:
+            condition = primary_key[0].in_(chunk)
+        else:
+            condition = or_(*[and_(*[c == v for (c, v) in zip(primary_key, pk)]) for pk in chunk])
+        instances = {}
+        for instance in session.query(column.class_).filter(condition):
+            pk = mapper.primary_key_from_instance(instance)
+            instances[pk[0] if len(primary_key) == 1 else tuple(pk)] = instance
+        for pk in chunk:
+            if pk in instances:
+                yield instances[pk]
+
+
+class _InsertFromSelect(Executable, ClauseElement):
+    """``INSERT INTO table (columns) SELECT ...``"""
+
+    def __init__(self, table, columns, select):
+        self.table = table
+        self.columns = columns
+        self.select = select
+
+@compiles(_InsertFromSelect)
+def _compile_insert_from_select(element, compiler, **kw):
+    return "INSERT INTO %s (%s) %s" % (
+        compiler.process(element.table, asfrom=True),
+        ", ".join(compiler.preparer.format_column(c) for c in element.columns),
+        compiler.process(element.select))
+
+
+# dialects with CREATE TEMPORARY TABLE (Oracle has global temporary tables,
+# which can not be dropped in the transaction that used them)
+_TEMPORARY_TABLES = ('postgresql', 'sqlite', 'mysql')
+
+def cluster(session, column, target, keys=None, batch_size=1000, **kwargs):
+    """Copies the rows of the table of ``column`` (a geometry column or
+    mapped geometry attribute) into the table ``target``, which has columns
+    with the same names, in curve order: the positions of the primary keys
+    in the order of :func:`load_keys` (or of ``keys``) are written to the
+    table ``<table>_curve_positions``, and the rows are copied with one
+    ``INSERT ... SELECT ... ORDER BY`` statement, without loading them. The
+    spatial index of ``target`` is then built in curve order, and most
+    databases store the rows in this order (SQLite stores the rows of tables
+    with an ``INTEGER PRIMARY KEY`` in the order of the key, only the R*Tree
+    is built in curve order).
+
+    The positions table is a temporary table with PostgreSQL, MySQL and
+    SQLite, and a regular table with Oracle and SQL Server. It is dropped
+    at the end, also if copying the rows fails.
+
+    The statements are executed in the transaction of the session, the
+    original table can then be dropped and ``target`` renamed.
+    """
+    column = _geometry_column(column)
+    source = column.table
+    if keys is None:
+        keys = load_keys(session, column, **kwargs)
+    primary_key = list(source.primary_key.columns)
+    dialect = session.get_bind(None).dialect
+    positions = Table('%s_curve_positions' % source.name, MetaData(),
+                      *([Column(c.name, c.type) for c in primary_key] +
+                        [Column('curve_position', Integer)]),
+                      prefixes=['TEMPORARY'] if dialect.name in _TEMPORARY_TABLES else [])
+    session.execute(CreateTable(positions))
+    try:
+        for start in xrange(0, len(keys), batch_size):
+            params = []
+            for (i, (key, pk)) in enumerate(keys[start:start + batch_size]):
+                values = [pk] if len(primary_key) == 1 else list(pk)
+                param = dict((c.name, v) for (c, v) in zip(primary_key, values))
+                param['curve_position'] = start + i
+                params.append(param)
+            session.execute(positions.insert(), params)
+        columns = [c for c in source.columns if c.name in target.c]
+        # the geometries are copied as they are, not converted to WKB
+        query = select([RawColumn(c) if isinstance(c.type, Geometry) else c for c in columns],
+                       and_(*[c == positions.c[c.name] for c in primary_key]),
+                       from_obj=[source, positions]).order_by(positions.c.curve_position)
+        session.execute(_InsertFromSelect(target, [target.c[c.name] for c in columns], query))
+    except:
+        exc_info = sys.exc_info()
+        try:
+            session.execute(DropTable(positions))
+        except Exception:
+            # e.g. in an aborted transaction, which removes the table on rollback
+            pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+    session.execute(DropTable(positions))
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy import select, func, and_
+import threading
+from binascii import hexlify
+from weakref import WeakKeyDictionary
+from sqlalchemy import select, func, and_, text, bindparam, literal_column
 from geoalchemy.base import SpatialComparator, PersistentSpatialElement, \
     WKBSpatialElement, WKTSpatialElement
 from geoalchemy.dialect import SpatialDialect 
 from geoalchemy.functions import functions, BaseFunction
+from geoalchemy.utils import unhexlify_ewkb, make_ewkt
 
 class PGComparator(SpatialComparator):
     """Comparator class used for PostGIS
@@ -52,6 +56,16 @@ class pg_functions(functions):
         """Expand(g)"""
         pass
 
+    class twkb(BaseFunction):
+        """AsTWKB(g, precision): available since PostGIS version 2.2,
+        see also :mod:`geoalchemy.twkb`"""
+        pass
+
+    class mvt_geom(BaseFunction):
+        """AsMVTGeom(g, bounds, extent, buffer, clip_geom): available since
+        PostGIS version 2.4, see also :mod:`geoalchemy.mvt`"""
+        pass
+
     @staticmethod
     def _within_distance(compiler, geom1, geom2, distance, *args):
         """ST_DWithin in early versions of PostGIS 1.3 does not work when
@@ -69,6 +83,9 @@ class PGSpatialDialect(SpatialDialect):
     __functions = {
                    WKTSpatialElement: 'ST_GeomFromText',
                    WKBSpatialElement: 'ST_GeomFromWKB',
+                   functions._from_ewkt: 'ST_GeomFromEWKT',
+                   functions._from_ewkb: 'ST_GeomFromEWKB',
+                   functions._from_wkb: 'ST_GeomFromWKB',
                    functions.wkt: 'ST_AsText',
                    functions.wkb: 'ST_AsBinary',
                    functions.dimension : 'ST_Dimension',
@@ -89,6 +106,8 @@ class PGSpatialDialect(SpatialDialect):
                    functions.boundary : 'ST_Boundary',
                    functions.buffer : 'ST_Buffer',
                    functions.convex_hull : 'ST_ConvexHull',
+                   functions.simplify : 'ST_SimplifyPreserveTopology',
+                   functions.snap_to_grid : 'ST_SnapToGrid',
                    functions.envelope : 'ST_Envelope',
                    functions.start_point : 'ST_StartPoint',
                    functions.end_point : 'ST_EndPoint',
@@ -114,30 +133,243 @@ class PGSpatialDialect(SpatialDialect):
                    pg_functions.gml : 'ST_AsGML',
                    pg_functions.geojson : 'ST_AsGeoJSON',
                    pg_functions.expand : 'ST_Expand',
-                   functions._within_distance : pg_functions._within_distance
+                   pg_functions.twkb : 'ST_AsTWKB',
+                   pg_functions.mvt_geom : 'ST_AsMVTGeom',
+                   functions._within_distance : pg_functions._within_distance,
+                   functions._bbox_intersects : lambda compiler, geom1, geom2: geom1.op('&&')(geom2),
+                   functions._knn_distance : lambda compiler, geom1, geom2:
+                                                 PGSpatialDialect._knn_distance(compiler, geom1, geom2),
+                   functions._xmin : 'ST_XMin',
+                   functions._ymin : 'ST_YMin'
                   }
     
+    # the PostGIS major version of each SQLAlchemy dialect (i.e. engine)
+    __postgis_versions = WeakKeyDictionary()
+    
     def _get_function_mapping(self):
         return PGSpatialDialect.__functions
     
+    def postgis_version(self, bind):
+        """Returns the major version of PostGIS, which is queried once per engine."""
+        versions = PGSpatialDialect.__postgis_versions
+        if bind.dialect not in versions:
+            version = bind.execute(select([func.postgis_lib_version()])).scalar()
+            versions[bind.dialect] = int(version.split('.')[0])
+        return versions[bind.dialect]
+    
+    @staticmethod
+    def _knn_distance(compiler, geom1, geom2):
+        """The index-assisted nearest neighbour operator ``<->`` of PostGIS 2, 
+        ``ST_Distance`` (without index) if the engine of the compiler is known to 
+        use PostGIS 1, see :meth:`postgis_version`.
+        """
+        if PGSpatialDialect.__postgis_versions.get(compiler.dialect, 2) < 2:
+            return func.ST_Distance(geom1, geom2)
+        return geom1.op('<->')(geom2)
+    
+    def inline_geometry_columns(self, bind):
+        """PostGIS 2 supports type modifiers, so that geometry columns are created
+        with ``CREATE TABLE`` (e.g. ``geometry(POINT,4326)``), including their
+        ``NOT NULL`` constraint, instead of by ``AddGeometryColumn``.
+        """
+        return self.postgis_version(bind) >= 2
+    
+    def build_spatial_indexes(self, bind, indexes, parallel=1, concurrently=False):
+        """The indexes are built with one statement per connection. With
+        ``parallel`` > 1, ``bind`` has to be an engine (or a connection
+        outside of a transaction), so that the other connections see the
+        created tables.
+        
+        With ``concurrently``, the indexes of the columns with the option
+        ``postgis_index_concurrently`` are built with ``CREATE INDEX
+        CONCURRENTLY``, which can not run in a transaction block. The
+        statements are then executed one by one on connections of the engine
+        in autocommit mode.
+        """
+        statements = self.spatial_indexes_ddl(indexes, concurrently)
+        if not statements:
+            return
+        engine = getattr(bind, 'engine', bind)
+        if parallel <= 1 or len(statements) == 1:
+            if concurrently:
+                PGSpatialDialect.__execute_autocommit(engine, statements)
+            else:
+                bind.execute(";\n".join(statements))
+            return
+        errors = []
+        def build(chunk):
+            try:
+                if concurrently:
+                    PGSpatialDialect.__execute_autocommit(engine, chunk)
+                    return
+                connection = engine.connect()
+                try:
+                    connection.execute(";\n".join(chunk))
+                finally:
+                    connection.close()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=build, args=(statements[i::parallel], ))
+                   for i in xrange(min(parallel, len(statements)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+    
+    @staticmethod
+    def __execute_autocommit(engine, statements):
+        connection = engine.connect()
+        try:
+            # psycopg2 opens a transaction before the first statement, unless
+            # the isolation level is ISOLATION_LEVEL_AUTOCOMMIT (0)
+            dbapi_connection = connection.connection
+            isolation_level = dbapi_connection.isolation_level
+            dbapi_connection.set_isolation_level(0)
+            try:
+                for statement in statements:
+                    connection.execute(statement)
+            finally:
+                dbapi_connection.set_isolation_level(isolation_level)
+        finally:
+            connection.close()
+    
     def process_result(self, value, type):
         if type.wkt_internal:
             return PGPersistentSpatialElement(WKTSpatialElement(value, type.srid))
+        if type.ewkb_internal:
+            # keep the EWKB, so that the value can be sent back as it is
+            return PGPersistentSpatialElement(WKBSpatialElement(unhexlify_ewkb(value), type.srid))
         return PGPersistentSpatialElement(WKBSpatialElement(value, type.srid))
     
+    def evaluate_many(self, session, function_class, elements, arguments, batch_size=None):
+        """Sends the geometries as a single array of hex-encoded EWKB and EWKT 
+        values, which PostGIS casts to geometries. The array is indexed with 
+        ``generate_series``, so that the results are in the order of the
+        geometries. An array parameter has no size limit, so all geometries are
+        sent in one query, unless a `batch_size` is given.
+        """
+        values = []
+        for element in elements:
+            if isinstance(element, WKBSpatialElement):
+                values.append(hexlify(str(unhexlify_ewkb(element.geom_ewkb))))
+            elif isinstance(element, WKTSpatialElement):
+                if element.srid is None:
+                    values.append(element.geom_wkt)
+                else:
+                    values.append(make_ewkt(element.geom_wkt, element.srid))
+            else:
+                return SpatialDialect.evaluate_many(self, session, function_class, elements, 
+                                                    arguments, batch_size or 250)
+        
+        batch_size = batch_size or len(values)
+        results = []
+        for i in xrange(0, len(values), batch_size):
+            batch = values[i:i + batch_size]
+            geometries = text('(SELECT n, CAST((CAST(:geometries AS text[]))[n] AS geometry) AS geom '
+                              'FROM generate_series(1, :count) AS n) AS geometries',
+                              bindparams=[bindparam('geometries', batch),
+                                          bindparam('count', len(batch))])
+            query = select([function_class(literal_column('geom'), *arguments)], 
+                           from_obj=[geometries]).order_by(literal_column('n'))
+            results.extend(row[0] for row in session.execute(query))
+        return results
+    
+    def spatial_index_ddl(self, table, column, concurrently=False):
+        """Options of the index:
+        
+        * ``postgis_index_method``: ``'gist'`` (default), ``'spgist'`` (PostGIS >= 2.5)
+          or ``'brin'`` (PostGIS >= 2.3, for large tables in spatial order);
+        * ``postgis_index_ops``: the operator class, e.g. ``'gist_geometry_ops_nd'``
+          for an n-dimensional index;
+        * ``postgis_index_with``: the storage parameters as dictionary, e.g.
+          ``{'fillfactor': 90}`` or ``{'pages_per_range': 32}`` for BRIN;
+        * ``postgis_index_concurrently``: build the index with ``CREATE INDEX
+          CONCURRENTLY`` when it is built on a filled table, see
+          :meth:`build_spatial_indexes`.
+        """
+        options = column.type.kwargs
+        method = options.get('postgis_index_method', 'gist').lower()
+        if method not in ('gist', 'spgist', 'brin'):
+            raise Exception("Unsupported index method '%s' for '%s.%s'" % (method, table.name, column.name))
+        ops = options.get('postgis_index_ops')
+        sql = "CREATE INDEX %s\"idx_%s_%s\" ON \"%s\".\"%s\" USING %s (%s%s)" % \
+                ('CONCURRENTLY ' if concurrently and options.get('postgis_index_concurrently') else '',
+                 table.name, column.name, (table.schema or 'public'), table.name, method.upper(),
+                 column.name, ' ' + ops if ops else '')
+        storage = options.get('postgis_index_with')
+        if storage:
+            sql += " WITH (%s)" % ", ".join("%s = %s" % (key, storage[key]) for key in sorted(storage))
+        return [sql]
+    
+    # ST_EstimatedExtent and _postgis_selectivity raise an error if the
+    # column has no statistics, e.g. if the table was not analyzed yet
+    __has_statistics = """EXISTS (SELECT 1 FROM pg_stats WHERE schemaname = :schema
+                                  AND tablename = :table AND attname = :column)"""
+    
+    def estimated_extent(self, session, column):
+        """Uses ``ST_EstimatedExtent``, which requires that the table was analyzed.
+        None is returned if the column has no statistics.
+        """
+        sql = """SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+                 FROM (SELECT CASE WHEN %s THEN ST_EstimatedExtent(:schema, :table, :column)
+                              END AS e) AS extent""" % PGSpatialDialect.__has_statistics
+        row = session.execute(text(sql), {'schema': column.table.schema or 'public',
+                                          'table': column.table.name, 'column': column.name}).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return tuple(row)
+    
+    def estimated_count(self, session, column, bbox):
+        """Multiplies the selectivity of ``bbox`` in the statistics of the column
+        (PostGIS >= 2.1) with the estimated number of rows of the table. If the
+        column has no statistics, the bounding boxes are counted with the
+        spatial index.
+        """
+        minx, miny, maxx, maxy = bbox
+        sql = """SELECT CASE WHEN %s THEN
+                          _postgis_selectivity(c.oid, :column,
+                                               ST_MakeEnvelope(:minx, :miny, :maxx, :maxy, :srid)) * c.reltuples
+                        END
+                 FROM pg_class c WHERE c.oid = CAST(:relation AS regclass)""" % PGSpatialDialect.__has_statistics
+        schema = column.table.schema or 'public'
+        row = session.execute(text(sql), {'schema': schema, 'table': column.table.name, 'column': column.name,
+                                          'minx': minx, 'miny': miny, 'maxx': maxx, 'maxy': maxy,
+                                          'srid': column.type.srid,
+                                          'relation': '"%s"."%s"' % (schema, column.table.name)}).fetchone()
+        if row is None or row[0] is None:
+            return SpatialDialect.estimated_count(self, session, column, bbox)
+        return int(round(row[0]))
+    
+    def reflect_geometry_columns(self, bind, schema=None):
+        sql = """SELECT g.f_table_name, g.f_geometry_column, g.type, g.coord_dimension, g.srid,
+                   EXISTS (SELECT 1 FROM pg_index i
+                           JOIN pg_class t ON t.oid = i.indrelid
+                           JOIN pg_namespace n ON n.oid = t.relnamespace
+                           JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(i.indkey)
+                           JOIN pg_class ic ON ic.oid = i.indexrelid
+                           JOIN pg_am am ON am.oid = ic.relam
+                           WHERE n.nspname = g.f_table_schema AND t.relname = g.f_table_name
+                             AND a.attname = g.f_geometry_column
+                             AND am.amname IN ('gist', 'spgist', 'brin'))
+                 FROM geometry_columns g
+                 WHERE g.f_table_schema = COALESCE(:schema, current_schema())"""
+        return bind.execute(text(sql, bindparams=[bindparam('schema', schema)])).fetchall()
+    
     def handle_ddl_before_drop(self, bind, table, column):
         bind.execute(select([func.DropGeometryColumn((table.schema or 'public'), table.name, column.name)]).execution_options(autocommit=True))
     
-    def handle_ddl_after_create(self, bind, table, column):    
+    def handle_ddl_after_create(self, bind, table, column, create_index=True):    
         bind.execute(select([func.AddGeometryColumn((table.schema or 'public'), 
                                                     table.name, 
                                                     column.name, 
                                                     column.type.srid, 
                                                     column.type.name, 
                                                     column.type.dimension)]).execution_options(autocommit=True))
-        if column.type.spatial_index:
-            bind.execute("CREATE INDEX \"idx_%s_%s\" ON \"%s\".\"%s\" USING GIST (%s)" % 
-                            (table.name, column.name, (table.schema or 'public'), table.name, column.name))
+        if column.type.spatial_index and create_index:
+            for statement in self.spatial_index_ddl(table, column):
+                bind.execute(statement)
             
         if not column.nullable:
             bind.execute("ALTER TABLE \"%s\".\"%s\" ALTER COLUMN \"%s\" SET not null" % 
@@ -0,0 +1,323 @@
+u"""
+:mod:`geoalchemy.query` -- Spatial queries
+==========================================
+
+:class:`SpatialQuery` is a ``Query`` subclass with the common spatial
+filters. It is used by passing it as ``query_cls`` to the session::
+
+    >>> from geoalchemy.query import SpatialQuery
+    >>> Session = sessionmaker(bind=engine, query_cls=SpatialQuery)
+    >>> session = Session()
+    >>> session.query(Lake).in_bbox((-89, 42, -88, 43)).all()
+    >>> session.query(Spot).within_radius((-88.5, 42.9), 0.1).all()
+    >>> session.query(Spot).nearest((-88.5, 42.9), 5).all()
+
+The filters always use the form of the spatial predicate that can use the
+spatial index of the database (see the table below), and geometries are
+passed to the database as bind parameters. Points can be given as ``(x, y)``
+tuples, WKT strings or geometry elements; tuples and WKT strings are assumed
+to be in the coordinate system of the geometry column, and distances are in
+its units.
+
+========== ================= ======================== =========================
+Database   ``in_bbox``       ``within_radius``        ``nearest``
+========== ================= ======================== =========================
+PostGIS    ``&&``            ``ST_Expand`` and ``&&`` ``<->`` (PostGIS >= 2.0),
+                                                      ``ST_Distance`` (1.x)
+SpatiaLite R-tree subquery   R-tree subquery          ``Distance`` (no index)
+MySQL      ``MBRIntersects`` ``Intersects`` (MBR)     not supported
+Oracle     ``SDO_FILTER``    ``SDO_WITHIN_DISTANCE``  ``SDO_NN``
+SQL Server ``Filter``        ``STDistance() <= d``    ``STDistance()``, ``TOP``
+========== ================= ======================== =========================
+
+With SpatiaLite, pass ``max_distance`` to :meth:`SpatialQuery.nearest` so
+that the candidates are selected with the R-tree index.
+
+Oracle applies the ``sdo_num_res`` of ``SDO_NN`` before the other conditions
+of the query. If the query has other filters or joins (or ``max_distance``),
+``SDO_NN`` is called with ``sdo_batch_size=0`` instead, and returns
+candidates until the ``ROWNUM`` limit is reached.
+
+:meth:`SpatialQuery.page_by_distance` pages with ``OFFSET``, so that the
+database has to compute and skip all rows of the previous pages. For deep
+pages, :meth:`SpatialQuery.page_after` resumes after the distance and
+primary key of the last row of the previous page (keyset pagination), and
+:meth:`SpatialQuery.pages_by_distance` iterates over all pages this way::
+
+    >>> for page in session.query(Store).pages_by_distance((7.44, 46.95), 20,
+    ...                                                    max_distance=5000):
+    ...     for store, distance in page:
+    ...         print store.store_name, distance
+
+:func:`spatial_join` builds the condition to join two geometry columns with
+a spatial predicate, in a form that uses the spatial index of the second
+column: the bounding boxes are compared first (with the ``in_bbox`` form of
+the table above, e.g. an R-tree subquery for SpatiaLite), then the exact
+predicate is tested on the candidates. Large joins can be split into tiles
+(see :func:`tiles`) that are run one after the other or by several
+processes, each row of the first column is in exactly one tile::
+
+    >>> from geoalchemy.query import spatial_join, tiles
+    >>> session.query(Spot, Lake).filter(
+    ...     spatial_join(Spot.spot_location, Lake.lake_geom, 'within')).all()
+    >>> for tile in tiles((-90, 42, -88, 44), 4, 4):
+    ...     session.query(Spot.spot_id, Lake.lake_id).filter(
+    ...         spatial_join(Spot.spot_location, Lake.lake_geom, 'within', tile)).all()
+
+``functions.extent`` reads the whole table. :func:`estimated_extent` and
+:func:`estimated_count` only read the statistics or the spatial index of the
+column, e.g. to initialize a map::
+
+    >>> from geoalchemy.query import estimated_extent, estimated_count
+    >>> estimated_extent(session, Lake.lake_geom)
+    (-89.5, 42.1, -87.9, 43.6)
+    >>> estimated_count(session, Lake.lake_geom, (-89, 42, -88, 43))
+    12
+
+========== ================================= ==================================
+Database   ``estimated_extent``              ``estimated_count``
+========== ================================= ==================================
+PostGIS    ``ST_EstimatedExtent``            ``_postgis_selectivity`` (>= 2.1)
+SpatiaLite root node of the R*Tree           count in the R*Tree
+MySQL      not supported                     count with ``MBRIntersects``
+Oracle     ``SDO_TUNE.EXTENT_OF``            count with ``SDO_FILTER``
+SQL Server bounding box of the spatial index count with ``Filter``
+========== ================================= ==================================
+
+With PostGIS, the table has to be analyzed first (``ANALYZE``).
+"""
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.properties import ColumnProperty
+
+from geoalchemy.base import WKTSpatialElement
+from geoalchemy.dialect import DialectManager
+from geoalchemy.functions import functions
+from geoalchemy.geometry import Geometry
+from geoalchemy.postgis import PGSpatialDialect
+from geoalchemy.utils import to_wkt
+
+
+class SpatialQuery(Query):
+    """A ``Query`` with index-assisted spatial filters on the geometry column
+    of the queried class. If the class has more than one geometry column,
+    the column has to be passed as ``column`` (e.g. ``Lake.lake_geom``).
+    """
+
+    def _geometry_column(self, column):
+        if column is not None:
+            return column
+        mapper = self._mapper_zero()
+        properties = [p for p in mapper.iterate_properties
+                      if isinstance(p, ColumnProperty) and isinstance(p.columns[0].type, Geometry)]
+        if len(properties) != 1:
+            raise Exception("%s has %d geometry columns, please pass the column"
+                            % (mapper.class_.__name__, len(properties)))
+        return getattr(mapper.class_, properties[0].key)
+
+    def _geometry(self, value, column):
+        if isinstance(value, (tuple, list)) or isinstance(value, basestring):
+            if hasattr(column, 'property'):
+                srid = column.property.columns[0].type.srid
+            else:
+                srid = column.type.srid
+            if isinstance(value, (tuple, list)):
+                value = to_wkt({"type": "Point", "coordinates": list(value)}, 15)
+            return WKTSpatialElement(value, srid)
+        return value
+
+    def in_bbox(self, bbox, column=None):
+        """Filters the rows whose geometry intersects the bounding box
+        ``(minx, miny, maxx, maxy)``, or the bounding box of a geometry, using
+        only the bounding boxes of the geometries.
+        """
+        column = self._geometry_column(column)
+        if isinstance(bbox, (tuple, list)) and len(bbox) == 4:
+            minx, miny, maxx, maxy = bbox
+            bbox = to_wkt({"type": "Polygon", "coordinates": [
+                [[minx, miny], [minx, maxy], [maxx, maxy], [maxx, miny], [minx, miny]]]}, 15)
+        return self.filter(functions._bbox_intersects(column, self._geometry(bbox, column)))
+
+    def within_radius(self, point, radius, column=None):
+        """Filters the rows whose geometry is within the distance ``radius``
+        of ``point`` (or any geometry). The spatial index is used with the
+        same form as ``within_distance`` in spatial filters: with MySQL the
+        distance is tested between bounding boxes.
+        """
+        column = self._geometry_column(column)
+        return self.filter(functions._within_distance(column, self._geometry(point, column), radius))
+
+    def _order_by_distance(self, point, limit, max_distance, column):
+        column = self._geometry_column(column)
+        point = self._geometry(point, column)
+        if self.session is not None:
+            bind = self.session.get_bind(self._mapper_zero())
+            spatial_dialect = DialectManager.get_spatial_dialect(bind.dialect)
+            if isinstance(spatial_dialect, PGSpatialDialect):
+                # PostGIS 1 has no <-> operator
+                spatial_dialect.postgis_version(bind)
+        query = self
+        if max_distance is not None:
+            query = query.filter(functions._within_distance(column, point, max_distance))
+        if query.whereclause is not None or query._from_obj:
+            # Oracle would look for the nearest rows before the other
+            # conditions are applied, and return less than `limit` rows
+            limit = None
+        return query.filter(functions._knn_filter(column, point, limit)) \
+                    .order_by(functions._knn_distance(column, point))
+
+    def nearest(self, point, k=1, max_distance=None, column=None):
+        """Limits the query to the ``k`` rows nearest to ``point`` (or any
+        geometry), ordered by distance, optionally only to those within
+        ``max_distance``.
+
+        Note that PostGIS 2.0 and 2.1 order by the distance between the
+        bounding boxes, exact distances are used since PostGIS 2.2.
+        """
+        return self._order_by_distance(point, k, max_distance, column).limit(k)
+
+    def page_by_distance(self, point, page_size, page=0, max_distance=None, column=None):
+        """Limits the query to the page ``page`` (counted from 0) of the rows
+        ordered by their distance to ``point``, with ``page_size`` rows per
+        page.
+        """
+        return self._order_by_distance(point, (page + 1) * page_size, max_distance, column) \
+                   .limit(page_size).offset(page * page_size)
+
+    def page_after(self, point, page_size, after=None, max_distance=None, column=None):
+        """Limits the query to the ``page_size`` rows following ``after`` in
+        the order of their distance to ``point`` (and of their primary key
+        for equal distances). The rows are ``(instance, distance)`` tuples.
+
+        ``after`` is the ``(distance, primary key)`` of the last row of the
+        previous page, ``None`` for the first page; the primary key is a tuple
+        for composite primary keys. The distance is passed as a bind
+        parameter, so the database only has to find the rows beyond it
+        instead of skipping the previous pages. If ``max_distance`` is set,
+        the candidates are selected with the spatial index, so that each page
+        only reads the rows within ``max_distance``.
+
+        The distances are computed with ``functions.distance``, which is not
+        supported by MySQL.
+        """
+        column = self._geometry_column(column)
+        point = self._geometry(point, column)
+        distance = functions.distance(column, point)
+        primary_key = list(self._mapper_zero().primary_key)
+
+        # rows without geometry have no distance and are skipped
+        query = self.add_column(distance.label('distance')).filter(distance != None)
+        if max_distance is not None:
+            query = query.filter(functions._within_distance(column, point, max_distance))
+        if after is not None:
+            last_distance, last_key = after
+            if len(primary_key) == 1:
+                last_key = (last_key, )
+            query = query.filter(or_(distance > last_distance,
+                                     and_(distance == last_distance,
+                                          _keyset_after(primary_key, last_key))))
+        return query.order_by(*[distance] + primary_key).limit(page_size)
+
+    def pages_by_distance(self, point, page_size, max_distance=None, column=None):
+        """Iterates over the pages of ``(instance, distance)`` rows ordered by
+        their distance to ``point``, with one :meth:`page_after` query per
+        page.
+        """
+        primary_key = self._mapper_zero().primary_key
+        after = None
+        while True:
+            page = self.page_after(point, page_size, after, max_distance, column).all()
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            instance, distance = page[-1]
+            key = self._mapper_zero().primary_key_from_instance(instance)
+            after = (distance, key[0] if len(primary_key) == 1 else tuple(key))
+
+
+def _bbox_polygon(minx, miny, maxx, maxy):
+    return to_wkt({"type": "Polygon", "coordinates": [
+        [[minx, miny], [minx, maxy], [maxx, maxy], [maxx, miny], [minx, miny]]]}, 15)
+
+
+def spatial_join(left, right, predicate='intersects', tile=None):
+    """Returns the condition that the geometry ``left`` is in the relation
+    ``predicate`` with the geometry ``right`` (e.g. ``'within'`` for
+    ``functions.within(left, right)``), for ``Query.filter()`` or as the
+    ``ON`` clause of a join. The columns are mapped attributes or table
+    columns, the bounding boxes are compared with the spatial index of
+    ``right``, so ``right`` should be the larger of the two tables.
+
+    If ``tile`` (``(minx, miny, maxx, maxy)``) is set, only the rows of
+    ``left`` whose bounding box has its lower left corner in the tile are
+    joined, with the lower and left edges of the tile included and the
+    upper and right edges excluded.
+    """
+    if predicate in ('disjoint', 'within_distance') or not hasattr(functions, predicate):
+        raise Exception("'%s' is not a spatial predicate that can be joined on" % predicate)
+    condition = [functions._bbox_intersects(right, left),
+                 getattr(functions, predicate)(left, right)]
+    if tile is not None:
+        minx, miny, maxx, maxy = tile
+        srid = getattr(left, 'property', left)
+        srid = (srid.columns[0] if hasattr(srid, 'columns') else srid).type.srid
+        xmin = functions._xmin(left)
+        ymin = functions._ymin(left)
+        condition = [functions._bbox_intersects(
+                         left, WKTSpatialElement(_bbox_polygon(minx, miny, maxx, maxy), srid)),
+                     xmin >= minx, xmin < maxx, ymin >= miny, ymin < maxy] + condition
+    return and_(*condition)
+
+
+def tiles(extent, nx, ny):
+    """Divides the bounding box ``extent`` into ``nx`` times ``ny`` tiles
+    for :func:`spatial_join`. The last tiles extend slightly beyond the
+    upper and right edges of ``extent``, so that all bounding boxes whose
+    lower left corner is in ``extent`` are in one of the tiles.
+    """
+    minx, miny, maxx, maxy = extent
+    width = float(maxx - minx) / nx
+    height = float(maxy - miny) / ny
+    # the upper and right edges of a tile are not part of it
+    xs = [minx + i * width for i in xrange(nx)] + [maxx + (width or 1) * 1e-6]
+    ys = [miny + j * height for j in xrange(ny)] + [maxy + (height or 1) * 1e-6]
+    return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for j in xrange(ny) for i in xrange(nx)]
+
+
+def _column(column):
+    if hasattr(column, 'property'):
+        return column.property.columns[0]
+    return column
+
+
+def estimated_extent(session, column):
+    """Returns the extent ``(minx, miny, maxx, maxy)`` of the geometry
+    ``column`` (a geometry column or mapped geometry attribute) as estimated
+    by the database from its statistics or spatial index, without reading
+    the table, or ``None`` if the database has no estimate (e.g. an empty
+    spatial index).
+    """
+    spatial_dialect = DialectManager.get_spatial_dialect(session.get_bind(None).dialect)
+    return spatial_dialect.estimated_extent(session, _column(column))
+
+
+def estimated_count(session, column, bbox):
+    """Returns the estimated number of rows whose geometry (``column``)
+    intersects the bounding box ``bbox`` (``(minx, miny, maxx, maxy)``),
+    from the statistics of the column or by counting the bounding boxes in
+    the spatial index.
+    """
+    spatial_dialect = DialectManager.get_spatial_dialect(session.get_bind(None).dialect)
+    return spatial_dialect.estimated_count(session, _column(column), bbox)
+
+
+def _keyset_after(columns, values):
+    """Returns the condition for rows whose values of ``columns`` follow
+    ``values`` in lexicographic order.
+    """
+    condition = columns[-1] > values[-1]
+    for (c, value) in reversed(zip(columns[:-1], values[:-1])):
+        condition = or_(c > value, and_(c == value, condition))
+    return condition
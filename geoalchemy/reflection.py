@@ -0,0 +1,109 @@
+u"""
+:mod:`geoalchemy.reflection` -- Reflection of geometry columns
+==============================================================
+
+SQLAlchemy does not know the geometry types when it reflects a table, so
+the geometry columns of autoloaded tables have no geometry type. This
+module reads the geometry columns of all tables of a schema from the
+catalog of the spatial database (``geometry_columns`` for PostGIS and
+SpatiaLite, ``USER_SDO_GEOM_METADATA`` for Oracle, the information schema
+for MySQL and SQL Server) with a single query, and replaces the reflected
+columns with geometry columns of the right type, srid, dimension and
+spatial index::
+
+    >>> from geoalchemy.reflection import reflect, reflect_geometry_columns
+    >>> spots = Table('spots', metadata, autoload=True)
+    >>> reflect_geometry_columns(spots)
+
+    >>> reflect(metadata, engine)    # all tables of the default schema
+
+The catalog is read once per engine and schema, see :func:`geometry_columns`.
+Mapped classes still need a :func:`GeometryColumn` property for the spatial
+comparator, which takes the reflected column::
+
+    >>> class Spot(Base):
+    ...     __table__ = spots
+    ...     spot_location = GeometryColumn(spots.c.spot_location)
+"""
+from weakref import WeakKeyDictionary
+
+from geoalchemy.dialect import DialectManager
+from geoalchemy.geometry import Geometry, Point, Curve, LineString, Polygon, MultiPoint, \
+    MultiLineString, MultiPolygon, GeometryCollection, GeometryExtensionColumn
+
+_TYPES = dict((type.name, type) for type in (Geometry, Point, Curve, LineString, Polygon, MultiPoint,
+                                            MultiLineString, MultiPolygon, GeometryCollection))
+
+# {engine: {schema: {(table name, column name): geometry type}}}
+_cache = WeakKeyDictionary()
+
+
+def _dimension(value):
+    # SpatiaLite 2 stores the dimension as 'XY', 'XYZ', 'XYM' or 'XYZM'
+    if isinstance(value, basestring) and not value.isdigit():
+        return len(value)
+    return int(value)
+
+
+def geometry_type(name, dimension=2, srid=None, spatial_index=True):
+    """Returns the geometry type for the name of a geometry type in the
+    catalog (e.g. ``'POINT'`` or ``'POINTM'``), :class:`Geometry` for unknown
+    types. The default srid of the types is used if ``srid`` is None.
+    """
+    name = (name or Geometry.name).upper()
+    if name not in _TYPES and name.endswith('M'):
+        # measured geometries
+        name = name[:-1]
+    kwargs = {'spatial_index': bool(spatial_index)}
+    if srid is not None:
+        kwargs['srid'] = int(srid)
+    return _TYPES.get(name, Geometry)(_dimension(dimension or 2), **kwargs)
+
+
+def geometry_columns(bind, schema=None, refresh=False):
+    """Returns the geometry types of all geometry columns in ``schema`` (the
+    default schema if None) as dictionary ``{(table name, column name):
+    geometry type}``. The catalog is only queried the first time for an
+    engine and schema, or if ``refresh`` is set.
+    """
+    engine = getattr(bind, 'engine', bind)
+    schemas = _cache.setdefault(engine, {})
+    if refresh or schema not in schemas:
+        spatial_dialect = DialectManager.get_spatial_dialect(bind.dialect)
+        schemas[schema] = dict(((table_name, column_name),
+                                geometry_type(name, dimension, srid, spatial_index))
+                               for (table_name, column_name, name, dimension, srid, spatial_index)
+                               in spatial_dialect.reflect_geometry_columns(bind, schema))
+    return schemas[schema]
+
+
+def reflect_geometry_columns(table, bind=None):
+    """Replaces the reflected columns of ``table`` that are geometry columns
+    by geometry columns with their geometry type, and returns them. ``bind``
+    defaults to the bind of the metadata.
+    """
+    if bind is None:
+        bind = table.bind
+    types = geometry_columns(bind, table.schema)
+    columns = []
+    for column in list(table.c):
+        if (table.name, column.name) in types:
+            geometry_column = GeometryExtensionColumn(column.name, types[(table.name, column.name)],
+                                                      key=column.key, nullable=column.nullable)
+            table.append_column(geometry_column)
+            columns.append(geometry_column)
+    return columns
+
+
+def reflect(metadata, bind=None, schema=None, **kwargs):
+    """Reflects the tables of ``schema`` into ``metadata`` (see
+    ``MetaData.reflect()``, the keyword arguments are passed on) and their
+    geometry columns.
+    """
+    if bind is None:
+        bind = metadata.bind
+    metadata.reflect(bind, schema=schema, **kwargs)
+    for table in metadata.tables.values():
+        if table.schema == schema:
+            reflect_geometry_columns(table, bind)
+    return metadata
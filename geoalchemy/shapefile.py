@@ -0,0 +1,558 @@
+u"""
+:mod:`geoalchemy.shapefile` -- ESRI Shapefiles
+==============================================
+
+This module reads and writes `ESRI Shapefiles
+<http://www.esri.com/library/whitepapers/pdfs/shapefile.pdf>`_ (``.shp``,
+``.shx`` and ``.dbf`` files) in Python, one record at a time, so that the
+memory used does not depend on the size of the files.
+
+:func:`read_features` yields the records as WKB values, which are created
+from the shape records without intermediate representation, and
+:func:`import_features` inserts them into the table of a geometry column with
+batched multi-row inserts (``executemany``)::
+
+    >>> from geoalchemy import shapefile
+    >>> shapefile.import_features(session, 'lakes.shp', Lake.lake_geom)
+
+:func:`write_features` writes the rows of a table, fetched in batches, and
+:class:`Writer` writes features from any iterator::
+
+    >>> shapefile.write_features(session, Lake.lake_geom, 'lakes.shp',
+    ...                          properties=[Lake.lake_name])
+
+Points, multi-points, lines and polygons with X/Y and X/Y/Z coordinates are
+supported. M values are dropped when reading and written as "no data" for
+Z shapes. Multi-patches are not supported.
+"""
+import mmap
+import os
+import struct
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import izip
+
+from sqlalchemy import select, bindparam, Integer, Float, Numeric, Boolean, Date, DateTime, String
+
+from geoalchemy.functions import functions
+from geoalchemy.utils import from_wkb
+
+_NULL = 0
+_POINT = 1
+_POLYLINE = 3
+_POLYGON = 5
+_MULTIPOINT = 8
+
+_FILE_CODE = 9994
+_VERSION = 1000
+# M values smaller than -10^38 mean "no data"
+_NO_DATA = -1e39
+
+_HEADER_SIZE = 100
+
+_shape_types = {"Point": _POINT, "MultiPoint": _MULTIPOINT, "LineString": _POLYLINE,
+                "MultiLineString": _POLYLINE, "Polygon": _POLYGON, "MultiPolygon": _POLYGON}
+
+_column_shape_types = {'POINT': _POINT, 'MULTIPOINT': _MULTIPOINT, 'CURVE': _POLYLINE,
+                       'LINESTRING': _POLYLINE, 'MULTILINESTRING': _POLYLINE,
+                       'POLYGON': _POLYGON, 'MULTIPOLYGON': _POLYGON}
+
+_WGS84 = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137,298.257223563]],'
+          'PRIMEM["Greenwich",0],UNIT["Degree",0.017453292519943295]]')
+
+
+def _base_name(path):
+    base, extension = os.path.splitext(path)
+    if extension.lower() in ('.shp', '.shx', '.dbf'):
+        return base
+    return path
+
+def _shape_type(shape_type):
+    """Returns the base shape type of a shape type and whether it has Z
+    values.
+    """
+    if shape_type in (_NULL, _POINT, _POLYLINE, _POLYGON, _MULTIPOINT):
+        return shape_type, False
+    if shape_type in (11, 13, 15, 18):
+        return shape_type - 10, True
+    if shape_type in (21, 23, 25, 28):
+        return shape_type - 20, False
+    raise Exception("Unsupported shape type %d" % shape_type)
+
+
+# Reading
+
+def _points(xy, zs, start, end):
+    """Returns the WKB points ``start`` to ``end`` of a part, taken from the
+    X/Y array (and the Z array) of a shape record.
+    """
+    if zs is None:
+        return xy[16 * start:16 * end]
+    coords = struct.unpack('<%dd' % (2 * (end - start)), xy[16 * start:16 * end])
+    z = struct.unpack('<%dd' % (end - start), zs[8 * start:8 * end])
+    values = []
+    for i in xrange(end - start):
+        values.extend((coords[2 * i], coords[2 * i + 1], z[i]))
+    return struct.pack('<%dd' % len(values), *values)
+
+def _ring_area(xy, start, end):
+    coords = struct.unpack('<%dd' % (2 * (end - start)), xy[16 * start:16 * end])
+    area = 0.0
+    for i in xrange(0, len(coords) - 2, 2):
+        area += coords[i] * coords[i + 3] - coords[i + 2] * coords[i + 1]
+    return area / 2
+
+def _shape_to_wkb(content, multi=False):
+    """Converts the content of a shape record to WKB, or ``None`` for null
+    shapes. Lines and polygons with several parts are returned as
+    MultiLineString and MultiPolygon, all shapes if ``multi`` is set.
+    """
+    shape_type, has_z = _shape_type(struct.unpack('<i', content[:4])[0])
+    offset = 1000 if has_z else 0
+
+    if shape_type == _NULL:
+        return None
+
+    if shape_type == _POINT:
+        if has_z:
+            wkb = struct.pack('<BI', 1, 1001) + content[4:28]
+        else:
+            wkb = struct.pack('<BI', 1, 1) + content[4:20]
+        if multi:
+            return struct.pack('<BII', 1, 4 + offset, 1) + wkb
+        return wkb
+
+    if shape_type == _MULTIPOINT:
+        count = struct.unpack('<i', content[36:40])[0]
+        xy = content[40:40 + 16 * count]
+        zs = None
+        if has_z:
+            zs = content[56 + 16 * count:56 + 24 * count]
+        header = struct.pack('<BI', 1, 1 + offset)
+        return struct.pack('<BII', 1, 4 + offset, count) + \
+            "".join(header + _points(xy, zs, i, i + 1) for i in xrange(count))
+
+    num_parts, num_points = struct.unpack('<2i', content[36:44])
+    parts = struct.unpack('<%di' % num_parts, content[44:44 + 4 * num_parts]) + (num_points, )
+    start = 44 + 4 * num_parts
+    xy = content[start:start + 16 * num_points]
+    zs = None
+    if has_z:
+        z_start = start + 16 * num_points + 16
+        zs = content[z_start:z_start + 8 * num_points]
+
+    if shape_type == _POLYLINE:
+        lines = [struct.pack('<BII', 1, 2 + offset, parts[i + 1] - parts[i]) +
+                 _points(xy, zs, parts[i], parts[i + 1]) for i in xrange(num_parts)]
+        if len(lines) == 1 and not multi:
+            return lines[0]
+        return struct.pack('<BII', 1, 5 + offset, len(lines)) + "".join(lines)
+
+    # exterior rings are clockwise, holes counter-clockwise; a hole belongs
+    # to the preceding exterior ring
+    polygons = []
+    for i in xrange(num_parts):
+        ring = struct.pack('<I', parts[i + 1] - parts[i]) + _points(xy, zs, parts[i], parts[i + 1])
+        if not polygons or _ring_area(xy, parts[i], parts[i + 1]) <= 0:
+            polygons.append([ring])
+        else:
+            polygons[-1].append(ring)
+    polygons = [struct.pack('<BII', 1, 3 + offset, len(rings)) + "".join(rings) for rings in polygons]
+    if len(polygons) == 1 and not multi:
+        return polygons[0]
+    return struct.pack('<BII', 1, 6 + offset, len(polygons)) + "".join(polygons)
+
+def _read_dbf_header(f):
+    """Returns the number of records, the record length and the fields
+    ``(name, type, length, decimals)`` of a dBase file.
+    """
+    header = f.read(32)
+    count, header_length, record_length = struct.unpack('<IHH', header[4:12])
+    descriptors = f.read(header_length - 32)
+    fields = []
+    for i in xrange(0, len(descriptors) - 31, 32):
+        descriptor = descriptors[i:i + 32]
+        if descriptor[0] == '\r':
+            break
+        name = descriptor[:11].split('\x00')[0]
+        fields.append((name, descriptor[11], ord(descriptor[16]), ord(descriptor[17])))
+    return count, record_length, fields
+
+def _dbf_value(raw, field_type, decimals, encoding):
+    if field_type == 'C':
+        return raw.rstrip(' \x00').decode(encoding)
+    value = raw.strip(' \x00')
+    if field_type in ('N', 'F'):
+        if not value or value.startswith('*'):
+            return None
+        if decimals == 0 and '.' not in value and 'e' not in value.lower():
+            return int(value)
+        return float(value)
+    if field_type == 'L':
+        if value in ('Y', 'y', 'T', 't'):
+            return True
+        if value in ('N', 'n', 'F', 'f'):
+            return False
+        return None
+    if field_type == 'D':
+        if len(value) == 8 and value.isdigit() and value != '00000000':
+            return date(int(value[:4]), int(value[4:6]), int(value[6:]))
+        return None
+    return value.decode(encoding)
+
+def read_features(path, encoding=None, multi=False):
+    """Yields the records of the shapefile ``path`` as ``(properties, wkb)``
+    tuples, where ``properties`` is a dictionary of the attributes of the
+    ``.dbf`` file and ``wkb`` is ``None`` for null shapes. Records marked as
+    deleted in the ``.dbf`` file are skipped.
+
+    The attributes are decoded with ``encoding``, by default the encoding
+    named in the ``.cpg`` file, or Latin-1. If ``multi`` is set, all
+    geometries are returned as multi-geometries (e.g. for a MultiPolygon
+    column), otherwise only those with more than one part.
+    """
+    base = _base_name(path)
+    if encoding is None:
+        encoding = 'latin-1'
+        if os.path.exists(base + '.cpg'):
+            encoding = open(base + '.cpg').read().strip() or encoding
+
+    shp = open(base + '.shp', 'rb')
+    dbf = open(base + '.dbf', 'rb') if os.path.exists(base + '.dbf') else None
+    try:
+        header = shp.read(_HEADER_SIZE)
+        if len(header) < _HEADER_SIZE or struct.unpack('>i', header[:4])[0] != _FILE_CODE:
+            raise Exception("%s.shp is not a shapefile" % base)
+        fields = []
+        record_length = 0
+        if dbf is not None:
+            count, record_length, fields = _read_dbf_header(dbf)
+
+        while True:
+            record_header = shp.read(8)
+            if len(record_header) < 8:
+                break
+            number, length = struct.unpack('>2i', record_header)
+            content = shp.read(2 * length)
+
+            properties = {}
+            if dbf is not None:
+                record = dbf.read(record_length)
+                if len(record) < record_length:
+                    raise Exception("%s.dbf has fewer records than %s.shp" % (base, base))
+                if record[0] == '*':
+                    continue
+                position = 1
+                for (name, field_type, length, decimals) in fields:
+                    properties[name] = _dbf_value(record[position:position + length], field_type,
+                                                  decimals, encoding)
+                    position += length
+            yield properties, _shape_to_wkb(content, multi)
+    finally:
+        shp.close()
+        if dbf is not None:
+            dbf.close()
+
+def _table_column(column):
+    if hasattr(column, 'property'):
+        return column.property.columns[0]
+    if hasattr(column, '__clause_element__'):
+        return column.__clause_element__()
+    return column
+
+def import_features(session, path, column, srid=None, batch_size=1000, encoding=None):
+    """Inserts the records of the shapefile ``path`` into the table of the
+    geometry column (or mapped geometry attribute) ``column``, with one
+    ``executemany`` insert per ``batch_size`` records. The attributes of the
+    ``.dbf`` file are inserted into the columns of the same name (compared
+    case-insensitively, and to the first 10 characters of the column names),
+    other attributes are ignored. ``srid`` defaults to the SRID of the
+    column. Returns the number of inserted records.
+    """
+    geometry_column = _table_column(column)
+    table = geometry_column.table
+    if srid is None:
+        srid = geometry_column.type.srid
+    multi = geometry_column.type.name.startswith('MULTI')
+    columns = {}
+    for c in table.columns:
+        if c is not geometry_column:
+            columns.setdefault(c.name.lower(), c)
+            columns.setdefault(c.name.lower()[:10], c)
+
+    insert = table.insert().values({geometry_column.name:
+                                    functions._from_wkb(bindparam('geoalchemy_wkb'), srid)})
+    names = None
+    batch = []
+    count = 0
+    for properties, wkb in read_features(path, encoding, multi):
+        if names is None:
+            names = [(name, columns[name.lower()]) for name in properties if name.lower() in columns]
+        row = dict((c.key, properties[name]) for (name, c) in names)
+        row['geoalchemy_wkb'] = None if wkb is None else buffer(wkb)
+        batch.append(row)
+        if len(batch) >= batch_size:
+            session.execute(insert, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        session.execute(insert, batch)
+        count += len(batch)
+    return count
+
+
+# Writing
+
+def _patch(f, offset, data):
+    """Writes ``data`` at ``offset`` of the open file ``f`` through a memory
+    map of the beginning of the file.
+    """
+    f.flush()
+    header = mmap.mmap(f.fileno(), offset + len(data))
+    try:
+        header[offset:offset + len(data)] = data
+        header.flush()
+    finally:
+        header.close()
+
+def _dbf_field(column):
+    """Returns the dBase field ``(type, length, decimals)`` for a column."""
+    if hasattr(column, '__clause_element__'):
+        column = column.__clause_element__()
+    type_ = column.type
+    if isinstance(type_, Boolean):
+        return 'L', 1, 0
+    if isinstance(type_, Integer):
+        return 'N', 18, 0
+    if isinstance(type_, Numeric) and not isinstance(type_, Float) and type_.scale is not None:
+        return 'N', 24, type_.scale
+    if isinstance(type_, (Float, Numeric)):
+        return 'N', 24, 11
+    if isinstance(type_, DateTime):
+        return 'C', 19, 0
+    if isinstance(type_, Date):
+        return 'D', 8, 0
+    if isinstance(type_, String) and type_.length:
+        return 'C', min(type_.length, 254), 0
+    return 'C', 254, 0
+
+def _format_value(value, field_type, length, decimals, encoding):
+    if value is None:
+        return ' ' * length
+    if field_type == 'L':
+        return 'T' if value else 'F'
+    if field_type == 'D':
+        return '%04d%02d%02d' % (value.year, value.month, value.day)
+    if field_type in ('N', 'F'):
+        if decimals == 0:
+            text = str(int(value))
+        else:
+            text = '%.*f' % (decimals, float(value))
+            if len(text) > length:
+                text = '%.*e' % (length - 8, float(value))
+        if len(text) > length:
+            raise Exception("Value %r is too large for a field of length %d" % (value, length))
+        return text.rjust(length)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, (Decimal, date)):
+        value = str(value)
+    if not isinstance(value, unicode):
+        value = unicode(value) if not isinstance(value, str) else value.decode('utf-8')
+    return value.encode(encoding)[:length].ljust(length)
+
+def _signed_area(ring):
+    return sum(a[0] * b[1] - b[0] * a[1] for (a, b) in izip(ring, ring[1:])) / 2.0
+
+def _oriented(ring, clockwise):
+    if ring[0] != ring[-1]:
+        ring = ring + ring[:1]
+    if (_signed_area(ring) < 0) != clockwise:
+        ring = ring[::-1]
+    return ring
+
+
+class Writer(object):
+    """Writes the shapefile ``path`` (``.shp``, ``.shx``, ``.dbf`` and, for
+    EPSG:4326, ``.prj``) record by record.
+
+    ``fields`` is a list of ``(name, type, length, decimals)`` dBase field
+    definitions (``type`` is ``'C'``, ``'N'``, ``'L'`` or ``'D'``). The shape
+    type (e.g. ``5`` for polygons, ``15`` for polygons with Z values) is taken
+    from the first geometry if not given. The file headers, which contain the
+    number of records and the bounding box, are written by :meth:`close`
+    through a memory map of the file headers.
+    """
+
+    def __init__(self, path, fields=(), shape_type=None, srid=None, encoding='utf-8'):
+        base = _base_name(path)
+        self.fields = [(name, field_type, length, decimals)
+                       for (name, field_type, length, decimals) in fields]
+        self.shape_type = shape_type
+        self.encoding = encoding
+        self.count = 0
+        self.bounds = None
+        self.z_range = None
+
+        self.shp = open(base + '.shp', 'w+b')
+        self.shx = open(base + '.shx', 'w+b')
+        self.dbf = open(base + '.dbf', 'w+b')
+        self.shp.write('\x00' * _HEADER_SIZE)
+        self.shx.write('\x00' * _HEADER_SIZE)
+        self.shp_length = _HEADER_SIZE
+
+        record_length = 1 + sum(length for (name, field_type, length, decimals) in self.fields)
+        today = date.today()
+        self.dbf.write(struct.pack('<4BIHH20x', 3, today.year - 1900, today.month, today.day, 0,
+                                   32 + 32 * len(self.fields) + 1, record_length))
+        for (name, field_type, length, decimals) in self.fields:
+            self.dbf.write(struct.pack('<11sc4xBB14x', name.encode('ascii')[:10], field_type,
+                                       length, decimals))
+        self.dbf.write('\r')
+
+        if srid == 4326:
+            open(base + '.prj', 'w').write(_WGS84)
+        open(base + '.cpg', 'w').write(encoding.upper())
+
+    def _update_bounds(self, points):
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        bounds = (min(xs), min(ys), max(xs), max(ys))
+        if self.bounds is not None:
+            bounds = (min(bounds[0], self.bounds[0]), min(bounds[1], self.bounds[1]),
+                      max(bounds[2], self.bounds[2]), max(bounds[3], self.bounds[3]))
+        self.bounds = bounds
+        if self.shape_type > 10:
+            zs = [p[2] if len(p) > 2 else 0.0 for p in points]
+            z_range = (min(zs), max(zs))
+            if self.z_range is not None:
+                z_range = (min(z_range[0], self.z_range[0]), max(z_range[1], self.z_range[1]))
+            self.z_range = z_range
+        return bounds
+
+    def _content(self, geom):
+        if geom is None:
+            return struct.pack('<i', _NULL)
+        geom_type = geom["type"]
+        if geom_type not in _shape_types:
+            raise Exception("Couldn't write a shape for a geometry of type %s" % geom_type)
+        coords = geom["coordinates"]
+        if not coords:
+            return struct.pack('<i', _NULL)
+
+        base_type = _shape_types[geom_type]
+        if self.shape_type is None:
+            has_z = len(coords if geom_type == "Point" else _first_point(coords)) > 2
+            self.shape_type = base_type + (10 if has_z else 0)
+        elif _shape_type(self.shape_type)[0] != base_type:
+            raise Exception("Couldn't write a geometry of type %s into a shapefile of shape type %d"
+                            % (geom_type, self.shape_type))
+        has_z = self.shape_type > 10
+
+        if geom_type == "Point":
+            self._update_bounds([coords])
+            if has_z:
+                return struct.pack('<i4d', self.shape_type, coords[0], coords[1],
+                                   coords[2] if len(coords) > 2 else 0.0, _NO_DATA)
+            return struct.pack('<i2d', self.shape_type, coords[0], coords[1])
+
+        if geom_type == "MultiPoint":
+            parts = []
+            points = coords
+        else:
+            if geom_type == "LineString":
+                lines = [coords]
+            elif geom_type == "MultiLineString":
+                lines = coords
+            else:
+                polygons = [coords] if geom_type == "Polygon" else coords
+                lines = [_oriented(ring, i == 0) for polygon in polygons
+                         for (i, ring) in enumerate(polygon)]
+            parts = []
+            points = []
+            for line in lines:
+                parts.append(len(points))
+                points.extend(line)
+
+        bounds = self._update_bounds(points)
+        content = [struct.pack('<i4d', self.shape_type, *bounds)]
+        if geom_type == "MultiPoint":
+            content.append(struct.pack('<i', len(points)))
+        else:
+            content.append(struct.pack('<2i%di' % len(parts), len(parts), len(points), *parts))
+        xy = []
+        for p in points:
+            xy.extend(p[:2])
+        content.append(struct.pack('<%dd' % len(xy), *xy))
+        if has_z:
+            zs = [p[2] if len(p) > 2 else 0.0 for p in points]
+            content.append(struct.pack('<%dd' % (len(zs) + 2), min(zs), max(zs), *zs))
+            content.append(struct.pack('<%dd' % (len(zs) + 2), *([_NO_DATA] * (len(zs) + 2))))
+        return "".join(content)
+
+    def write(self, wkb, properties=None):
+        """Writes a record, ``wkb`` is the WKB value of the geometry (or
+        ``None``) and ``properties`` a dictionary of the field values.
+        """
+        content = self._content(None if wkb is None else from_wkb(wkb))
+        self.count += 1
+        self.shx.write(struct.pack('>2i', self.shp_length / 2, len(content) / 2))
+        self.shp.write(struct.pack('>2i', self.count, len(content) / 2))
+        self.shp.write(content)
+        self.shp_length += 8 + len(content)
+
+        properties = properties or {}
+        self.dbf.write(' ' + "".join(_format_value(properties.get(name), field_type, length,
+                                                   decimals, self.encoding)
+                                     for (name, field_type, length, decimals) in self.fields))
+
+    def _header(self, length):
+        bounds = self.bounds or (0.0, 0.0, 0.0, 0.0)
+        z_range = self.z_range or (0.0, 0.0)
+        return struct.pack('>7i', _FILE_CODE, 0, 0, 0, 0, 0, length / 2) + \
+            struct.pack('<2i8d', _VERSION, self.shape_type or _NULL, bounds[0], bounds[1],
+                        bounds[2], bounds[3], z_range[0], z_range[1], 0.0, 0.0)
+
+    def close(self):
+        """Writes the file headers and closes the files."""
+        self.dbf.write('\x1a')
+        _patch(self.shp, 0, self._header(self.shp_length))
+        _patch(self.shx, 0, self._header(_HEADER_SIZE + 8 * self.count))
+        _patch(self.dbf, 4, struct.pack('<I', self.count))
+        for f in (self.shp, self.shx, self.dbf):
+            f.close()
+
+def _first_point(coords):
+    while coords and isinstance(coords[0], (list, tuple)) and isinstance(coords[0][0], (list, tuple)):
+        coords = coords[0]
+    return coords[0] if coords else ()
+
+def write_features(session, column, path, properties=(), whereclause=None, batch_size=1000,
+                   encoding='utf-8'):
+    """Writes the rows of the table of the geometry column (or mapped geometry
+    attribute) ``column`` into the shapefile ``path``, optionally filtered by
+    ``whereclause``. ``properties`` are the columns written into the ``.dbf``
+    file. The rows are fetched in batches of ``batch_size`` rows and written
+    with a :class:`Writer`. Returns the number of written records.
+    """
+    geometry_column = _table_column(column)
+    properties = [p.__clause_element__() if hasattr(p, '__clause_element__') else p
+                  for p in properties]
+    fields = [(p.key, ) + _dbf_field(p) for p in properties]
+    shape_type = _column_shape_types.get(geometry_column.type.name)
+    if shape_type is not None and geometry_column.type.dimension > 2:
+        shape_type += 10
+
+    writer = Writer(path, fields, shape_type, geometry_column.type.srid, encoding)
+    try:
+        result = session.execute(select([functions.wkb(geometry_column)] + properties, whereclause))
+        names = [p.key for p in properties]
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                writer.write(row[0], dict(izip(names, row[1:])))
+    finally:
+        writer.close()
+    return writer.count
@@ -1,3 +1,4 @@
+import struct
 from sqlalchemy import select, func
 from sqlalchemy.sql import and_, text, column, table
 
@@ -66,6 +67,37 @@ class sqlite_functions(mysql_functions):
         else:
             return func.Distance(geom1, geom2) <= distance
 
+    @staticmethod
+    def _bbox_intersects(compiler, geom1, geom2):
+        """Uses the R*Tree index of geometry columns with a spatial index, 
+        like in _within_distance()."""
+        if isinstance(geom1, GeometryExtensionColumn) and \
+           geom1.type.spatial_index and \
+           SQLiteSpatialDialect.supports_rtree(compiler.dialect):
+            return table(geom1.table.fullname, column("rowid")).c.rowid.in_(
+                select([table("idx_%s_%s" % (geom1.table.fullname, geom1.key), column("pkid")).c.pkid]).where(
+                    and_(text('xmin') <= func.MbrMaxX(geom2),
+                         text('xmax') >= func.MbrMinX(geom2),
+                         text('ymin') <= func.MbrMaxY(geom2),
+                         text('ymax') >= func.MbrMinY(geom2))))
+        else:
+            return func.MbrIntersects(geom1, geom2)
+
+
+def _rtree_node_extent(data):
+    """Returns the union of the bounding boxes of the cells of the root node of
+    a 2-dimensional SQLite R*Tree, None for an empty tree. The node starts with
+    the depth of the tree and the number of cells (16-bit integers), a cell is
+    the id of the child (64-bit integer) followed by xmin, xmax, ymin and ymax
+    (32-bit floats), all big-endian.
+    """
+    count = struct.unpack('>H', data[2:4])[0]
+    if count == 0:
+        return None
+    boxes = [struct.unpack('>4f', data[12 + i * 24:28 + i * 24]) for i in xrange(count)]
+    return (min(b[0] for b in boxes), min(b[2] for b in boxes),
+            max(b[1] for b in boxes), max(b[3] for b in boxes))
+
 
 class SQLiteSpatialDialect(SpatialDialect):
     """Implementation of SpatialDialect for SQLite."""
@@ -84,7 +116,8 @@ class SQLiteSpatialDialect(SpatialDialect):
                    mysql_functions.mbr_within : 'MBRWithin',
                    mysql_functions.mbr_overlaps : 'MBROverlaps',
                    mysql_functions.mbr_contains : 'MBRContains',
-                   functions._within_distance : sqlite_functions._within_distance
+                   functions._within_distance : sqlite_functions._within_distance,
+                   functions._bbox_intersects : sqlite_functions._bbox_intersects
                    }
 
     def _get_function_mapping(self):
@@ -93,6 +126,33 @@ class SQLiteSpatialDialect(SpatialDialect):
     def process_result(self, value, type):
         return SQLitePersistentSpatialElement(WKBSpatialElement(value, type.srid))
     
+    def estimated_extent(self, session, column):
+        """Reads the bounding boxes of the root node of the R*Tree of the spatial
+        index, which are rounded outwards to single precision.
+        """
+        row = session.execute('SELECT data FROM "idx_%s_%s_node" WHERE nodeno = 1' %
+                              (column.table.name, column.name)).fetchone()
+        if row is None:
+            return None
+        return _rtree_node_extent(str(row[0]))
+    
+    def estimated_count(self, session, column, bbox):
+        """Counts the bounding boxes in the R*Tree of the spatial index, without
+        reading the table.
+        """
+        minx, miny, maxx, maxy = bbox
+        sql = 'SELECT COUNT(*) FROM "idx_%s_%s" WHERE xmin <= :maxx AND xmax >= :minx ' \
+              'AND ymin <= :maxy AND ymax >= :miny' % (column.table.name, column.name)
+        return session.execute(text(sql), {'minx': minx, 'miny': miny,
+                                           'maxx': maxx, 'maxy': maxy}).fetchone()[0]
+    
+    def reflect_geometry_columns(self, bind, schema=None):
+        """Reads the table ``geometry_columns`` of SpatiaLite 2 and 3, the
+        ``schema`` is ignored.
+        """
+        return bind.execute("SELECT f_table_name, f_geometry_column, type, coord_dimension, srid, "
+                            "spatial_index_enabled FROM geometry_columns").fetchall()
+    
     def handle_ddl_before_drop(self, bind, table, column):
         if column.type.spatial_index and SQLiteSpatialDialect.supports_rtree(bind.dialect):
             bind.execute(select([func.DisableSpatialIndex(table.name, column.name)]).execution_options(autocommit=True))
@@ -100,16 +160,32 @@ class SQLiteSpatialDialect(SpatialDialect):
         
         bind.execute(select([func.DiscardGeometryColumn(table.name, column.name)]).execution_options(autocommit=True))
     
-    def handle_ddl_after_create(self, bind, table, column):
+    def handle_ddl_after_create(self, bind, table, column, create_index=True):
         bind.execute(select([func.AddGeometryColumn(table.name, 
                                                     column.name, 
                                                     column.type.srid, 
                                                     column.type.name, 
                                                     column.type.dimension,
                                                     0 if column.nullable else 1)]).execution_options(autocommit=True))
-        if column.type.spatial_index and SQLiteSpatialDialect.supports_rtree(bind.dialect):
-            bind.execute("SELECT CreateSpatialIndex('%s', '%s')" % (table.name, column.name))
-            bind.execute("VACUUM %s" % table.name)
+        if column.type.spatial_index and create_index and SQLiteSpatialDialect.supports_rtree(bind.dialect):
+            for statement in self.spatial_index_ddl(table, column):
+                bind.execute(statement)
+    
+    def spatial_index_ddl(self, table, column, concurrently=False):
+        return ["SELECT CreateSpatialIndex('%s', '%s')" % (table.name, column.name),
+                "VACUUM %s" % table.name]
+    
+    def spatial_indexes_ddl(self, indexes, concurrently=False):
+        # the database is vacuumed once after all R*Trees were created
+        statements = ["SELECT CreateSpatialIndex('%s', '%s')" % (table.name, column.name)
+                      for (table, column) in indexes]
+        if statements:
+            statements.append("VACUUM")
+        return statements
+    
+    def build_spatial_indexes(self, bind, indexes, parallel=1, concurrently=False):
+        if indexes and SQLiteSpatialDialect.supports_rtree(bind.dialect):
+            SpatialDialect.build_spatial_indexes(self, bind, indexes)
     
     @staticmethod  
     def supports_rtree(dialect):
@@ -0,0 +1,317 @@
+u"""
+:mod:`geoalchemy.strtree` -- Client-side spatial index
+======================================================
+
+:class:`EnvelopeIndex` keeps the bounding boxes and primary keys of the rows
+of a mapped geometry column in memory, in a packed R-tree bulk-loaded with
+the Sort-Tile-Recursive (STR) algorithm. For tables that are read often and
+changed rarely (e.g. administrative boundaries), the candidates of a spatial
+query can then be found without a query to the database, and only the few
+matching rows are loaded::
+
+    >>> from geoalchemy.strtree import EnvelopeIndex
+    >>> index = EnvelopeIndex(District.district_geom)
+    >>> index.listen(Session)
+    >>> index.load(session)
+    >>> index.search((7.43, 46.94))
+    [12, 15]
+    >>> district = index.query(session, (7.43, 46.94)) \\
+    ...     .filter(District.district_geom.gcontains('POINT(7.43 46.94)')).first()
+
+The index is loaded with one query (the envelopes of all geometries are
+selected). Once registered with :meth:`EnvelopeIndex.listen` (or, with
+SQLAlchemy 0.6, :meth:`EnvelopeIndex.extension`), the rows inserted, updated
+or deleted with the ORM are applied to the index when the session is
+committed; changes made with other connections or with SQL statements are
+not seen until the index is loaded again.
+
+The boxes and the tree nodes are stored in flat arrays of doubles. The
+packed tree is not changed in place: changed rows are kept in a small
+list that is searched linearly, and the tree is rebuilt when this list
+exceeds ``rebuild_threshold`` times the number of rows.
+"""
+from array import array
+from math import ceil, sqrt
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import select, and_, or_, literal_column
+from sqlalchemy.orm import attributes, class_mapper
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from geoalchemy.base import WKTSpatialElement, PersistentSpatialElement
+from geoalchemy.functions import functions
+from geoalchemy.utils import element_geometry, geometry_bounds, wkb_bounds
+
+# marks a geometry that is not known in Python
+_UNKNOWN = object()
+
+
+def _bounds(value):
+    """Returns the bounding box ``(minx, miny, maxx, maxy)`` of a bounding
+    box, a point ``(x, y)``, a WKT string or a geometry element.
+    """
+    if isinstance(value, (tuple, list)):
+        if len(value) == 2:
+            return (value[0], value[1], value[0], value[1])
+        return tuple(value)
+    if isinstance(value, PersistentSpatialElement):
+        # loaded geometries cache their bounds
+        return value.bounds
+    if isinstance(value, basestring):
+        value = WKTSpatialElement(value)
+    geom = element_geometry(value)
+    if geom is None:
+        raise Exception("The bounding box of %r is not known in Python" % (value, ))
+    return geometry_bounds(geom)
+
+
+class EnvelopeIndex(object):
+    """An in-memory packed R-tree of the bounding boxes of the mapped geometry
+    attribute ``column`` (e.g. ``District.district_geom``), keyed by primary
+    key (a tuple for composite primary keys).
+
+    ``capacity`` is the number of entries per tree node.
+    """
+
+    def __init__(self, column, capacity=16, rebuild_threshold=0.1):
+        self.column = column
+        self.class_ = column.class_
+        self.key = column.key
+        self.geometry_column = column.property.columns[0]
+        self.mapper = class_mapper(self.class_)
+        self.primary_key = list(self.mapper.primary_key)
+        self.capacity = capacity
+        self.rebuild_threshold = rebuild_threshold
+        self.loaded = False
+        self._build([])
+        self._pending = WeakKeyDictionary()
+
+    def __len__(self):
+        return len(self._keys) - len(self._removed.intersection(self._keys)) + len(self._added)
+
+    # building
+
+    def _build(self, entries):
+        """Bulk-loads the tree from a list of ``(bounds, key)`` entries: the
+        entries are sorted into vertical slices by the x coordinate of their
+        centers, and each slice by the y coordinate; consecutive entries are
+        then packed into the nodes of each level.
+        """
+        capacity = self.capacity
+        count = len(entries)
+        leaves = int(ceil(float(count) / capacity))
+        slice_size = capacity * int(ceil(sqrt(leaves))) or 1
+
+        entries.sort(key=lambda (b, key): b[0] + b[2])
+        boxes = array('d')
+        keys = []
+        for start in xrange(0, count, slice_size):
+            strip = entries[start:start + slice_size]
+            strip.sort(key=lambda (b, key): b[1] + b[3])
+            for (b, key) in strip:
+                boxes.extend(b)
+                keys.append(key)
+
+        levels = [boxes]
+        while len(levels[-1]) > 4 * capacity:
+            children = levels[-1]
+            size = len(children) // 4
+            nodes = array('d')
+            for start in xrange(0, size, capacity):
+                end = min(start + capacity, size)
+                nodes.extend((min(children[4 * i] for i in xrange(start, end)),
+                              min(children[4 * i + 1] for i in xrange(start, end)),
+                              max(children[4 * i + 2] for i in xrange(start, end)),
+                              max(children[4 * i + 3] for i in xrange(start, end))))
+            levels.append(nodes)
+
+        self._levels = levels
+        self._keys = keys
+        self._removed = set()
+        self._added = {}
+
+    def _entries(self):
+        boxes = self._levels[0]
+        entries = [(tuple(boxes[4 * i:4 * i + 4]), key) for (i, key) in enumerate(self._keys)
+                   if key not in self._removed]
+        entries.extend((b, key) for (key, b) in self._added.iteritems())
+        return entries
+
+    def rebuild(self):
+        """Packs the changed rows into the tree."""
+        self._build(self._entries())
+
+    def _row_key(self, row):
+        if len(self.primary_key) == 1:
+            return row[0]
+        return tuple(row[:len(self.primary_key)])
+
+    def _select(self, whereclause=None):
+        return select(self.primary_key +
+                      [functions.wkb(functions.envelope(self.geometry_column))], whereclause)
+
+    def load(self, session, batch_size=10000):
+        """Loads the envelopes of all rows with one query (fetched in batches
+        of ``batch_size`` rows) and builds the tree.
+        """
+        entries = []
+        result = session.execute(self._select())
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                bounds = None if row[-1] is None else wkb_bounds(row[-1])
+                if bounds is not None:
+                    entries.append((bounds, self._row_key(row)))
+        self._build(entries)
+        self.loaded = True
+
+    # changes
+
+    def update(self, key, bounds):
+        """Sets the bounding box of the row with the primary key ``key``,
+        removes the row if ``bounds`` is ``None``.
+        """
+        self._removed.add(key)
+        if bounds is None:
+            self._added.pop(key, None)
+        else:
+            self._added[key] = tuple(bounds)
+        if len(self._added) + len(self._removed) > max(self.capacity,
+                                                       self.rebuild_threshold * len(self._keys)):
+            self.rebuild()
+
+    def remove(self, key):
+        """Removes the row with the primary key ``key``."""
+        self.update(key, None)
+
+    # searching
+
+    def _search_tree(self, minx, miny, maxx, maxy):
+        levels = self._levels
+        capacity = self.capacity
+        top = len(levels) - 1
+        stack = [(top, i) for i in xrange(len(levels[top]) // 4)]
+        while stack:
+            level, i = stack.pop()
+            boxes = levels[level]
+            if boxes[4 * i] > maxx or boxes[4 * i + 1] > maxy or \
+                    boxes[4 * i + 2] < minx or boxes[4 * i + 3] < miny:
+                continue
+            if level == 0:
+                yield self._keys[i]
+            else:
+                size = len(levels[level - 1]) // 4
+                stack.extend((level - 1, j)
+                             for j in xrange(i * capacity, min((i + 1) * capacity, size)))
+
+    def search(self, bounds):
+        """Returns the primary keys of the rows whose bounding box intersects
+        ``bounds``: a bounding box ``(minx, miny, maxx, maxy)``, a point
+        ``(x, y)``, a WKT string or a geometry element.
+        """
+        minx, miny, maxx, maxy = _bounds(bounds)
+        result = [key for key in self._search_tree(minx, miny, maxx, maxy)
+                  if key not in self._removed]
+        result.extend(key for (key, b) in self._added.iteritems()
+                      if b[0] <= maxx and b[1] <= maxy and b[2] >= minx and b[3] >= miny)
+        return result
+
+    def _key_clause(self, keys):
+        if not keys:
+            return literal_column('1') == literal_column('0')
+        if len(self.primary_key) == 1:
+            return self.primary_key[0].in_(keys)
+        return or_(*[and_(*[c == value for (c, value) in zip(self.primary_key, key)])
+                     for key in keys])
+
+    def query(self, session, bounds):
+        """Returns a query of the instances whose bounding box intersects
+        ``bounds`` (see :meth:`search`), loading the index first if needed.
+        Filter it with the exact spatial relation, e.g. ``gcontains``.
+        """
+        if not self.loaded:
+            self.load(session)
+        return session.query(self.class_).filter(self._key_clause(self.search(bounds)))
+
+    # session hooks
+
+    def _changed_bounds(self, session, instance, key):
+        """Returns the bounding box of the new geometry of an instance, ``None``
+        if it has no geometry and ``_UNKNOWN`` if it was not changed.
+        """
+        history = attributes.get_history(instance, self.key,
+                                         passive=attributes.PASSIVE_NO_INITIALIZE)
+        if not history.added:
+            return _UNKNOWN
+        value = history.added[0]
+        if value is None:
+            return None
+        if isinstance(value, basestring):
+            value = WKTSpatialElement(value)
+        geom = element_geometry(value)
+        if geom is None:
+            # e.g. a database function, the envelope is selected
+            pk = [c == v for (c, v) in zip(self.primary_key,
+                                            key if len(self.primary_key) > 1 else [key])]
+            row = session.execute(self._select(and_(*pk))).fetchone()
+            if row is None or row[-1] is None:
+                return None
+            return wkb_bounds(row[-1])
+        return geometry_bounds(geom)
+
+    def _instance_key(self, instance):
+        key = self.mapper.primary_key_from_instance(instance)
+        if len(key) == 1:
+            return key[0]
+        return tuple(key)
+
+    def after_flush(self, session, flush_context):
+        pending = self._pending.setdefault(session, [])
+        for instance in session.deleted:
+            if isinstance(instance, self.class_):
+                pending.append((self._instance_key(instance), None))
+        for instance in list(session.new) + list(session.dirty):
+            if isinstance(instance, self.class_):
+                key = self._instance_key(instance)
+                bounds = self._changed_bounds(session, instance, key)
+                if bounds is not _UNKNOWN:
+                    pending.append((key, bounds))
+
+    def after_commit(self, session):
+        for key, bounds in self._pending.pop(session, []):
+            self.update(key, bounds)
+
+    def after_rollback(self, session):
+        self._pending.pop(session, None)
+
+    def listen(self, target):
+        """Registers the update hooks on ``target``, a session, a
+        ``sessionmaker()`` or the ``Session`` class (SQLAlchemy 0.7).
+        """
+        from sqlalchemy import event
+        event.listen(target, 'after_flush', self.after_flush)
+        event.listen(target, 'after_commit', self.after_commit)
+        event.listen(target, 'after_rollback', self.after_rollback)
+
+    def extension(self):
+        """Returns a ``SessionExtension`` with the update hooks, e.g. for
+        ``sessionmaker(extension=index.extension())``.
+        """
+        return _EnvelopeIndexExtension(self)
+
+
+class _EnvelopeIndexExtension(SessionExtension):
+
+    def __init__(self, index):
+        self.index = index
+
+    def after_flush(self, session, flush_context):
+        self.index.after_flush(session, flush_context)
+
+    def after_commit(self, session):
+        self.index.after_commit(session)
+
+    def after_rollback(self, session):
+        self.index.after_rollback(session)
@@ -0,0 +1,111 @@
+"""Fake sessions and mapped classes for the tests that run without a
+spatial database."""
+from sqlalchemy import MetaData, Table, Column, Integer, String, Numeric
+from sqlalchemy.orm import mapper
+
+from geoalchemy import GeometryExtensionColumn, GeometryColumn, Point, Polygon
+from geoalchemy.utils import to_wkb
+
+
+class FakeSession(object):
+    """Compiles the executed queries instead of sending them to a database."""
+
+    def __init__(self, dialect, rows):
+        self.dialect = dialect
+        self.rows = rows
+        self.queries = []
+
+    def get_bind(self, mapper):
+        return self
+
+    def execute(self, query, params=None):
+        if isinstance(params, list):
+            # executemany
+            params = params[0]
+        if params:
+            self.queries.append(query.compile(dialect=self.dialect, column_keys=params.keys()))
+        else:
+            # e.g. DDL, which has no column keys
+            self.queries.append(query.compile(dialect=self.dialect))
+        return self
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def __iter__(self):
+        rows, self.rows = self.rows, []
+        return iter(rows)
+
+
+class ScalarSession(FakeSession):
+
+    def scalar(self, query):
+        self.execute(query)
+        return self.rows.pop(0)
+
+
+class FlushedSession(object):
+    """The objects of a flush, as passed to the ``after_flush`` event."""
+
+    def __init__(self, new=(), dirty=(), deleted=()):
+        self.new = new
+        self.dirty = dirty
+        self.deleted = deleted
+
+
+class FakeBind(object):
+    """Records the executed DDL statements."""
+
+    def __init__(self, dialect, result=None):
+        self.dialect = dialect
+        self.result = result
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(statement if isinstance(statement, basestring)
+                               else str(statement.compile(dialect=self.dialect)))
+        return self
+
+    def scalar(self):
+        return self.result
+
+    def connect(self):
+        return self
+
+    def close(self):
+        pass
+
+
+class Spot(object):
+    pass
+
+spots = Table('spots', MetaData(),
+              Column('spot_id', Integer, primary_key=True),
+              Column('spot_name', String),
+              Column('spot_height', Numeric),
+              GeometryExtensionColumn('spot_location', Point(2, srid=4326)),
+              GeometryExtensionColumn('spot_label', Point(2, srid=4326, spatial_index=False)))
+mapper(Spot, spots, properties={'spot_location': GeometryColumn(spots.c.spot_location),
+                                'spot_label': GeometryColumn(spots.c.spot_label)})
+
+
+class Lake(object):
+    pass
+
+lakes = Table('lakes', MetaData(),
+              Column('lake_id', Integer, primary_key=True),
+              Column('lake_name', String),
+              GeometryExtensionColumn('lake_geom', Polygon(2, srid=4326)))
+mapper(Lake, lakes, properties={'lake_geom': GeometryColumn(lakes.c.lake_geom)})
+
+
+def point(x, y):
+    return buffer(to_wkb({"type": "Point", "coordinates": [x, y]}))
+
+def box(minx, miny, maxx, maxy):
+    return buffer(to_wkb({"type": "Polygon", "coordinates": [[[minx, miny], [minx, maxy], [maxx, maxy],
+                                                              [maxx, miny], [minx, miny]]]}))
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from nose.tools import ok_, raises
+from nose.tools import ok_, eq_, raises, assert_raises
+from nose.plugins.skip import SkipTest
 
 from sqlalchemy.dialects.sqlite.base import SQLiteDialect
 from sqlalchemy.dialects.mysql.base import MySQLDialect
@@ -13,9 +14,28 @@ from geoalchemy.postgis import PGSpatialDialect
 from geoalchemy.mysql import MySQLSpatialDialect
 from geoalchemy.spatialite import SQLiteSpatialDialect
 from geoalchemy.oracle import OracleSpatialDialect
-from geoalchemy.functions import parse_clause
-from geoalchemy.base import WKTSpatialElement
+from geoalchemy.functions import parse_clause, functions
+from geoalchemy.base import WKTSpatialElement, WKBSpatialElement, _to_gis
+from geoalchemy.utils import make_ewkb, from_wkb, to_wkb
 from geoalchemy.mssql import MSSpatialDialect
+from geoalchemy.geometry import Geometry, GeometryExtensionColumn, GeometryColumn, GeometryDDL, \
+    DeferredSpatialIndexes, simplify, quantize
+
+from sqlalchemy import MetaData, Table, Column, Integer, select
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import mapper, sessionmaker
+from binascii import unhexlify
+
+from geoalchemy.tests.fixtures import FakeSession, FakeBind
+
+
+def _require_loader_options(option, key):
+    """The query options need the loader strategies of SQLAlchemy 0.7, with
+    other versions they raise ``NotImplementedError``."""
+    import geoalchemy.geometry
+    if geoalchemy.geometry._reduce_path is None:
+        assert_raises(NotImplementedError, option, key, 1)
+        raise SkipTest("The query option %s() requires SQLAlchemy 0.7" % option.__name__)
 
 
 class TestDialectManager(TestCase):
@@ -41,6 +61,421 @@ class TestDialectManager(TestCase):
         ok_(isinstance(parse_clause('GEOMETRYCOLLECTION (POINT(4 6),LINESTRING(4 6,7 10))', None), WKTSpatialElement))
         ok_(not isinstance(parse_clause('unit=km arc_tolerance=0.05)', None), WKTSpatialElement))
 
+    def test_ewkb_internal(self):
+        spots = Table('spots', MetaData(),
+                      Column('spot_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('spot_location', Geometry(2, ewkb_internal=True)))
+        eq_(str(select([spots]).compile(dialect=PGDialect_psycopg2())),
+            'SELECT spots.spot_id, spots.spot_location \nFROM spots')
+        eq_(str(select([spots]).compile(dialect=SQLiteDialect())),
+            'SELECT spots.spot_id, AsBinary(spots.spot_location) \nFROM spots')
+
+    def test_simplify(self):
+        class Spot(object):
+            pass
+        spots = Table('spots', MetaData(),
+                      Column('spot_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('spot_location', Geometry(2)))
+        mapper(Spot, spots, properties={'spot_location': GeometryColumn(spots.c.spot_location)})
+        _require_loader_options(simplify, Spot.spot_location)
+        query = sessionmaker()().query(Spot).options(simplify(Spot.spot_location, 0.5))
+        eq_(str(query.statement.compile(dialect=PGDialect_psycopg2())),
+            'SELECT ST_AsBinary(ST_SimplifyPreserveTopology(spots.spot_location, %(param_1)s)) AS wkb_1, '
+            'spots.spot_id \nFROM spots')
+        eq_(str(query.statement.compile(dialect=SQLiteDialect())),
+            'SELECT AsBinary(Simplify(spots.spot_location, ?)) AS wkb_1, spots.spot_id \nFROM spots')
+        eq_(str(query.statement.compile(dialect=MSDialect())),
+            'SELECT spots.spot_location.Reduce(:param_1).STAsBinary() AS wkb_1, spots.spot_id \nFROM spots')
+
+    def test_bbox_intersects(self):
+        lakes = Table('lakes', MetaData(),
+                      Column('lake_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('lake_geom', Geometry(2)),
+                      GeometryExtensionColumn('lake_center', Geometry(2, spatial_index=False)))
+        query = select([lakes.c.lake_id], functions._bbox_intersects(lakes.c.lake_geom, 'POINT(1 2)'))
+        eq_(str(query.compile(dialect=PGDialect_psycopg2())),
+            'SELECT lakes.lake_id \nFROM lakes \n'
+            'WHERE lakes.lake_geom && ST_GeomFromText(%(ST_GeomFromText_1)s, %(ST_GeomFromText_2)s)')
+        eq_(str(query.compile(dialect=MySQLDialect())),
+            'SELECT lakes.lake_id \nFROM lakes \nWHERE MBRIntersects(lakes.lake_geom, GeomFromText(%s, %s))')
+        eq_(str(query.compile(dialect=OracleDialect())),
+            'SELECT lakes.lake_id \nFROM lakes \n'
+            'WHERE SDO_FILTER(lakes.lake_geom, MDSYS.SDO_GEOMETRY(:SDO_GEOMETRY_1, :SDO_GEOMETRY_2)) '
+            '= :SDO_FILTER_1')
+        dialect = SQLiteDialect()
+        dialect.server_version_info = (3, 7, 3)
+        eq_(str(query.compile(dialect=dialect)),
+            'SELECT lakes.lake_id \nFROM lakes \nWHERE lakes.rowid IN (SELECT idx_lakes_lake_geom.pkid \n'
+            'FROM idx_lakes_lake_geom \nWHERE MbrMaxX(GeomFromText(?, ?)) >= xmin AND '
+            'MbrMinX(GeomFromText(?, ?)) <= xmax AND MbrMaxY(GeomFromText(?, ?)) >= ymin AND '
+            'MbrMinY(GeomFromText(?, ?)) <= ymax)')
+        query = select([lakes.c.lake_id], functions._bbox_intersects(lakes.c.lake_center, 'POINT(1 2)'))
+        eq_(str(query.compile(dialect=dialect)),
+            'SELECT lakes.lake_id \nFROM lakes \nWHERE MbrIntersects(lakes.lake_center, GeomFromText(?, ?))')
+
+    def test_from_wkb(self):
+        from sqlalchemy import bindparam
+        query = select([functions._from_wkb(bindparam('wkb'), 4326)])
+        eq_(str(query.compile(dialect=PGDialect_psycopg2())),
+            'SELECT ST_GeomFromWKB(%(wkb)s, %(param_1)s) AS _from_wkb_1')
+        eq_(str(query.compile(dialect=SQLiteDialect())),
+            'SELECT GeomFromWKB(?, ?) AS _from_wkb_1')
+        eq_(str(query.compile(dialect=OracleDialect())),
+            'SELECT MDSYS.SDO_GEOMETRY(TO_BLOB(:wkb), :param_1) AS "_from_wkb_1" FROM DUAL')
+
+    def test_precision(self):
+        spots = Table('spots', MetaData(),
+                      Column('spot_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('spot_location', Geometry(2, precision=6)))
+        eq_(str(select([spots]).compile(dialect=PGDialect_psycopg2())),
+            'SELECT spots.spot_id, ST_AsBinary(ST_SnapToGrid(spots.spot_location, %(param_1)s)) \nFROM spots')
+        eq_(str(select([spots]).compile(dialect=MySQLDialect())),
+            'SELECT spots.spot_id, AsBinary(spots.spot_location) \nFROM spots')
+
+        # MySQL can not snap to a grid, the coordinates are rounded when loaded
+        process = spots.c.spot_location.type.result_processor(MySQLDialect())
+        wkb = str(to_wkb({"type": "Point", "coordinates": [1.23456789, 2.0]}))
+        eq_(from_wkb(process(wkb).geom_wkb), {"type": "Point", "coordinates": [1.234568, 2.0]})
+        process = spots.c.spot_location.type.result_processor(PGDialect_psycopg2())
+        eq_(from_wkb(process(wkb).geom_wkb), {"type": "Point", "coordinates": [1.23456789, 2.0]})
+
+    def test_quantize(self):
+        class Spot(object):
+            pass
+        spots = Table('spots', MetaData(),
+                      Column('spot_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('spot_location', Geometry(2)))
+        mapper(Spot, spots, properties={'spot_location': GeometryColumn(spots.c.spot_location)})
+        _require_loader_options(quantize, Spot.spot_location)
+        query = sessionmaker()().query(Spot).options(quantize(Spot.spot_location, 2))
+        eq_(str(query.statement.compile(dialect=SQLiteDialect())),
+            'SELECT AsBinary(SnapToGrid(spots.spot_location, ?)) AS wkb_1, spots.spot_id \nFROM spots')
+        eq_(str(query.statement.compile(dialect=MySQLDialect())),
+            'SELECT AsBinary(spots.spot_location) AS wkb_1, spots.spot_id \nFROM spots')
+
+    def test_quantize_assigned(self):
+        class Spot(object):
+            pass
+        spots = Table('spots', MetaData(),
+                      Column('spot_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('spot_location', Geometry(2, precision=2)))
+        mapper(Spot, spots, properties={'spot_location': GeometryColumn(spots.c.spot_location)})
+        spot = Spot()
+        spot.spot_location = 'POINT(1.23456 2.5)'
+        ok_(isinstance(spot.spot_location, WKBSpatialElement))
+        eq_(from_wkb(spot.spot_location.geom_wkb), {"type": "Point", "coordinates": [1.23, 2.5]})
+        wkb = str(make_ewkb(to_wkb({"type": "Point", "coordinates": [1.0, 2.004]}), 4326))
+        spot.spot_location = WKBSpatialElement(wkb)
+        eq_(spot.spot_location.srid, 4326)
+        eq_(from_wkb(spot.spot_location.geom_wkb), {"type": "Point", "coordinates": [1.0, 2.0]})
+        spot.spot_location = WKTSpatialElement('POINT(1.23456 2.5)', 2249)
+        eq_(str(spot.spot_location.compile(dialect=SQLiteDialect())),
+            'SnapToGrid(Transform(GeomFromText(?, ?), ?), ?)')
+        eq_(str(spot.spot_location.compile(dialect=OracleDialect())),
+            'SDO_CS.TRANSFORM(MDSYS.SDO_GEOMETRY(:SDO_GEOMETRY_1, :SDO_GEOMETRY_2), :param_1)')
+        spot.spot_location = None
+        eq_(spot.spot_location, None)
+
+    def test_ewkt_element(self):
+        e = WKTSpatialElement('SRID=2249;POINT(1 2)')
+        eq_(e.srid, 2249)
+        eq_(e.geom_wkt, 'POINT(1 2)')
+        eq_(WKTSpatialElement('POINT(1 2)', 2249).geom_ewkt, 'SRID=2249;POINT(1 2)')
+        c = e.compile(dialect=PGDialect_psycopg2())
+        eq_(str(c), 'ST_GeomFromEWKT(%(ST_GeomFromEWKT_1)s)')
+        eq_(c.params.values(), ['SRID=2249;POINT(1 2)'])
+        c = e.compile(dialect=SQLiteDialect())
+        eq_(str(c), 'GeomFromText(?, ?)')
+        eq_(sorted(c.params.values()), [2249, 'POINT(1 2)'])
+
+    def test_ewkb_element(self):
+        wkb = unhexlify('0101000000000000000000F03F0000000000000040')
+        e = WKBSpatialElement(make_ewkb(wkb, 2249))
+        eq_(e.srid, 2249)
+        eq_(str(e.geom_wkb), wkb)
+        eq_(WKBSpatialElement(wkb).srid, 4326)
+        eq_(str(e.compile(dialect=PGDialect_psycopg2())), 'ST_GeomFromEWKB(%(ST_GeomFromEWKB_1)s)')
+        c = e.compile(dialect=SQLiteDialect())
+        eq_(str(c), 'GeomFromWKB(?, ?)')
+        ok_(str(c.params['GeomFromWKB_1']) == wkb)
+
+    def test_check_srid_ewkt(self):
+        ok_(isinstance(_to_gis('SRID=4326;POINT(1 2)', 4326), WKTSpatialElement))
+        transformed = _to_gis('SRID=2249;POINT(1 2)', 4326)
+        eq_(str(transformed.compile(dialect=PGDialect_psycopg2())),
+            'ST_Transform(ST_GeomFromEWKT(%(ST_GeomFromEWKT_1)s), %(param_1)s)')
+
+    def test_evaluate_many(self):
+        session = FakeSession(SQLiteDialect(), [(1.0, 2.0)])
+        eq_(functions.evaluate_many(session, ['POINT(1 2)', None, WKTSpatialElement('POINT(2 2)')],
+                                    functions.x), [1.0, None, 2.0])
+        eq_(len(session.queries), 1)
+        eq_(str(session.queries[0]), 'SELECT X(GeomFromText(?, ?)) AS x_1, '
+                                     'X(GeomFromText(?, ?)) AS x_2')
+
+        session = FakeSession(PGDialect_psycopg2(), [(3.0, ), (4.0, )])
+        eq_(functions.evaluate_many(session, ['POINT(1 2)', 'SRID=2249;POINT(2 2)'],
+                                    functions.buffer, 5), [3.0, 4.0])
+        eq_(str(session.queries[0]), 'SELECT ST_Buffer(geom, %(param_1)s) AS buffer_1 \n'
+                                     'FROM (SELECT n, CAST((CAST(%(geometries)s AS text[]))[n] AS geometry) AS geom '
+                                     'FROM generate_series(1, %(count)s) AS n) AS geometries ORDER BY n')
+        eq_(session.queries[0].params['geometries'], ['SRID=4326;POINT(1 2)', 'SRID=2249;POINT(2 2)'])
+        eq_(session.queries[0].params['count'], 2)
+
+        session = FakeSession(PGDialect_psycopg2(), [(1.0, ), (2.0, ), (3.0, )])
+        wkb = WKBSpatialElement(unhexlify('0101000000000000000000F03F0000000000000040'), 4326)
+        eq_(PGSpatialDialect().evaluate_many(session, functions.x, [wkb, wkb, wkb], [], batch_size=2),
+            [1.0, 2.0, 3.0])
+        eq_([query.params['count'] for query in session.queries], [2, 1])
+        eq_(session.queries[1].params['geometries'],
+            [str(make_ewkb(unhexlify('0101000000000000000000F03F0000000000000040'), 4326)).encode('hex')])
+
+        session = FakeSession(PGDialect_psycopg2(), [(float(i), ) for i in xrange(1000)])
+        eq_(functions.evaluate_many(session, [wkb] * 1000, functions.x), [float(i) for i in xrange(1000)])
+        eq_(len(session.queries), 1)
+
+        session = FakeSession(SQLiteDialect(), [(1.0, ), (2.0, )])
+        eq_(functions.evaluate_many(session, ['POINT(1 2)', 'POINT(2 2)'], functions.x, batch_size=1),
+            [1.0, 2.0])
+        eq_(len(session.queries), 2)
+
+        eq_(functions.evaluate_many(session, [], functions.area), [])
+
+
+def _column(geometry_type, **kwargs):
+    table = Table('parcels', MetaData(), Column('parcel_id', Integer, primary_key=True),
+                  GeometryExtensionColumn('parcel_geom', geometry_type(2, srid=2056, **kwargs)))
+    return table, table.c.parcel_geom
+
+
+class TestSpatialIndexDDL(TestCase):
+
+    def test_postgis(self):
+        from geoalchemy.geometry import Polygon
+        dialect = PGSpatialDialect()
+        eq_(dialect.spatial_index_ddl(*_column(Polygon)),
+            ['CREATE INDEX "idx_parcels_parcel_geom" ON "public"."parcels" USING GIST (parcel_geom)'])
+        table, column = _column(Polygon, postgis_index_method='brin', postgis_index_concurrently=True,
+                                postgis_index_with={'pages_per_range': 32, 'autosummarize': 'on'})
+        eq_(dialect.spatial_index_ddl(table, column),
+            ['CREATE INDEX "idx_parcels_parcel_geom" ON "public"."parcels" USING BRIN (parcel_geom) '
+             'WITH (autosummarize = on, pages_per_range = 32)'])
+        eq_(dialect.spatial_index_ddl(table, column, concurrently=True)[0][:41],
+            'CREATE INDEX CONCURRENTLY "idx_parcels_pa')
+        table, column = _column(Polygon, postgis_index_ops='gist_geometry_ops_nd')
+        eq_(dialect.spatial_index_ddl(table, column),
+            ['CREATE INDEX "idx_parcels_parcel_geom" ON "public"."parcels" USING GIST '
+             '(parcel_geom gist_geometry_ops_nd)'])
+
+    @raises(Exception)
+    def test_postgis_method(self):
+        PGSpatialDialect().spatial_index_ddl(*_column(Geometry, postgis_index_method='hash'))
+
+    def test_mssql(self):
+        table, column = _column(Geometry, bounding_box='(0, 0, 100, 100)',
+                                mssql_tessellation='GEOMETRY_GRID', mssql_cells_per_object=64,
+                                mssql_grids=('MEDIUM', 'MEDIUM', 'HIGH', 'HIGH'))
+        eq_(MSSpatialDialect().spatial_index_ddl(table, column),
+            ['CREATE SPATIAL INDEX [parcels_parcel_geom] ON [dbo].[parcels]([parcel_geom]) '
+             'USING GEOMETRY_GRID WITH (BOUNDING_BOX = (0, 0, 100, 100), GRIDS = (LEVEL_1 = MEDIUM, '
+             'LEVEL_2 = MEDIUM, LEVEL_3 = HIGH, LEVEL_4 = HIGH), CELLS_PER_OBJECT = 64)'])
+        eq_(MSSpatialDialect().spatial_index_ddl(*_column(Geometry)), [])
+
+    def test_oracle(self):
+        from geoalchemy.geometry import Point
+        table, column = _column(Point, diminfo='DIMINFO', oracle_index_local=True,
+                                oracle_index_parallel=4,
+                                oracle_index_params={'sdo_indx_dims': 2, 'sdo_rtr_pctfree': 10})
+        eq_(OracleSpatialDialect().spatial_index_ddl(table, column),
+            ["CREATE INDEX parcels_parcel_geom_sidx ON parcels(parcel_geom) INDEXTYPE IS "
+             "MDSYS.SPATIAL_INDEX LOCAL PARALLEL 4 PARAMETERS "
+             "('LAYER_GTYPE=POINT SDO_INDX_DIMS=2 SDO_RTR_PCTFREE=10')"])
+        table, column = _column(Geometry, diminfo='DIMINFO')
+        eq_(OracleSpatialDialect().spatial_index_ddl(table, column),
+            ["CREATE INDEX parcels_parcel_geom_sidx ON parcels(parcel_geom) INDEXTYPE IS "
+             "MDSYS.SPATIAL_INDEX"])
+
+    def test_mysql(self):
+        from geoalchemy.geometry import Point
+        bind = FakeBind(MySQLDialect())
+        MySQLSpatialDialect().handle_ddl_after_create(bind, *_column(Point, mysql_srid=True))
+        eq_(bind.statements, ['ALTER TABLE parcels ADD parcel_geom POINT NOT NULL SRID 2056',
+                              'CREATE SPATIAL INDEX idx_parcels_parcel_geom ON parcels(parcel_geom)'])
+
+
+class TestInlineGeometryColumns(TestCase):
+
+    def _table(self):
+        from geoalchemy.geometry import Point
+        return Table('parcels', MetaData(), Column('parcel_id', Integer, primary_key=True),
+                     GeometryExtensionColumn('parcel_geom', Point(2, srid=2056), nullable=False),
+                     GeometryExtensionColumn('parcel_center', Geometry(3, srid=2056)),
+                     GeometryExtensionColumn('parcel_label', Geometry(2, spatial_index=False)))
+
+    def test_postgis2(self):
+        table = self._table()
+        bind = FakeBind(PGDialect_psycopg2(), '2.5.3 r17699')
+        ddl = GeometryDDL(table)
+        ddl('before-create', table, bind)
+        eq_(str(CreateTable(table).compile(dialect=bind.dialect)),
+            '\nCREATE TABLE parcels (\n\tparcel_id SERIAL NOT NULL, '
+            '\n\tparcel_geom geometry(POINT,2056) NOT NULL, '
+            '\n\tparcel_center geometry(GEOMETRYZ,2056), '
+            '\n\tparcel_label geometry(GEOMETRY,4326), '
+            '\n\tPRIMARY KEY (parcel_id)\n)\n\n')
+        ddl('after-create', table, bind)
+        eq_(bind.statements,
+            ['SELECT postgis_lib_version() AS postgis_lib_version_1',
+             'CREATE INDEX "idx_parcels_parcel_geom" ON "public"."parcels" USING GIST (parcel_geom);\n'
+             'CREATE INDEX "idx_parcels_parcel_center" ON "public"."parcels" USING GIST (parcel_center)'])
+        ddl('before-drop', table, bind)
+        ddl('after-drop', table, bind)
+        eq_(len(bind.statements), 2)
+
+    def test_postgis1(self):
+        table = self._table()
+        bind = FakeBind(PGDialect_psycopg2(), '1.5.8')
+        ddl = GeometryDDL(table)
+        ddl('before-create', table, bind)
+        eq_(list(table.c.keys()), ['parcel_id'])
+        ddl('after-create', table, bind)
+        eq_(len(table.c), 4)
+        eq_(bind.statements[1][:24], 'SELECT AddGeometryColumn')
+        eq_(bind.statements[3], 'ALTER TABLE "public"."parcels" ALTER COLUMN "parcel_geom" SET not null')
+
+    def test_other_dialects(self):
+        from geoalchemy.geometry import Point
+        ok_(not MySQLSpatialDialect().inline_geometry_columns(FakeBind(MySQLDialect())))
+        eq_(Point(2).compile(dialect=MySQLDialect()), 'POINT')
+
+
+class _DBAPIConnection(object):
+    """Records the isolation levels set by ``set_isolation_level``."""
+
+    isolation_level = 1
+
+    def __init__(self):
+        self.levels = []
+
+    def set_isolation_level(self, level):
+        self.levels.append(level)
+
+
+class _AutocommitBind(FakeBind):
+
+    def __init__(self, dialect, result=None):
+        FakeBind.__init__(self, dialect, result)
+        self.connection = _DBAPIConnection()
+
+
+class TestDeferredSpatialIndexes(TestCase):
+
+    def _tables(self, indexes):
+        from geoalchemy.geometry import Point
+        metadata = MetaData()
+        tables = [Table(name, metadata, Column('id', Integer, primary_key=True),
+                        GeometryExtensionColumn('geom', Point(2)),
+                        GeometryExtensionColumn('label', Point(2, spatial_index=False)))
+                  for name in ('parcels', 'roads', 'lakes')]
+        return [(table, GeometryDDL(table, deferred_indexes=indexes)) for table in tables]
+
+    def _create(self, tables, bind):
+        for (table, ddl) in tables:
+            ddl('before-create', table, bind)
+            ddl('after-create', table, bind)
+
+    def test_spatialite(self):
+        dialect = SQLiteDialect()
+        dialect.server_version_info = (3, 7, 3)
+        bind = FakeBind(dialect)
+        indexes = DeferredSpatialIndexes()
+        self._create(self._tables(indexes), bind)
+        eq_(len(bind.statements), 6)
+        ok_(all(s.startswith('SELECT AddGeometryColumn') for s in bind.statements))
+        indexes.after_create(None, bind)
+        eq_(bind.statements[6:], ["SELECT CreateSpatialIndex('parcels', 'geom')",
+                                  "SELECT CreateSpatialIndex('roads', 'geom')",
+                                  "SELECT CreateSpatialIndex('lakes', 'geom')",
+                                  "VACUUM"])
+        indexes.build(bind)
+        eq_(len(bind.statements), 10)
+
+    def test_postgis(self):
+        bind = FakeBind(PGDialect_psycopg2(), '2.4.0')
+        indexes = DeferredSpatialIndexes(parallel=2)
+        self._create(self._tables(indexes), bind)
+        eq_(len(bind.statements), 1)
+        indexes.build(bind)
+        eq_(sorted(bind.statements[1:]),
+            ['CREATE INDEX "idx_parcels_geom" ON "public"."parcels" USING GIST (geom);\n'
+             'CREATE INDEX "idx_lakes_geom" ON "public"."lakes" USING GIST (geom)',
+             'CREATE INDEX "idx_roads_geom" ON "public"."roads" USING GIST (geom)'])
+
+    def test_postgis_concurrently(self):
+        from geoalchemy.geometry import Point
+        bind = _AutocommitBind(PGDialect_psycopg2(), '2.4.0')
+        indexes = DeferredSpatialIndexes()
+        for name in ('parcels', 'roads'):
+            table = Table(name, MetaData(), Column('id', Integer, primary_key=True),
+                          GeometryExtensionColumn('geom', Point(2, postgis_index_concurrently=True)))
+            indexes.add(table, [table.c.geom])
+        indexes.build(bind, concurrently=True)
+        eq_(bind.statements,
+            ['CREATE INDEX CONCURRENTLY "idx_parcels_geom" ON "public"."parcels" USING GIST (geom)',
+             'CREATE INDEX CONCURRENTLY "idx_roads_geom" ON "public"."roads" USING GIST (geom)'])
+        eq_(bind.connection.levels, [0, 1])
+
+
+class TestSpatialDeferredColumnLoader(TestCase):
+    """The loader with a text column in SQLite, without spatial functions."""
+
+    def setUp(self):
+        from sqlalchemy import create_engine, event, String
+        from sqlalchemy.orm import column_property
+        from geoalchemy.geometry import SpatialDeferredColumnLoader
+
+        class Note(object):
+            pass
+        notes = Table('notes', MetaData(), Column('note_id', Integer, primary_key=True),
+                      Column('note_text', String))
+        text = column_property(notes.c.note_text, deferred=True)
+        text.strategy_class = SpatialDeferredColumnLoader
+        mapper(Note, notes, properties={'note_text': text})
+        self.Note = Note
+
+        engine = create_engine('sqlite://')
+        notes.create(engine)
+        engine.execute(notes.insert(), [{'note_id': i, 'note_text': 'note %d' % i} for i in xrange(1, 6)])
+        self.statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append((statement, parameters))
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        self.session = sessionmaker(bind=engine)()
+
+    def test_batch(self):
+        Note = self.Note
+        notes = self.session.query(Note).filter(Note.note_id <= 3).order_by(Note.note_id).all()
+        ok_(all('note_text' not in note.__dict__ for note in notes))
+        eq_(notes[1].note_text, 'note 2')
+        eq_(len(self.statements), 2)
+        ok_(' IN (' in self.statements[1][0])
+        eq_(sorted(self.statements[1][1]), [1, 2, 3])
+        eq_([note.note_text for note in notes], ['note 1', 'note 2', 'note 3'])
+        eq_(len(self.statements), 2)
+
+        # only the instances loaded since are pending
+        more = self.session.query(Note).filter(Note.note_id > 3).all()
+        eq_(more[0].note_text, 'note %d' % more[0].note_id)
+        eq_(len(self.statements), 4)
+        eq_(sorted(self.statements[3][1]), [4, 5])
+
+    def test_undefer(self):
+        from sqlalchemy.orm import undefer
+        Note = self.Note
+        notes = self.session.query(Note).options(undefer('note_text')).all()
+        eq_(sorted(note.note_text for note in notes), ['note %d' % i for i in xrange(1, 6)])
+        eq_(len(self.statements), 1)
+
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,149 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_, raises
+from binascii import hexlify
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+
+from geoalchemy.geopackage import (to_gpkg, from_gpkg, gpkg_bounds, write_features,
+                                   read_features, import_features)
+from geoalchemy.utils import to_wkb, from_wkb
+from geoalchemy.tests.fixtures import FakeSession, Spot, point
+
+
+class _ImportSession(object):
+
+    def __init__(self):
+        self.added = []
+        self.flushed = []
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    def flush(self):
+        self.flushed.append(list(self.added))
+
+    def expunge(self, instance):
+        self.added.remove(instance)
+
+
+class TestGeoPackage(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'spots.gpkg')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_header(self):
+        wkb = to_wkb({"type": "LineString", "coordinates": [[1, 2], [3, -4]]})
+        data = to_gpkg(wkb, 4326)
+        eq_(hexlify(data[:8]), '47500003e6100000')
+        eq_(gpkg_bounds(data), (1, -4, 3, 2))
+        eq_(from_gpkg(data), (wkb, 4326))
+
+        data = to_gpkg(wkb, 4326, envelope=False)
+        eq_(len(data), len(wkb) + 8)
+        eq_(gpkg_bounds(data), (1, -4, 3, 2))
+
+        empty = to_gpkg(to_wkb({"type": "LineString", "coordinates": []}), 4326)
+        eq_(ord(empty[3]) & 0x10, 0x10)
+        eq_(gpkg_bounds(empty), None)
+
+    @raises(Exception)
+    def test_header_magic(self):
+        from_gpkg('XX' + '\x00' * 10)
+
+    def _write(self):
+        rows = [(1, point(1, 1), u'A', 10.5), (2, point(5, 5), u'B', None), (3, None, u'C', 1)]
+        session = FakeSession(MySQLDialect(), rows)
+        eq_(write_features(session, Spot.spot_location, self.path,
+                           properties=[Spot.spot_name, Spot.spot_height], batch_size=2), 3)
+        return session
+
+    def test_write_features(self):
+        session = self._write()
+        eq_(str(session.queries[0]),
+            'SELECT spots.spot_id, AsBinary(spots.spot_location) AS wkb_1, spots.spot_name, '
+            'spots.spot_height \nFROM spots')
+
+        connection = sqlite3.connect(self.path)
+        eq_(connection.execute("PRAGMA application_id").fetchone()[0], 0x47504B47)
+        eq_(connection.execute("SELECT table_name, data_type, min_x, min_y, max_x, max_y, srs_id "
+                               "FROM gpkg_contents").fetchall(),
+            [(u'spots', u'features', 1.0, 1.0, 5.0, 5.0, 4326)])
+        eq_(connection.execute("SELECT * FROM gpkg_geometry_columns").fetchall(),
+            [(u'spots', u'spot_location', u'POINT', 4326, 0, 0)])
+        eq_(connection.execute("SELECT extension_name FROM gpkg_extensions").fetchall(),
+            [(u'gpkg_rtree_index', )])
+        eq_(connection.execute("SELECT * FROM rtree_spots_spot_location ORDER BY id").fetchall(),
+            [(1, 1.0, 1.0, 1.0, 1.0), (2, 5.0, 5.0, 5.0, 5.0)])
+        eq_(connection.execute("SELECT fid, spot_name, spot_height FROM spots ORDER BY fid").fetchall(),
+            [(1, u'A', 10.5), (2, u'B', None), (3, u'C', 1)])
+        connection.close()
+
+        # the feature table is replaced
+        self._write()
+        connection = sqlite3.connect(self.path)
+        eq_(connection.execute("SELECT count(*) FROM spots").fetchone()[0], 3)
+        connection.close()
+
+    def test_quoted_names(self):
+        session = FakeSession(MySQLDialect(), [(1, point(1, 1), u'A', 10.5)])
+        write_features(session, Spot.spot_location, self.path,
+                       properties=[Spot.spot_name, Spot.spot_height], table='spot "table"')
+        connection = sqlite3.connect(self.path)
+        eq_(connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                               "ORDER BY name").fetchall(),
+            [(u'rtree_spot "table"_spot_location_%s' % suffix, )
+             for suffix in ('delete', 'insert', 'update1', 'update2', 'update3', 'update4')])
+        eq_(connection.execute('SELECT * FROM "rtree_spot ""table""_spot_location"').fetchall(),
+            [(1, 1.0, 1.0, 1.0, 1.0)])
+        connection.close()
+
+    def test_read_features(self):
+        self._write()
+        features = list(read_features(self.path))
+        eq_([(fid, properties) for (fid, properties, wkb, srs_id) in features],
+            [(1, {'spot_name': u'A', 'spot_height': 10.5}), (2, {'spot_name': u'B', 'spot_height': None}),
+             (3, {'spot_name': u'C', 'spot_height': 1})])
+        eq_(from_wkb(features[1][2]), {"type": "Point", "coordinates": [5.0, 5.0]})
+        eq_(features[1][3], 4326)
+        eq_(features[2][2], None)
+
+        eq_([f[0] for f in read_features(self.path, 'spots', bbox=(0, 0, 2, 2))], [1])
+
+        # without R-tree, the envelopes of the headers are used
+        connection = sqlite3.connect(self.path)
+        connection.execute("DROP TABLE rtree_spots_spot_location")
+        connection.close()
+        eq_([f[0] for f in read_features(self.path, bbox=(4, 4, 6, 6))], [2])
+
+    @raises(Exception)
+    def test_read_features_unknown_table(self):
+        self._write()
+        list(read_features(self.path, 'lakes'))
+
+    def test_import_features(self):
+        self._write()
+        session = _ImportSession()
+        eq_(import_features(session, self.path, Spot.spot_location, batch_size=2), 3)
+        eq_([len(batch) for batch in session.flushed], [2, 1])
+        spot = session.flushed[0][1]
+        eq_(spot.spot_name, u'B')
+        eq_(spot.spot_location.srid, 4326)
+        eq_(from_wkb(spot.spot_location.desc), {"type": "Point", "coordinates": [5.0, 5.0]})
+        ok_(session.flushed[1][0].spot_location is None)
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -0,0 +1,95 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_, assert_almost_equal, raises
+
+from sqlalchemy import MetaData, Table, Column, Integer
+
+from geoalchemy import local
+from geoalchemy.base import WKTSpatialElement, WKBSpatialElement
+from geoalchemy.functions import functions
+from geoalchemy.geometry import Geometry
+from geoalchemy.utils import from_wkb
+
+
+class _Session(object):
+    """Records the functions that are sent to the database."""
+
+    def __init__(self):
+        self.queries = []
+
+    def scalar(self, clause):
+        self.queries.append(clause)
+        return 'database'
+
+
+class TestLocal(TestCase):
+
+    def test_point(self):
+        point = WKTSpatialElement('POINT(-88.5945861592357 42.9480095987261)')
+        eq_(local.evaluate(point.x), -88.5945861592357)
+        eq_(local.evaluate(point.y), 42.9480095987261)
+        eq_(local.evaluate(point.dimension), 0)
+        eq_(local.evaluate(functions.geometry_type(point)), 'POINT')
+        eq_(local.evaluate(point.num_points), None)
+
+    def test_linestring(self):
+        line = WKTSpatialElement('LINESTRING(0 0,3 4,3 10)', 2249)
+        eq_(local.evaluate(line.length), 11.0)
+        eq_(local.evaluate(line.area), 0.0)
+        eq_(local.evaluate(line.num_points), 3)
+        eq_(local.evaluate(line.is_closed), False)
+        eq_(local.evaluate(line.dimension), 1)
+
+        start_point = local.evaluate(line.start_point)
+        ok_(isinstance(start_point, WKBSpatialElement))
+        eq_(start_point.srid, 2249)
+        eq_(from_wkb(start_point.geom_wkb), {"type": "Point", "coordinates": [0.0, 0.0]})
+        eq_(local.evaluate(line.end_point.y), 10.0)
+        eq_(local.evaluate(line.point_n(2).x), 3.0)
+        eq_(local.evaluate(line.point_n(4)), None)
+
+    def test_polygon(self):
+        polygon = WKTSpatialElement('POLYGON((0 0,0 10,10 10,10 0,0 0),(2 2,4 2,4 4,2 4,2 2))')
+        eq_(local.evaluate(polygon.area), 96.0)
+        eq_(local.evaluate(polygon.length), 0)
+        eq_(local.evaluate(polygon.is_closed), True)
+        eq_(local.evaluate(polygon.dimension), 2)
+
+        centroid = from_wkb(local.evaluate(polygon.centroid).geom_wkb)["coordinates"]
+        assert_almost_equal(centroid[0], 5.0833333333)
+        assert_almost_equal(centroid[1], 5.0833333333)
+
+        envelope = local.evaluate(functions.envelope('LINESTRING(0 0,4 8,10 2)'))
+        eq_(local.evaluate(envelope.area), 80.0)
+        eq_(local.evaluate(functions.geometry_type(envelope)), 'POLYGON')
+
+    def test_collections(self):
+        eq_(local.evaluate(functions.area('MULTIPOLYGON(((0 0,0 1,1 1,0 0)),((5 5,5 7,7 7,7 5,5 5)))')), 4.5)
+        eq_(local.evaluate(functions.length('MULTILINESTRING((0 0,0 1),(1 1,1 3))')), 3.0)
+        eq_(local.evaluate(functions.dimension('GEOMETRYCOLLECTION(POINT(1 1),LINESTRING(0 0,1 1))')), 1)
+        eq_(local.evaluate(functions.centroid('MULTIPOINT(0 0,4 0,4 2)').x), 8.0 / 3)
+
+    def test_scalar(self):
+        session = _Session()
+        eq_(local.scalar(session, WKTSpatialElement('POINT(1 2)').x), 1.0)
+        eq_(session.queries, [])
+
+        # not supported locally
+        eq_(local.scalar(session, WKTSpatialElement('POINT(1 2)').buffer(5).area), 'database')
+        # not known in Python
+        table = Table('spots', MetaData(), Column('id', Integer, primary_key=True),
+                      Column('spot_location', Geometry(2)))
+        eq_(local.scalar(session, functions.area(table.c.spot_location)), 'database')
+        eq_(len(session.queries), 2)
+
+    @raises(NotImplementedError)
+    def test_evaluate_not_supported(self):
+        local.evaluate(functions.distance('POINT(0 0)', 'POINT(1 1)'))
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -0,0 +1,179 @@
+from unittest import TestCase
+from nose.tools import ok_, eq_, assert_almost_equal
+
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+
+from geoalchemy.mvt import tile_bounds, encode, tile, _geometry_commands, _to_tile, _clip
+from geoalchemy.functions import _WKBType
+from geoalchemy.twkb import _read_varint
+from geoalchemy.utils import to_wkb, from_wkt
+from geoalchemy.tests.fixtures import ScalarSession, lakes
+
+
+def _read_message(data):
+    """Reads the fields of a protocol buffer message as (field, value) list."""
+    data = bytearray(data)
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        wire_type = key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = str(data[pos:pos + 8]), pos + 8
+        else:
+            length, pos = _read_varint(data, pos)
+            value, pos = str(data[pos:pos + length]), pos + length
+        fields.append((key >> 3, value))
+    return fields
+
+def _read_packed(data):
+    data = bytearray(data)
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+class TestMVT(TestCase):
+
+    def test_tile_bounds(self):
+        bounds = tile_bounds(0, 0, 0)
+        assert_almost_equal(bounds[0], -20037508.342789244)
+        assert_almost_equal(bounds[3], 20037508.342789244)
+        eq_(tile_bounds(1, 1, 0), (0.0, 0.0, bounds[2], bounds[3]))
+
+    def test_geometry_commands(self):
+        # examples of the vector tile specification
+        eq_(_geometry_commands({"type": "Point", "coordinates": [25, 17]}), (1, [9, 50, 34]))
+        eq_(_geometry_commands({"type": "MultiPoint", "coordinates": [[5, 7], [3, 2]]}),
+            (1, [17, 10, 14, 3, 9]))
+        eq_(_geometry_commands({"type": "LineString", "coordinates": [[2, 2], [2, 10], [10, 10]]}),
+            (2, [9, 4, 4, 18, 0, 16, 16, 0]))
+        eq_(_geometry_commands({"type": "Polygon", "coordinates": [[[3, 6], [8, 12], [20, 34], [3, 6]]]}),
+            (3, [9, 6, 12, 18, 10, 12, 24, 44, 15]))
+
+    def test_ring_orientation(self):
+        # the exterior ring is reversed, the interior ring is kept
+        exterior = [[0, 0], [0, 10], [10, 10], [10, 0], [0, 0]]
+        interior = [[2, 2], [2, 4], [4, 4], [4, 2], [2, 2]]
+        eq_(_geometry_commands({"type": "Polygon", "coordinates": [exterior, interior]}),
+            (3, [9, 20, 0, 26, 0, 20, 19, 0, 0, 19, 15,
+                 9, 4, 4, 26, 0, 4, 4, 0, 0, 3, 15]))
+
+    def test_collapsed_geometries(self):
+        eq_(_geometry_commands({"type": "LineString", "coordinates": [[0.1, 0.1], [0.2, 0.3]]}), None)
+        eq_(_geometry_commands({"type": "Polygon",
+                                "coordinates": [[[0, 0], [0.2, 0.2], [0, 0.4], [0, 0]]]}), None)
+
+    def test_clip(self):
+        eq_(_clip({"type": "LineString", "coordinates": [[-10, 5], [5, 5], [5, 20], [8, 20], [8, 5]]},
+                  0, 10),
+            {"type": "MultiLineString", "coordinates": [[[0, 5], [5, 5], [5, 10]], [[8, 10], [8, 5]]]})
+        eq_(_clip({"type": "Polygon", "coordinates": [[[-5, -5], [-5, 5], [5, 5], [5, -5], [-5, -5]]]},
+                  0, 10),
+            {"type": "MultiPolygon", "coordinates": [[[[0, 0], [0, 5], [5, 5], [5, 0]]]]})
+        eq_(_clip({"type": "MultiPoint", "coordinates": [[1, 1], [11, 1]]}, 0, 10),
+            {"type": "MultiPoint", "coordinates": [[1, 1]]})
+        eq_(_clip({"type": "Polygon", "coordinates": [[[20, 20], [20, 30], [30, 30], [20, 20]]]}, 0, 10),
+            {"type": "MultiPolygon", "coordinates": []})
+
+    def test_to_tile(self):
+        geom = _to_tile({"type": "Point", "coordinates": [0.0, 0.0]}, tile_bounds(1, 0, 0), 4096, 64,
+                        lonlat=True)
+        eq_(geom["type"], "MultiPoint")
+        assert_almost_equal(geom["coordinates"][0][0], 4096.0)
+        assert_almost_equal(geom["coordinates"][0][1], 4096.0)
+        geom = _to_tile({"type": "Point", "coordinates": [0.0, 0.0]}, tile_bounds(1, 1, 1), 4096, 64)
+        eq_(geom, {"type": "MultiPoint", "coordinates": [[0.0, 0.0]]})
+        geom = _to_tile(from_wkt('GEOMETRYCOLLECTION(POINT(0 0),GEOMETRYCOLLECTION(POINT(0 0),'
+                                 'POINT(-10000000 0)))'), tile_bounds(1, 1, 1), 4096, 64)
+        eq_(geom, {"type": "GeometryCollection",
+                   "geometries": [{"type": "MultiPoint", "coordinates": [[0.0, 0.0]]},
+                                  {"type": "GeometryCollection",
+                                   "geometries": [{"type": "MultiPoint", "coordinates": [[0.0, 0.0]]},
+                                                  {"type": "MultiPoint", "coordinates": []}]}]})
+
+    def test_encode(self):
+        data = encode([('points', [({"type": "Point", "coordinates": [25, 17]},
+                                    {"name": u'A', "height": 12, "depth": -1.5, "empty": None}, 1),
+                                   ({"type": "Point", "coordinates": [1, 1]}, {"name": u'A'})])])
+        layers = _read_message(data)
+        eq_([field for (field, value) in layers], [3])
+        layer = _read_message(layers[0][1])
+        eq_(layer[:2], [(15, 2), (1, 'points')])
+        eq_(layer[-1], (5, 4096))
+        eq_([value for (field, value) in layer if field == 3], ['depth', 'height', 'name'])
+        eq_([_read_message(value) for (field, value) in layer if field == 4],
+            [[(3, '\x00\x00\x00\x00\x00\x00\xf8\xbf')], [(5, 12)], [(1, 'A')]])
+
+        features = [_read_message(value) for (field, value) in layer if field == 2]
+        eq_(len(features), 2)
+        eq_(features[0][0], (1, 1))
+        eq_(_read_packed(features[0][1][1]), [0, 0, 1, 1, 2, 2])
+        eq_(features[0][2], (3, 1))
+        eq_(_read_packed(features[0][3][1]), [9, 50, 34])
+        eq_(_read_packed(features[1][0][1]), [2, 2])
+
+    def test_encode_collection(self):
+        collection = {"type": "GeometryCollection",
+                      "geometries": [{"type": "Point", "coordinates": [1, 1]},
+                                     {"type": "LineString", "coordinates": [[0, 0], [5, 0]]},
+                                     {"type": "GeometryCollection",
+                                      "geometries": [{"type": "MultiPoint", "coordinates": [[3, 2]]}]}]}
+        layer = _read_message(encode([('mixed', [(collection, {}, 7)])]))
+        layer = _read_message(layer[0][1])
+        features = [_read_message(value) for (field, value) in layer if field == 2]
+        eq_(len(features), 2)
+        # one feature per geometry type, only the first one has the id
+        eq_(features[0][:2], [(1, 7), (3, 1)])
+        eq_(_read_packed(features[0][2][1]), [17, 2, 2, 4, 2])
+        eq_(features[1][0], (3, 2))
+        eq_(_read_packed(features[1][1][1]), [9, 0, 0, 10, 10, 0])
+
+    def test_tile(self):
+        session = ScalarSession(PGDialect_psycopg2(), [buffer('tile')])
+        eq_(tile(session, lakes.c.lake_geom, 1, 0, 0, [lakes.c.lake_name]), 'tile')
+        eq_(str(session.queries[0]),
+            'SELECT ST_AsMVT(mvt_features, %(ST_AsMVT_2)s, %(ST_AsMVT_3)s, %(ST_AsMVT_4)s) AS "ST_AsMVT_1" \n'
+            'FROM (SELECT ST_AsMVTGeom(ST_Transform(lakes.lake_geom, %(param_1)s), '
+            'ST_MakeEnvelope(%(ST_MakeEnvelope_1)s, %(ST_MakeEnvelope_2)s, %(ST_MakeEnvelope_3)s, '
+            '%(ST_MakeEnvelope_4)s, %(ST_MakeEnvelope_5)s), %(param_2)s, %(param_3)s, %(param_4)s) '
+            'AS mvt_geometry, lakes.lake_name AS lake_name \n'
+            'FROM lakes \n'
+            'WHERE lakes.lake_geom && ST_GeomFromText(%(ST_GeomFromText_1)s, %(ST_GeomFromText_2)s)) '
+            'AS mvt_features')
+        eq_(session.queries[0].params['ST_AsMVT_2'], 'lakes')
+
+        wkb = to_wkb({"type": "Polygon", "coordinates": [[[-100, 10], [-100, 50], [-60, 50], [-60, 10],
+                                                          [-100, 10]]]})
+        session = ScalarSession(MySQLDialect(), [(wkb, u'Lake')])
+        layer = _read_message(_read_message(tile(session, lakes.c.lake_geom, 2, 0, 1,
+                                                 [lakes.c.lake_name], layer='water'))[0][1])
+        # the WKB value is converted by the dialect (e.g. from an Oracle LOB)
+        ok_(isinstance(session.queries[0].result_map['wkb_1'][-1], _WKBType))
+        eq_(str(session.queries[0]),
+            'SELECT AsBinary(lakes.lake_geom) AS wkb_1, lakes.lake_name \n'
+            'FROM lakes \n'
+            'WHERE MBRIntersects(lakes.lake_geom, GeomFromText(%s, %s))')
+        eq_(layer[1], (1, 'water'))
+        feature = _read_message(layer[2][1])
+        eq_(feature[1], (3, 3))
+        # the polygon is clipped at the right edge of the tile (plus buffer)
+        commands = _read_packed(feature[2][1])
+        eq_(commands[0], 9)
+        eq_(commands[1], (4096 + 64) * 2)
+        eq_(commands[-1], 15)
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
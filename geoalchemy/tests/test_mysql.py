@@ -438,6 +438,18 @@ class TestGeometry(TestCase):
         ok_(session.scalar(functions._within_distance('Polygon((0 0, 1 0, 1 8, 0 8, 0 0))',
                                                       'Polygon((-5 -5, 5 -5, 5 5, -5 5, -5 -5))', 0)))
 
+    def test_bbox_minimum(self):
+        # MySQL >= 5.7.6 returns points and lines as envelopes of points and straight lines
+        for (wkt, lower_left) in [('POINT(1 2)', (1, 2)), ('LINESTRING(3 5,3 1)', (3, 1)),
+                                  ('LINESTRING(4 1,-2 1)', (-2, 1)),
+                                  ('POLYGON((0 0,2 -1,3 4,0 0))', (0, -1))]:
+            eq_((session.scalar(functions._xmin(wkt)), session.scalar(functions._ymin(wkt))),
+                lower_left)
+        from geoalchemy.query import spatial_join
+        eq_(session.query(Spot.spot_id, Lake.lake_id).filter(
+                spatial_join(Spot.spot_location, Lake.lake_geom, 'within', (-89, 43, -88.9, 43.1))).count(),
+            1)
+
     @raises(OperationalError)
     def test_constraint_nullable(self):
         road_null = Road(road_name=u'Jeff Rd', road_geom=None)
@@ -525,6 +525,15 @@ class TestGeometry(TestCase):
         ok_(p2 not in spots_within)
         eq_(session.scalar(functions.within('LINESTRING(0 1, 2 1)', 'POLYGON((-1 -1, 3 -1, 3 2, -1 2, -1 -1))')), True)
 
+    def test_sdo_join(self):
+        from geoalchemy.oracle import sdo_join
+        pairs = sdo_join(session, Spot.spot_location, Lake.lake_geom, 'INSIDE').all()
+        eq_(sorted((s.spot_id, l.lake_id) for (s, l) in pairs),
+            sorted((s.spot_id, l.lake_id) for (s, l) in session.query(Spot, Lake).filter(
+                Spot.spot_location.within(Lake.lake_geom)).all()))
+        ok_((session.query(Spot).get(2), session.query(Lake).filter(
+            Lake.lake_name=='Lake Blue').one()) in pairs)
+
     def test_overlaps(self):
         l1 = session.query(Lake).filter(Lake.lake_name=='Lake White').one()
         l2 = session.query(Lake).filter(Lake.lake_name=='Lake Blue').one()
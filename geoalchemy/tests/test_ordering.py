@@ -0,0 +1,138 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_, raises
+
+from sqlalchemy import MetaData, Table, Column, Integer, String
+from sqlalchemy.orm import mapper
+from sqlalchemy.dialects.sqlite.base import SQLiteDialect
+from sqlalchemy.dialects.oracle.base import OracleDialect
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+from geoalchemy import GeometryExtensionColumn, GeometryColumn, Point, WKTSpatialElement, WKBSpatialElement
+from geoalchemy.base import PersistentSpatialElement
+from geoalchemy.ordering import geohash, hilbert, CurveKey, ordered, load_keys, cluster
+from geoalchemy.tests.fixtures import FakeSession, point
+
+
+class Tree(object):
+    pass
+
+trees = Table('trees', MetaData(),
+              Column('tree_id', Integer, primary_key=True),
+              Column('tree_name', String),
+              GeometryExtensionColumn('tree_geom', Point(2, srid=4326)))
+mapper(Tree, trees, properties={'tree_geom': GeometryColumn(trees.c.tree_geom)})
+
+trees_ordered = Table('trees_ordered', MetaData(),
+                      Column('tree_id', Integer, primary_key=True),
+                      Column('tree_name', String),
+                      GeometryExtensionColumn('tree_geom', Point(2, srid=4326)))
+
+
+class _CopyError(Exception):
+    pass
+
+class _FailingSession(FakeSession):
+
+    def execute(self, query, params=None):
+        FakeSession.execute(self, query, params)
+        if str(self.queries[-1]).startswith('INSERT INTO trees_ordered'):
+            raise _CopyError()
+        return self
+
+
+class TestCurves(TestCase):
+
+    def test_geohash(self):
+        eq_(geohash(-5.6, 42.6, 5), 'ezs42')
+        eq_(geohash(10.40744, 57.64911, 11), 'u4pruydqqvj')
+        eq_(geohash(10.40744, 57.64911), 'u4pruydqqvj' + geohash(10.40744, 57.64911)[11])
+
+    def test_hilbert(self):
+        eq_([hilbert(x, y, (0, 0, 2, 2), 1) for (x, y) in [(0.5, 0.5), (0.5, 1.5), (1.5, 1.5), (1.5, 0.5)]],
+            [0, 1, 2, 3])
+        # consecutive positions are neighbouring cells
+        cells = dict((hilbert(x + 0.5, y + 0.5, (0, 0, 32, 32), 5), (x, y))
+                     for x in xrange(32) for y in xrange(32))
+        eq_(sorted(cells), range(1024))
+        ok_(all(abs(cells[i][0] - cells[i + 1][0]) + abs(cells[i][1] - cells[i + 1][1]) == 1
+                for i in xrange(1023)))
+        # outside of the extent
+        eq_(hilbert(-5, -5, (0, 0, 2, 2), 1), 0)
+        eq_(hilbert(5, -5, (0, 0, 2, 2), 1), 3)
+
+    def test_curve_key(self):
+        key = CurveKey('hilbert', (0, 0, 2, 2), order=1)
+        eq_([key((0.5, 1.5)), key('LINESTRING(1 1,2 2)'), key(point(1.5, 0.5)),
+             key(WKTSpatialElement('POINT(1.5 1.5)')), key(None)], [1, 2, 3, 2, None])
+        eq_(CurveKey('geohash', precision=5)('POINT(-5.6 42.6)'), 'ezs42')
+        # the cached bounds of loaded geometries are used
+        element = PersistentSpatialElement(WKBSpatialElement(point(0.5, 1.5)))
+        eq_(key(element), 1)
+        eq_(element.__dict__['_bounds'], (0.5, 1.5, 0.5, 1.5))
+
+    @raises(Exception)
+    def test_curve_key_extent(self):
+        CurveKey('hilbert')
+
+    def test_ordered(self):
+        points = ['POINT(1.5 0.5)', None, 'POINT(0.5 0.5)', 'POINT(1.5 1.5)', 'POINT(0.5 1.5)']
+        eq_(ordered(points, order=1),
+            ['POINT(0.5 0.5)', 'POINT(0.5 1.5)', 'POINT(1.5 1.5)', 'POINT(1.5 0.5)', None])
+        trees = []
+        for wkt in points[::-1]:
+            if wkt is None:
+                continue
+            tree = Tree()
+            tree.tree_geom = WKTSpatialElement(wkt)
+            trees.append(tree)
+        eq_([t.tree_geom.geom_wkt for t in ordered(trees, 'geohash', key=lambda t: t.tree_geom)],
+            ['POINT(0.5 0.5)', 'POINT(1.5 0.5)', 'POINT(0.5 1.5)', 'POINT(1.5 1.5)'])
+
+
+class TestLoadKeys(TestCase):
+
+    def setUp(self):
+        rows = [(1, point(1.5, 0.5)), (2, point(0.5, 0.5)), (3, None), (4, point(0.5, 1.5))]
+        self.session = FakeSession(PGDialect_psycopg2(), rows)
+
+    def test_load_keys(self):
+        eq_(load_keys(self.session, Tree.tree_geom, order=1, batch_size=2),
+            [(0, 2), (1, 4), (3, 1), (None, 3)])
+        eq_(str(self.session.queries[0]),
+            'SELECT trees.tree_id, ST_AsBinary(ST_Envelope(trees.tree_geom)) AS wkb_1 \nFROM trees')
+
+    def test_cluster(self):
+        session = FakeSession(SQLiteDialect(), [])
+        cluster(session, trees.c.tree_geom, trees_ordered, keys=[(0, 2), (1, 4), (3, 1), (None, 3)],
+                batch_size=3)
+        queries = [str(q).strip() for q in session.queries]
+        eq_(queries[0], 'CREATE TEMPORARY TABLE trees_curve_positions (\n\ttree_id INTEGER, '
+            '\n\tcurve_position INTEGER\n)')
+        eq_(queries[1], 'INSERT INTO trees_curve_positions (tree_id, curve_position) VALUES (?, ?)')
+        eq_(len(queries), 5)
+        eq_(queries[3], 'INSERT INTO trees_ordered (tree_id, tree_name, tree_geom) '
+            'SELECT trees.tree_id, trees.tree_name, trees.tree_geom \nFROM trees, trees_curve_positions '
+            '\nWHERE trees.tree_id = trees_curve_positions.tree_id '
+            'ORDER BY trees_curve_positions.curve_position')
+        eq_(queries[4], 'DROP TABLE trees_curve_positions')
+
+        # Oracle and SQL Server use a regular table, which is dropped if copying fails
+        session = _FailingSession(OracleDialect(), [])
+        try:
+            cluster(session, trees.c.tree_geom, trees_ordered, keys=[(0, 2)])
+        except _CopyError:
+            pass
+        else:
+            ok_(False, 'the error is not raised')
+        queries = [str(q).strip() for q in session.queries]
+        ok_(queries[0].startswith('CREATE TABLE trees_curve_positions'))
+        eq_(queries[-1], 'DROP TABLE trees_curve_positions')
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -1,17 +1,21 @@
 from unittest import TestCase
 from sqlalchemy import (create_engine, MetaData, Column, Integer, String,
-        Numeric, func, Table)
+        Numeric, func, Table, select)
 from sqlalchemy.orm import sessionmaker, mapper, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import and_, ForeignKey
 from sqlalchemy.exc import IntegrityError
 
 from geoalchemy import (Geometry, GeometryCollection, GeometryColumn,
-        GeometryDDL, WKTSpatialElement, DBSpatialElement, GeometryExtensionColumn)
+        GeometryDDL, WKTSpatialElement, WKBSpatialElement, DBSpatialElement, GeometryExtensionColumn)
 from geoalchemy.functions import functions
+from geoalchemy.geometry import simplify, quantize
 from geoalchemy.postgis import PGComparator, pg_functions
+from geoalchemy import twkb, mvt
+from binascii import hexlify
 
 from nose.tools import eq_, ok_, raises, assert_almost_equal
+from nose.plugins.skip import SkipTest
 
 
 
@@ -53,6 +57,13 @@ mapper(Spot, spots_table, properties={
             'spot_location': GeometryColumn(spots_table.c.spot_location,
                                             comparator=PGComparator)})
 
+class DeferredSpot(object):
+    pass
+
+mapper(DeferredSpot, spots_table, properties={
+            'spot_location': GeometryColumn(spots_table.c.spot_location,
+                                            comparator=PGComparator, deferred=True)})
+
 class Shape(Base):
     __tablename__ = 'shapes'
 
@@ -158,6 +169,24 @@ class TestGeometry(TestCase):
         centroid_geom = DBSpatialElement(session.scalar(self.r.road_geom.centroid))
         eq_(session.scalar(functions.wkt(func.ST_GeomFromWKB(centroid_geom.wkb, 4326))), u'POINT(-88.5769371859941 42.9915634871979)')
 
+    def test_ewkb_internal(self):
+        shapes = Table('shapes', MetaData(),
+                       Column('shape_id', Integer, primary_key=True),
+                       GeometryExtensionColumn('shape_geom', GeometryCollection(2, ewkb_internal=True)))
+        sh = session.execute(select([shapes]).where(shapes.c.shape_id == 1)).first()
+        eq_(sh.shape_geom.desc.srid, 4326)
+        eq_(session.scalar(sh.shape_geom.wkt), 'GEOMETRYCOLLECTION(POINT(-88.3304141847134 42.6269904904459))')
+        eq_(session.scalar(sh.shape_geom.wkb), sh.shape_geom.geom_wkb)
+
+    def test_ewkt(self):
+        eq_(session.scalar(functions.srid(WKTSpatialElement('SRID=2249;POINT(1 2)'))), 2249)
+        spot = Spot(spot_height=1.0, spot_location='SRID=4326;POINT(-88.5 42.9)')
+        session.add(spot)
+        session.flush()
+        eq_(session.scalar(spot.spot_location.wkt), 'POINT(-88.5 42.9)')
+        ewkb = session.scalar(func.ST_AsEWKB(spot.spot_location))
+        eq_(session.scalar(functions.srid(WKBSpatialElement(ewkb))), 4326)
+
     def test_svg(self):
         eq_(session.scalar(self.r.road_geom.svg), u'M -88.674840936305699 -43.103503229299399 L -88.6464173694267 -42.998168834394903 -88.607961955413998 -42.968073292993601 -88.516003356687904 -42.936305777070103 -88.4390925286624 -43.003184757961797')
         ok_(self.r is session.query(Road).filter(Road.road_geom.svg == u'M -88.674840936305699 -43.103503229299399 L -88.6464173694267 -42.998168834394903 -88.607961955413998 -42.968073292993601 -88.516003356687904 -42.936305777070103 -88.4390925286624 -43.003184757961797').first())
@@ -175,6 +204,145 @@ class TestGeometry(TestCase):
         s = session.query(Spot).filter(Spot.spot_height==420.40).one()
         ok_(True) # todo: test with version 1.3.4
 
+    def test_twkb(self):
+        eq_(hexlify(session.scalar(pg_functions.twkb('POINT(1 2)'))), '01000204')
+        s = session.query(Spot).get(1)
+        eq_(twkb.from_twkb(session.scalar(s.spot_location.twkb(5))), twkb.from_twkb(twkb.encode(s.spot_location, 5)))
+
+    def test_mvt(self):
+        data = mvt.tile(session, Lake.lake_geom, 6, 16, 23, properties=[Lake.lake_name])
+        ok_('lakes' in data)
+        ok_('Lake Blue' in data)
+        eq_(mvt.tile(session, Lake.lake_geom, 6, 0, 0), '')
+
+    def test_tilecache(self):
+        import tempfile, os
+        from geoalchemy.tilecache import TileCache
+        fd, path = tempfile.mkstemp(suffix='.mbtiles')
+        os.close(fd)
+        try:
+            cache = TileCache(path, Lake.lake_geom, properties=[Lake.lake_name])
+            cache.listen(session)
+            data = cache.tile(session, 6, 16, 23)
+            ok_('Lake Blue' in data)
+            eq_(cache.get(6, 16, 23), data)
+            l = session.query(Lake).filter(Lake.lake_name=='Lake Blue').one()
+            l.lake_name = 'Lake Green'
+            session.commit()
+            eq_(cache.get(6, 16, 23), None)
+            ok_('Lake Green' in cache.tile(session, 6, 16, 23))
+            l.lake_name = 'Lake Blue'
+            session.commit()
+        finally:
+            os.remove(path)
+
+    def test_geopackage(self):
+        import tempfile, shutil, os
+        from geoalchemy import geopackage
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'lakes.gpkg')
+            count = session.query(Lake).count()
+            eq_(geopackage.write_features(session, Lake.lake_geom, path, properties=[Lake.lake_name]),
+                count)
+            features = list(geopackage.read_features(path, bbox=(-89, 43, -88.7, 43.3)))
+            eq_(sorted(properties['lake_name'] for (fid, properties, wkb, srs_id) in features),
+                ['Lake Blue', 'My Lake'])
+            eq_(geopackage.import_features(session, path, Lake.lake_geom, bbox=(-88.2, 42.5, -88, 42.8)), 1)
+            eq_(session.query(Lake).filter(Lake.lake_name=='Lake White').count(), 2)
+            session.rollback()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shapefile(self):
+        import tempfile, shutil, os
+        from geoalchemy import shapefile
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'lakes.shp')
+            count = session.query(Lake).count()
+            eq_(shapefile.write_features(session, Lake.lake_geom, path, properties=[Lake.lake_name]),
+                count)
+            eq_(sorted(properties['lake_name'] for (properties, wkb) in shapefile.read_features(path)),
+                sorted(lake.lake_name for lake in session.query(Lake)))
+            eq_(shapefile.import_features(session, path, Lake.lake_geom), count)
+            eq_(session.query(Lake).filter(Lake.lake_name=='Lake White').count(), 2)
+            session.rollback()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_envelope_index(self):
+        from geoalchemy.strtree import EnvelopeIndex
+        index = EnvelopeIndex(Lake.lake_geom)
+        index.load(session)
+        eq_(len(index), session.query(Lake).count())
+        point = 'POINT(-88.7 43.1)'
+        eq_([lake.lake_name for lake in index.query(session, point)
+             .filter(Lake.lake_geom.gcontains(WKTSpatialElement(point, 4326)))],
+            [lake.lake_name for lake in session.query(Lake)
+             .filter(Lake.lake_geom.gcontains(WKTSpatialElement(point, 4326)))])
+
+        index.listen(session)
+        lake = Lake(lake_name=u'Lake Index',
+                    lake_geom=WKTSpatialElement('POLYGON((10 10,10 11,11 11,11 10,10 10))', 4326))
+        session.add(lake)
+        session.commit()
+        eq_(index.search((10.5, 10.5)), [lake.lake_id])
+        session.delete(lake)
+        session.commit()
+        eq_(index.search((10.5, 10.5)), [])
+
+    def test_vectorized(self):
+        try:
+            from geoalchemy import vectorized
+        except ImportError:
+            raise SkipTest("NumPy is not installed")
+        lakes = session.query(Lake).order_by(Lake.lake_id).all()
+        points = ['POINT(-88.7 43.1)', 'POINT(-88.9 43.3)', 'POINT(-88.1 42.6)']
+        expected = [-1] * len(points)
+        for i, lake in enumerate(lakes):
+            for j, point in enumerate(points):
+                if expected[j] < 0 and session.scalar(lake.lake_geom.gcontains(point)):
+                    expected[j] = i
+        eq_(list(vectorized.containing([lake.lake_geom for lake in lakes], points)), expected)
+
+    def test_spatial_query(self):
+        from geoalchemy.query import SpatialQuery
+        query = SpatialQuery(Spot, session=session)
+        eq_(query.in_bbox((-88.7, 42.7, -88.5, 42.9)).count(),
+            session.query(Spot).filter(Spot.spot_location.intersects(
+                'POLYGON((-88.7 42.7,-88.7 42.9,-88.5 42.9,-88.5 42.7,-88.7 42.7))')).count())
+        eq_(query.within_radius((-88.5945861592357, 42.9480095987261), 0.1).count(),
+            session.query(Spot).filter(Spot.spot_location.within_distance(
+                'POINT(-88.5945861592357 42.9480095987261)', 0.1)).count())
+        nearest = query.nearest((-88.5945861592357, 42.9480095987261), 3).all()
+        eq_(len(nearest), 3)
+        eq_(nearest[0].spot_location.coords(session), [-88.5945861592357, 42.9480095987261])
+        eq_([s.spot_id for s in query.page_by_distance((-88.59, 42.94), 2, page=1)],
+            [s.spot_id for s in query.nearest((-88.59, 42.94), 4)][2:])
+        pages = list(query.pages_by_distance((-88.59, 42.94), 2))
+        eq_([s.spot_id for page in pages for (s, d) in page],
+            [s.spot_id for (s, d) in query.page_after((-88.59, 42.94), 100).all()])
+        ok_(all(len(page) == 2 for page in pages[:-1]))
+
+    def test_spatial_join(self):
+        from geoalchemy.query import spatial_join, tiles
+        buffered = Spot.spot_location.buffer(0.5)
+        eq_(sorted(session.query(Spot.spot_id, Lake.lake_id).filter(
+                spatial_join(Lake.lake_geom, buffered, 'within')).all()),
+            sorted(session.query(Spot.spot_id, Lake.lake_id).filter(
+                Lake.lake_geom.within(buffered)).all()))
+        eq_(sorted(session.query(Spot.spot_id, Lake.lake_id).filter(
+                spatial_join(Spot.spot_location, Lake.lake_geom, 'intersects')).all()),
+            sorted(session.query(Spot.spot_id, Lake.lake_id).filter(
+                Spot.spot_location.intersects(Lake.lake_geom)).all()))
+        joined = []
+        for tile in tiles((-90, 42, -88, 44), 3, 2):
+            joined.extend(session.query(Spot.spot_id, Lake.lake_id).filter(
+                spatial_join(Lake.lake_geom, Spot.spot_location, 'gcontains', tile)).all())
+        eq_(sorted(joined), sorted(session.query(Spot.spot_id, Lake.lake_id).filter(
+            Lake.lake_geom.gcontains(Spot.spot_location)).all()))
+
     def test_dimension(self):
         r = session.query(Road).filter(Road.road_name=='Graeme Ave').one()
         l = session.query(Lake).filter(Lake.lake_name=='My Lake').one()
@@ -277,6 +445,38 @@ class TestGeometry(TestCase):
         assert_almost_equal(session.scalar(functions.area(WKTSpatialElement('POLYGON((743238 2967416,743238 2967450,743265 2967450,743265.625 2967416,743238 2967416))',2249))),
                             928.625)
 
+    def test_simplify(self):
+        eq_(session.scalar(functions.wkt(functions.simplify('LINESTRING(0 0,5 0.1,10 0)', 1))),
+            u'LINESTRING(0 0,10 0)')
+        session.expunge_all()
+        r = session.query(Road).options(simplify(Road.road_geom, 0.1)).filter(Road.road_name=='Graeme Ave').one()
+        eq_(session.scalar(r.road_geom.num_points), 2)
+        session.expunge_all()
+
+    def test_quantize(self):
+        s = session.query(Spot).options(quantize(Spot.spot_location, 2)).filter(Spot.spot_height==420.40).one()
+        eq_(session.scalar(s.spot_location.wkt), u'POINT(-88.59 42.95)')
+        session.expunge_all()
+
+    def test_deferred(self):
+        spots = session.query(DeferredSpot).order_by(DeferredSpot.spot_id).all()
+        ok_('spot_location' not in spots[0].__dict__)
+        # the first access loads the geometries of all spots
+        eq_(session.scalar(spots[0].spot_location.wkt),
+            session.scalar(select([functions.wkt(spots_table.c.spot_location)],
+                                  spots_table.c.spot_id == spots[0].spot_id)))
+        ok_(all('spot_location' in spot.__dict__ for spot in spots))
+
+    def test_evaluate_many(self):
+        lakes = session.query(Lake).order_by(Lake.lake_id).all()
+        areas = functions.evaluate_many(session, [l.lake_geom for l in lakes] + [None], functions.area)
+        eq_(len(areas), len(lakes) + 1)
+        for l, area in zip(lakes, areas):
+            assert_almost_equal(area, session.scalar(l.lake_geom.area))
+        ok_(areas[-1] is None)
+        eq_(functions.evaluate_many(session, ['POINT(1 2)', 'SRID=2249;POINT(3 4)'], functions.srid),
+            [4326, 2249])
+
     def test_x(self):
         s = session.query(Spot).filter(Spot.spot_height==420.40).one()
         eq_(session.scalar(s.spot_location.x), -88.5945861592357)
@@ -321,6 +521,12 @@ class TestGeometry(TestCase):
         eq_(session.scalar(functions.wkt(functions.convex_hull('POINT(-88.5945861592357 42.9480095987261)'))),
             u'POINT(-88.5945861592357 42.9480095987261)')
 
+    def test_bounds(self):
+        r = session.query(Road).filter(Road.road_name=='Graeme Ave').one()
+        eq_(r.road_geom.bounds, (-88.6096339299363, 42.6988853949045, -88.5477708726115, 43.187101955414))
+        l = session.query(Lake).filter(Lake.lake_name=='Lake Deep').one()
+        eq_(l.lake_geom.bounds, (-88.9323248407643, 43.0165605095542, -88.9005573248408, 43.0399681528663))
+
     def test_envelope(self):
         r = session.query(Road).filter(Road.road_name=='Graeme Ave').one()
         eq_(session.scalar(functions.wkt(r.road_geom.envelope)),
@@ -524,6 +730,28 @@ class TestGeometry(TestCase):
         eq_(s, "BOX(-89.201512910828 42.6269904904459,-88.3304141847134 43.1051752038217)")
         eq_(sh, "BOX(-88.7968950764331 42.5584395350319,-88.0110670509554 43.2339172420382)")
 
+    def test_estimates(self):
+        from geoalchemy.query import estimated_extent, estimated_count
+        from geoalchemy.postgis import PGSpatialDialect
+        # _postgis_selectivity requires PostGIS 2.1
+        selectivity = PGSpatialDialect().postgis_version(engine) >= 2
+        # without statistics, there is no extent and the rows are counted
+        # with the spatial index
+        eq_(estimated_extent(session, Spot.spot_location), None)
+        if selectivity:
+            eq_(estimated_count(session, Spot.spot_location, (-90, 42, -88, 44)), 4)
+
+        # the estimates are read from the statistics of the table
+        session.execute('ANALYZE spots')
+        extent = estimated_extent(session, Spot.spot_location)
+        for (estimated, exact) in zip(extent, (-89.201512910828, 42.6269904904459,
+                                               -88.3304141847134, 43.1051752038217)):
+            assert_almost_equal(estimated, exact, places=3)
+        if not selectivity:
+            raise SkipTest("_postgis_selectivity requires PostGIS 2.1")
+        eq_(estimated_count(session, Spot.spot_location, (-90, 42, -88, 44)), 4)
+        eq_(estimated_count(session, Spot.spot_location, (0, 0, 1, 1)), 0)
+
     def test_union(self):
         l = session.query(functions.geometry_type(functions.union(Lake.lake_geom))). \
                 filter(Lake.lake_geom != None).scalar()
@@ -0,0 +1,322 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_, raises
+
+from sqlalchemy import MetaData, Table, Column, Integer, select, and_
+from sqlalchemy.orm import mapper, Session
+from sqlalchemy.dialects.sqlite.base import SQLiteDialect
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+from sqlalchemy.dialects.oracle.base import OracleDialect
+from sqlalchemy.dialects.mssql.base import MSDialect
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+from geoalchemy import GeometryExtensionColumn, GeometryColumn, Point, Polygon, WKTSpatialElement
+from geoalchemy.query import SpatialQuery, spatial_join, tiles, estimated_extent, estimated_count
+from geoalchemy.oracle import SDOJoin, sdo_join, rowid
+from geoalchemy.postgis import PGSpatialDialect
+from geoalchemy.tests.fixtures import FakeSession, FakeBind, Spot, Lake, spots, lakes
+
+
+class Pond(object):
+    pass
+
+ponds = Table('ponds', MetaData(),
+              Column('pond_id', Integer, primary_key=True),
+              GeometryExtensionColumn('pond_geom', Polygon(2, srid=4326)),
+              schema='gis')
+mapper(Pond, ponds, properties={'pond_geom': GeometryColumn(ponds.c.pond_geom)})
+
+
+def _sql(query, dialect):
+    return str(query.statement.compile(dialect=dialect)).split('\nWHERE ', 1)[1]
+
+
+class TestSpatialQuery(TestCase):
+
+    def setUp(self):
+        self.query = SpatialQuery(Spot)
+
+    def test_in_bbox(self):
+        query = self.query.in_bbox((0, 0, 1, 1), Spot.spot_location)
+        eq_(_sql(query, PGDialect_psycopg2()),
+            'spots.spot_location && ST_GeomFromText(%(ST_GeomFromText_1)s, %(ST_GeomFromText_2)s)')
+        eq_(query.statement.compile(dialect=PGDialect_psycopg2()).params['ST_GeomFromText_1'],
+            'POLYGON((0 0,0 1,1 1,1 0,0 0))')
+        eq_(_sql(query, MySQLDialect()), 'MBRIntersects(spots.spot_location, GeomFromText(%s, %s))')
+        query = self.query.in_bbox('POINT(1 2)', Spot.spot_location)
+        eq_(_sql(query, OracleDialect()),
+            'SDO_FILTER(spots.spot_location, MDSYS.SDO_GEOMETRY(:SDO_GEOMETRY_1, :SDO_GEOMETRY_2)) '
+            '= :SDO_FILTER_1')
+
+    def test_within_radius(self):
+        query = self.query.within_radius((1, 2), 3, Spot.spot_location)
+        eq_(_sql(query, MSDialect()),
+            'spots.spot_location.STDistance(geometry::STGeomFromText(:geometry::STGeomFromText_1, '
+            ':geometry::STGeomFromText_2)) <= :distance_1')
+        eq_(_sql(query, OracleDialect()),
+            'SDO_WITHIN_DISTANCE(spots.spot_location, MDSYS.SDO_GEOMETRY(:SDO_GEOMETRY_1, '
+            ':SDO_GEOMETRY_2), :SDO_WITHIN_DISTANCE_1) = :SDO_WITHIN_DISTANCE_2')
+
+    def test_nearest(self):
+        query = self.query.nearest(WKTSpatialElement('POINT(1 2)', 4326), 5, column=Spot.spot_location)
+        eq_(_sql(query, PGDialect_psycopg2()),
+            'spots.spot_location IS NOT NULL ORDER BY spots.spot_location <-> '
+            'ST_GeomFromText(%(ST_GeomFromText_1)s, %(ST_GeomFromText_2)s) \n LIMIT %(param_1)s')
+        ok_(str(query.statement.compile(dialect=MSDialect())).startswith('SELECT TOP 5 '))
+        eq_(_sql(query, MSDialect()),
+            'spots.spot_location.STDistance(geometry::STGeomFromText(:geometry::STGeomFromText_1, '
+            ':geometry::STGeomFromText_2)) IS NOT NULL ORDER BY spots.spot_location.STDistance('
+            'geometry::STGeomFromText(:geometry::STGeomFromText_3, :geometry::STGeomFromText_4))')
+        sql = str(query.statement.compile(dialect=OracleDialect()))
+        eq_(sql.split('\nWHERE ', 1)[1].split(')', 2)[2],
+            ' = :SDO_NN_2 ORDER BY SDO_NN_DISTANCE(1)) \nWHERE ROWNUM <= :ROWNUM_1')
+
+    def test_nearest_postgis1(self):
+        # PostGIS 1 has no <-> operator, the version is queried once per engine
+        bind = FakeBind(PGDialect_psycopg2(), '1.5.3')
+        session = Session(bind=bind)
+        query = SpatialQuery(Spot, session=session).nearest((1, 2), 5, column=Spot.spot_location)
+        eq_(bind.statements, ['SELECT postgis_lib_version() AS postgis_lib_version_1'])
+        eq_(_sql(query, bind.dialect),
+            'spots.spot_location IS NOT NULL ORDER BY ST_Distance(spots.spot_location, '
+            'ST_GeomFromText(%(ST_GeomFromText_1)s, %(ST_GeomFromText_2)s)) \n LIMIT %(param_1)s')
+        SpatialQuery(Spot, session=session).nearest((1, 2), 5, column=Spot.spot_location)
+        eq_(len(bind.statements), 1)
+        eq_(PGSpatialDialect().postgis_version(bind), 1)
+        eq_(query.statement.compile(dialect=OracleDialect()).params['SDO_NN_1'], 'sdo_num_res=5')
+
+    def test_nearest_filtered_oracle(self):
+        # sdo_num_res would be applied before the other conditions
+        queries = [self.query.nearest((1, 2), 5, max_distance=10, column=Spot.spot_location),
+                   self.query.filter(Spot.spot_height > 100).nearest((1, 2), 5, column=Spot.spot_location),
+                   self.query.join((Lake, Lake.lake_id == Spot.spot_id))
+                       .nearest((1, 2), 5, column=Spot.spot_location),
+                   self.query.filter(Spot.spot_height > 100)
+                       .page_by_distance((1, 2), 5, page=1, column=Spot.spot_location)]
+        for query in queries:
+            compiled = query.statement.compile(dialect=OracleDialect())
+            eq_([value for value in compiled.params.values() if str(value).startswith('sdo_')],
+                ['sdo_batch_size=0'])
+            ok_('ROWNUM' in str(compiled))
+
+    def test_page_by_distance(self):
+        dialect = SQLiteDialect()
+        dialect.server_version_info = (3, 7, 3)
+        query = self.query.page_by_distance((1, 2), 10, page=2, max_distance=4, column=Spot.spot_location)
+        sql = _sql(query, dialect)
+        eq_(sql.split(' AND ')[0], 'Distance(spots.spot_location, GeomFromText(?, ?)) <= ?')
+        eq_(sql.split(' AND spots.spot_location IS NOT NULL ')[1],
+            'ORDER BY Distance(spots.spot_location, GeomFromText(?, ?))\n LIMIT ? OFFSET ?')
+        eq_(query._limit, 10)
+        eq_(query._offset, 20)
+
+    def test_page_after(self):
+        query = self.query.page_after((1, 2), 10, column=Spot.spot_location)
+        eq_(_sql(query, PGDialect_psycopg2()),
+            'ST_Distance(spots.spot_location, ST_GeomFromText(%(ST_GeomFromText_3)s, '
+            '%(ST_GeomFromText_4)s)) IS NOT NULL ORDER BY ST_Distance(spots.spot_location, '
+            'ST_GeomFromText(%(ST_GeomFromText_5)s, %(ST_GeomFromText_6)s)), spots.spot_id \n '
+            'LIMIT %(param_1)s')
+
+        query = self.query.page_after((1, 2), 10, after=(0.5, 7), column=Spot.spot_location)
+        compiled = query.statement.compile(dialect=MSDialect())
+        eq_(str(compiled).split(' IS NOT NULL AND ')[1].split(' ORDER BY ')[0],
+            '(spots.spot_location.STDistance(geometry::STGeomFromText(:geometry::STGeomFromText_5, '
+            ':geometry::STGeomFromText_6)) > :distance_1 OR spots.spot_location.STDistance('
+            'geometry::STGeomFromText(:geometry::STGeomFromText_7, :geometry::STGeomFromText_8)) '
+            '= :distance_2 AND spots.spot_id > :spot_id_1)')
+        eq_((compiled.params['distance_1'], compiled.params['spot_id_1']), (0.5, 7))
+
+    def test_keyset_after(self):
+        from geoalchemy.query import _keyset_after
+        columns = [spots.c.spot_id, spots.c.spot_location]
+        eq_(str(_keyset_after(columns, (1, 2))),
+            'spots.spot_id > :spot_id_1 OR spots.spot_id = :spot_id_2 AND '
+            'spots.spot_location > :spot_location_1')
+
+    def test_pages_by_distance(self):
+        class _PageQuery(SpatialQuery):
+            pages = [[(Spot(), 1.0), (Spot(), 2.0)], [(Spot(), 2.0)]]
+            calls = []
+            def page_after(self, point, page_size, after=None, max_distance=None, column=None):
+                self.calls.append(after)
+                return self
+            def all(self):
+                return self.pages.pop(0)
+        for i, (spot, distance) in enumerate(_PageQuery.pages[0] + _PageQuery.pages[1]):
+            spot.spot_id = i + 1
+        query = _PageQuery(Spot)
+        eq_([len(page) for page in query.pages_by_distance((1, 2), 2)], [2, 1])
+        eq_(query.calls, [None, (2.0, 2)])
+
+    def test_spatial_join(self):
+        condition = spatial_join(Spot.spot_location, lakes.c.lake_geom, 'within')
+        eq_(str(condition.compile(dialect=PGDialect_psycopg2())),
+            'lakes.lake_geom && spots.spot_location AND '
+            'ST_Within(spots.spot_location, lakes.lake_geom)')
+        eq_(str(condition.compile(dialect=MSDialect())),
+            'lakes.lake_geom.Filter(spots.spot_location) = :Filter_1 AND '
+            'spots.spot_location.STWithin(lakes.lake_geom) = :STWithin_1')
+        dialect = SQLiteDialect()
+        dialect.server_version_info = (3, 7, 3)
+        # the subquery is correlated with the spots of the enclosing query
+        eq_(_sql(self.query.add_column(lakes.c.lake_id).filter(condition), dialect),
+            'lakes.rowid IN (SELECT idx_lakes_lake_geom.pkid \nFROM idx_lakes_lake_geom \n'
+            'WHERE MbrMaxX(spots.spot_location) >= xmin AND MbrMinX(spots.spot_location) <= xmax '
+            'AND MbrMaxY(spots.spot_location) >= ymin AND MbrMinY(spots.spot_location) <= ymax) '
+            'AND Within(spots.spot_location, lakes.lake_geom)')
+
+    def test_spatial_join_tile(self):
+        condition = spatial_join(spots.c.spot_location, lakes.c.lake_geom, 'intersects', (0, 0, 1, 2))
+        compiled = condition.compile(dialect=PGDialect_psycopg2())
+        eq_(str(compiled).split(' AND lakes.')[0],
+            'spots.spot_location && ST_GeomFromText(%(ST_GeomFromText_1)s, %(ST_GeomFromText_2)s) '
+            'AND ST_XMin(spots.spot_location) >= %(_xmin_1)s AND ST_XMin(spots.spot_location) < '
+            '%(_xmin_2)s AND ST_YMin(spots.spot_location) >= %(_ymin_1)s AND '
+            'ST_YMin(spots.spot_location) < %(_ymin_2)s')
+        eq_((compiled.params['ST_GeomFromText_1'], compiled.params['ST_GeomFromText_2']),
+            ('POLYGON((0 0,0 2,1 2,1 0,0 0))', 4326))
+        eq_(str(condition.compile(dialect=OracleDialect())).split(' AND ')[1],
+            'SDO_GEOM.SDO_MIN_MBR_ORDINATE(spots.spot_location, :SDO_MIN_MBR_ORDINATE_1) >= :_xmin_1')
+        # the envelope of points and of vertical or horizontal lines is not a polygon
+        compiled = condition.compile(dialect=MySQLDialect())
+        eq_(str(compiled).split(' AND ')[3],
+            'Y(CASE GeometryType(Envelope(spots.spot_location)) WHEN %s THEN Envelope(spots.spot_location) '
+            'WHEN %s THEN StartPoint(Envelope(spots.spot_location)) '
+            'ELSE StartPoint(ExteriorRing(Envelope(spots.spot_location))) END) >= %s')
+        eq_(compiled.construct_params().values().count('LINESTRING'), 4)
+
+    @raises(Exception)
+    def test_spatial_join_disjoint(self):
+        spatial_join(Spot.spot_location, lakes.c.lake_geom, 'disjoint')
+
+    def test_tiles(self):
+        result = tiles((0, 0, 4, 2), 2, 2)
+        eq_(result[0], (0, 0, 2, 1))
+        eq_(len(result), 4)
+        minx, miny, maxx, maxy = result[3]
+        eq_((minx, miny), (2, 1))
+        ok_(4 < maxx < 4.001 and 2 < maxy < 2.001)
+
+    @raises(NotImplementedError)
+    def test_nearest_mysql(self):
+        _sql(self.query.nearest((1, 2), column=Spot.spot_location), MySQLDialect())
+
+    def test_geometry_column(self):
+        class Lake(object):
+            pass
+        lakes = Table('lakes', MetaData(),
+                      Column('lake_id', Integer, primary_key=True),
+                      GeometryExtensionColumn('lake_geom', Point(2)))
+        mapper(Lake, lakes, properties={'lake_geom': GeometryColumn(lakes.c.lake_geom)})
+        ok_(SpatialQuery(Lake)._geometry_column(None) is Lake.lake_geom)
+
+    @raises(Exception)
+    def test_ambiguous_geometry_column(self):
+        self.query.in_bbox((0, 0, 1, 1))
+
+    def test_session(self):
+        from sqlalchemy.orm import sessionmaker
+        session = sessionmaker(query_cls=SpatialQuery)()
+        eq_(session.query(Spot).in_bbox((0, 0, 1, 1), Spot.spot_location).__class__, SpatialQuery)
+
+
+class TestSDOJoin(TestCase):
+
+    def test_sdo_join(self):
+        join = SDOJoin(spots.c.spot_location, Pond.pond_geom, "mask=INSIDE+COVEREDBY")
+        query = select([spots.c.spot_id, ponds.c.pond_id],
+                       and_(rowid(spots) == join.c.rowid1, rowid(ponds) == join.c.rowid2),
+                       from_obj=[join])
+        eq_(str(query.compile(dialect=OracleDialect())),
+            "SELECT spots.spot_id, gis.ponds.pond_id \n"
+            "FROM spots, gis.ponds, TABLE(SDO_JOIN('SPOTS', 'SPOT_LOCATION', 'GIS.PONDS', "
+            "'POND_GEOM', 'mask=INSIDE+COVEREDBY')) sdo_join \n"
+            "WHERE spots.rowid = sdo_join.rowid1 AND gis.ponds.rowid = sdo_join.rowid2")
+
+    def test_sdo_join_query(self):
+        query = sdo_join(Session(), Spot.spot_location, Pond.pond_geom, params="distance=10 unit=M")
+        sql = str(query.statement.compile(dialect=OracleDialect()))
+        eq_(sql.split('\nFROM ')[1],
+            "TABLE(SDO_JOIN('SPOTS', 'SPOT_LOCATION', 'GIS.PONDS', 'POND_GEOM', "
+            "'mask=ANYINTERACT distance=10 unit=M')) sdo_join "
+            "JOIN spots ON spots.rowid = sdo_join.rowid1 "
+            "JOIN gis.ponds ON gis.ponds.rowid = sdo_join.rowid2")
+        eq_([d['type'] for d in query.column_descriptions], [Spot, Pond])
+
+    def test_sdo_join_aliases(self):
+        # a self join, the aliases of a table are resolved to the table
+        spots1, spots2 = spots.alias('spots1'), spots.alias('spots2')
+        join = SDOJoin(spots1.c.spot_location, spots2.c.spot_location)
+        query = select([spots1.c.spot_id, spots2.c.spot_id],
+                       and_(rowid(spots1) == join.c.rowid1, rowid(spots2) == join.c.rowid2),
+                       from_obj=[join])
+        eq_(str(query.compile(dialect=OracleDialect())).split('\nFROM ')[1],
+            "spots spots1, spots spots2, TABLE(SDO_JOIN('SPOTS', 'SPOT_LOCATION', "
+            "'SPOTS', 'SPOT_LOCATION', 'mask=ANYINTERACT')) sdo_join \n"
+            "WHERE spots1.rowid = sdo_join.rowid1 AND spots2.rowid = sdo_join.rowid2")
+        ponds1 = ponds.alias('ponds1')
+        eq_(str(SDOJoin(spots1.c.spot_location, ponds1.c.pond_geom).compile(dialect=OracleDialect())),
+            "TABLE(SDO_JOIN('SPOTS', 'SPOT_LOCATION', 'GIS.PONDS', 'POND_GEOM', 'mask=ANYINTERACT'))")
+
+    @raises(Exception)
+    def test_sdo_join_same_table(self):
+        sdo_join(Session(), Spot.spot_location, Spot.spot_label)
+
+
+class TestEstimates(TestCase):
+
+    def test_postgis(self):
+        session = FakeSession(PGDialect_psycopg2(), [(-89.5, 42.1, -87.9, 43.6), (None, None, None, None),
+                                                  (12.4, ), (None, ), (3, )])
+        eq_(estimated_extent(session, Spot.spot_location), (-89.5, 42.1, -87.9, 43.6))
+        ok_('ST_EstimatedExtent(%(schema)s, %(table)s, %(column)s)' in str(session.queries[0]))
+        ok_('FROM pg_stats WHERE schemaname = %(schema)s' in str(session.queries[0]))
+        eq_(estimated_extent(session, ponds.c.pond_geom), None)
+        eq_(estimated_count(session, Spot.spot_location, (-89, 42, -88, 43)), 12)
+        ok_('_postgis_selectivity(c.oid, %(column)s' in str(session.queries[2]))
+        # without statistics, the bounding boxes are counted with the index
+        eq_(estimated_count(session, Spot.spot_location, (-89, 42, -88, 43)), 3)
+        ok_(str(session.queries[4]).startswith('SELECT count(*) AS count_1 \nFROM spots \n'
+                                               'WHERE spots.spot_location && '))
+
+    def test_spatialite(self):
+        from sqlalchemy import create_engine
+        engine = create_engine('sqlite://')
+        engine.execute("CREATE VIRTUAL TABLE idx_spots_spot_location USING rtree(pkid, xmin, xmax, ymin, ymax)")
+        session = Session(bind=engine)
+        eq_(estimated_extent(session, Spot.spot_location), None)
+        for (i, (x, y)) in enumerate([(1, 2), (5, 1), (3, 7), (-2, 4)]):
+            engine.execute("INSERT INTO idx_spots_spot_location VALUES (?, ?, ?, ?, ?)", i, x, x, y, y)
+        eq_(estimated_extent(session, Spot.spot_location), (-2, 1, 5, 7))
+        eq_(estimated_count(session, Spot.spot_location, (0, 0, 4, 4)), 1)
+        eq_(estimated_count(session, Spot.spot_location, (-5, 0, 10, 10)), 4)
+
+    def test_index_count(self):
+        session = FakeSession(OracleDialect(), [(3, )])
+        eq_(estimated_count(session, Spot.spot_location, (0, 0, 1, 1)), 3)
+        eq_(str(session.queries[0]),
+            'SELECT count(*) AS count_1 \nFROM spots \nWHERE SDO_FILTER(spots.spot_location, '
+            'MDSYS.SDO_GEOMETRY(:SDO_GEOMETRY_1, :SDO_GEOMETRY_2)) = :SDO_FILTER_1')
+
+    def test_oracle_extent(self):
+        session = FakeSession(OracleDialect(), [(0.0, 1.0, 2.0, 3.0)])
+        eq_(estimated_extent(session, Pond.pond_geom), (0.0, 1.0, 2.0, 3.0))
+        ok_('SDO_TUNE.EXTENT_OF(:table_name, :column_name)' in str(session.queries[0]))
+
+    def test_mssql_extent(self):
+        session = FakeSession(MSDialect(), [None])
+        eq_(estimated_extent(session, Spot.spot_location), None)
+        ok_('FROM sys.spatial_index_tessellations t' in str(session.queries[0]))
+
+    @raises(NotImplementedError)
+    def test_mysql_extent(self):
+        estimated_extent(FakeSession(MySQLDialect(), []), Spot.spot_location)
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
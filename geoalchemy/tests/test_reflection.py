@@ -0,0 +1,109 @@
+from unittest import TestCase
+from nose.tools import ok_, eq_, raises
+
+from sqlalchemy import create_engine, MetaData, Table
+from sqlalchemy.dialects.oracle.base import OracleDialect
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+from sqlalchemy.dialects.firebird.base import FBDialect
+
+from geoalchemy.geometry import Geometry, Point, LineString, Polygon, GeometryExtensionColumn
+from geoalchemy.reflection import geometry_type, geometry_columns, reflect_geometry_columns, reflect
+
+
+class _Engine(object):
+    """Returns ``rows`` for the catalog queries and records them."""
+
+    def __init__(self, dialect, rows):
+        self.dialect = dialect
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query, **params):
+        self.queries.append((str(query), params))
+        return self
+
+    def fetchall(self):
+        return self.rows
+
+
+def _spatialite_engine():
+    # a database with the metadata tables of SpatiaLite 2, without the extension
+    engine = create_engine('sqlite://')
+    engine.execute("CREATE TABLE geometry_columns (f_table_name TEXT, f_geometry_column TEXT, "
+                   "type TEXT, coord_dimension TEXT, srid INTEGER, spatial_index_enabled INTEGER)")
+    engine.execute("INSERT INTO geometry_columns VALUES ('spots', 'spot_location', 'POINT', 'XY', 4326, 1)")
+    engine.execute("INSERT INTO geometry_columns VALUES ('roads', 'road_geom', 'LINESTRING', 'XYZ', 2056, 0)")
+    engine.execute("CREATE TABLE spots (spot_id INTEGER PRIMARY KEY, spot_height NUMERIC, "
+                   "spot_location BLOB NOT NULL)")
+    engine.execute("CREATE TABLE roads (road_id INTEGER PRIMARY KEY, road_name TEXT, road_geom BLOB)")
+    return engine
+
+
+class TestReflection(TestCase):
+
+    def test_geometry_type(self):
+        point = geometry_type('POINT', 2, 2056)
+        ok_(isinstance(point, Point))
+        eq_((point.dimension, point.srid, point.spatial_index), (2, 2056, True))
+        ok_(isinstance(geometry_type('linestringm', 3), LineString))
+        eq_(geometry_type('POLYGON', 'XYZ', spatial_index=0).dimension, 3)
+        ok_(not geometry_type('POLYGON', 'XYZ', spatial_index=0).spatial_index)
+        eq_(type(geometry_type('CIRCULARSTRING')), Geometry)
+        eq_(geometry_type(None, None).srid, 4326)
+
+    def test_reflect(self):
+        engine = _spatialite_engine()
+        metadata = reflect(MetaData(), engine)
+        spots = metadata.tables['spots']
+        ok_(isinstance(spots.c.spot_location, GeometryExtensionColumn))
+        ok_(isinstance(spots.c.spot_location.type, Point))
+        eq_(spots.c.spot_location.type.srid, 4326)
+        ok_(not spots.c.spot_location.nullable)
+        eq_(list(spots.c.keys()), ['spot_id', 'spot_height', 'spot_location'])
+        roads = metadata.tables['roads']
+        eq_((roads.c.road_geom.type.name, roads.c.road_geom.type.dimension,
+             roads.c.road_geom.type.spatial_index), ('LINESTRING', 3, False))
+        ok_(not isinstance(roads.c.road_name, GeometryExtensionColumn))
+
+    def test_cache(self):
+        engine = _spatialite_engine()
+        spots = Table('spots', MetaData(), autoload=True, autoload_with=engine)
+        eq_([c.name for c in reflect_geometry_columns(spots, engine)], ['spot_location'])
+        engine.execute("INSERT INTO geometry_columns VALUES ('lakes', 'lake_geom', 'POLYGON', 'XY', 4326, 1)")
+        ok_(('lakes', 'lake_geom') not in geometry_columns(engine))
+        ok_(isinstance(geometry_columns(engine, refresh=True)[('lakes', 'lake_geom')], Polygon))
+
+    def test_postgis(self):
+        engine = _Engine(PGDialect_psycopg2(), [('spots', 'spot_location', 'POINTM', 3, 31467, True)])
+        columns = geometry_columns(engine, 'gis')
+        eq_(columns.keys(), [('spots', 'spot_location')])
+        eq_((columns[('spots', 'spot_location')].name, columns[('spots', 'spot_location')].dimension,
+             columns[('spots', 'spot_location')].srid), ('POINT', 3, 31467))
+        eq_(len(engine.queries), 1)
+        ok_('FROM geometry_columns g' in engine.queries[0][0])
+        geometry_columns(engine, 'gis')
+        eq_(len(engine.queries), 1)
+
+    def test_oracle(self):
+        engine = _Engine(OracleDialect(), [('SPOTS', 'SPOT_LOCATION', 'POINT', 2, 8307, 1),
+                                           ('ROADS', 'ROAD_GEOM', 'LINE', 2, 8307, 1),
+                                           ('LAKES', 'LAKE_GEOM', None, 2, None, 0)])
+        columns = geometry_columns(engine, 'gis')
+        eq_(engine.queries[0][1], {'schema': 'GIS'})
+        ok_('ALL_SDO_GEOM_METADATA m' in engine.queries[0][0])
+        eq_(columns[('roads', 'road_geom')].name, 'LINESTRING')
+        eq_(columns[('spots', 'spot_location')].srid, 8307)
+        eq_(type(columns[('lakes', 'lake_geom')]), Geometry)
+
+    @raises(NotImplementedError)
+    def test_unsupported_dialect(self):
+        geometry_columns(_Engine(FBDialect(), []))
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -0,0 +1,139 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_, raises
+from datetime import date
+import os
+import shutil
+import struct
+import tempfile
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, Numeric, Date
+from sqlalchemy.orm import mapper
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+
+from geoalchemy import GeometryExtensionColumn, GeometryColumn, MultiPolygon
+from geoalchemy.shapefile import Writer, read_features, write_features, import_features
+from geoalchemy.utils import to_wkb, from_wkb
+from geoalchemy.tests.fixtures import FakeSession
+
+
+class Park(object):
+    pass
+
+parks = Table('parks', MetaData(),
+              Column('park_id', Integer, primary_key=True),
+              Column('park_name', String(20)),
+              Column('park_area', Numeric(10, 2)),
+              Column('park_opened', Date),
+              GeometryExtensionColumn('park_geom', MultiPolygon(2, srid=4326)))
+mapper(Park, parks, properties={'park_geom': GeometryColumn(parks.c.park_geom)})
+
+_square = [[0, 0], [0, 4], [4, 4], [4, 0], [0, 0]]
+_hole = [[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]
+
+
+class TestShapefile(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'parks.shp')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_points(self):
+        writer = Writer(self.path, [('name', 'C', 10, 0), ('rank', 'N', 5, 0)])
+        writer.write(to_wkb({"type": "Point", "coordinates": [1, 2]}), {'name': u'A', 'rank': 1})
+        writer.write(None, {'name': u'B'})
+        writer.write(to_wkb({"type": "Point", "coordinates": [-3, 5]}), {})
+        writer.close()
+
+        shp = open(self.path, 'rb').read()
+        eq_(struct.unpack('>7i', shp[:28]), (9994, 0, 0, 0, 0, 0, len(shp) / 2))
+        eq_(struct.unpack('<2i4d', shp[28:68]), (1000, 1, -3, 2, 1, 5))
+        shx = open(os.path.join(self.directory, 'parks.shx'), 'rb').read()
+        eq_(len(shx), 100 + 3 * 8)
+        eq_(struct.unpack('>6i', shx[100:]), (50, 10, 64, 2, 70, 10))
+
+        features = list(read_features(self.path))
+        eq_(features[0], ({'name': u'A', 'rank': 1}, to_wkb({"type": "Point", "coordinates": [1, 2]})))
+        eq_(features[1], ({'name': u'B', 'rank': None}, None))
+        eq_(features[2][0], {'name': u'', 'rank': None})
+        eq_(from_wkb(features[2][1]), {"type": "Point", "coordinates": [-3, 5]})
+
+    def test_lines(self):
+        writer = Writer(self.path)
+        line = {"type": "LineString", "coordinates": [[0, 0, 1], [1, 1, 2]]}
+        lines = {"type": "MultiLineString", "coordinates": [[[0, 0, 1], [1, 1, 2]], [[2, 2, 0], [3, 3, 0]]]}
+        writer.write(to_wkb(line))
+        writer.write(to_wkb(lines))
+        writer.close()
+        eq_(writer.shape_type, 13)
+
+        eq_([from_wkb(wkb) for (properties, wkb) in read_features(self.path)], [line, lines])
+        eq_(from_wkb(list(read_features(self.path, multi=True))[0][1]),
+            {"type": "MultiLineString", "coordinates": [line["coordinates"]]})
+
+    def test_polygons(self):
+        writer = Writer(self.path)
+        # the orientation of the rings is fixed when writing
+        polygon = {"type": "Polygon", "coordinates": [_square[::-1], _hole[::-1]]}
+        polygons = {"type": "MultiPolygon", "coordinates": [[_square], [[[5, 5], [6, 5], [6, 6], [5, 5]]]]}
+        writer.write(to_wkb(polygon))
+        writer.write(to_wkb(polygons))
+        writer.close()
+
+        features = [from_wkb(wkb) for (properties, wkb) in read_features(self.path)]
+        eq_(features[0], {"type": "Polygon", "coordinates": [_square, _hole]})
+        eq_(features[1]["type"], "MultiPolygon")
+        eq_(len(features[1]["coordinates"]), 2)
+
+    @raises(Exception)
+    def test_mixed_shape_types(self):
+        writer = Writer(self.path)
+        writer.write(to_wkb({"type": "Point", "coordinates": [1, 2]}))
+        writer.write(to_wkb({"type": "LineString", "coordinates": [[1, 2], [3, 4]]}))
+
+    @raises(Exception)
+    def test_not_a_shapefile(self):
+        open(self.path, 'wb').write('\x00' * 100)
+        list(read_features(self.path))
+
+    def _write(self):
+        polygon = to_wkb({"type": "MultiPolygon", "coordinates": [[_square]]})
+        rows = [(polygon, u'Central', 16.5, date(1858, 1, 1)), (None, u'Hyde', None, None)]
+        session = FakeSession(MySQLDialect(), rows)
+        eq_(write_features(session, Park.park_geom, self.path,
+                           properties=[Park.park_name, Park.park_area, Park.park_opened],
+                           batch_size=1), 2)
+        return session
+
+    def test_write_features(self):
+        session = self._write()
+        eq_(str(session.queries[0]),
+            'SELECT AsBinary(parks.park_geom) AS wkb_1, parks.park_name, parks.park_area, '
+            'parks.park_opened \nFROM parks')
+        ok_(os.path.exists(os.path.join(self.directory, 'parks.prj')))
+
+        features = list(read_features(self.path))
+        eq_(features[0][0], {'park_name': u'Central', 'park_area': 16.5, 'park_opene': date(1858, 1, 1)})
+        # polygons of a MultiPolygon column
+        eq_(from_wkb(features[0][1]), {"type": "Polygon", "coordinates": [_square]})
+        eq_(features[1], ({'park_name': u'Hyde', 'park_area': None, 'park_opene': None}, None))
+
+    def test_import_features(self):
+        self._write()
+        session = FakeSession(MySQLDialect(), [])
+        eq_(import_features(session, self.path, Park.park_geom, batch_size=1), 2)
+        eq_(str(session.queries[0]),
+            'INSERT INTO parks (park_name, park_area, park_opened, park_geom) '
+            'VALUES (%s, %s, %s, GeomFromWKB(%s, %s))')
+        eq_(len(session.queries), 2)
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -150,6 +150,40 @@ class TestGeometry(TestCase):
     def test_fgf(self):
         eq_(b2a_hex(session.scalar(self.r.road_geom.fgf(1))), '020000000100000005000000d7db0998302b56c0876f04983f8d454000000000000000004250f5e65e2956c068ce11ffc37f45400000000000000000c8ed42d9e82656c0efc45ed3e97b454000000000000000007366f132062156c036c921ded8774540000000000000000078a18c171a1c56c053a5af5b688045400000000000000000')
 
+    def test_ordering(self):
+        from geoalchemy.ordering import load_keys, iter_ordered, cluster
+        keys = load_keys(session, Spot.spot_location, order=8)
+        eq_(len(keys), session.query(Spot).count())
+        eq_([s.spot_id for s in iter_ordered(session, Spot.spot_location, batch_size=2, keys=keys)],
+            [pk for (key, pk) in keys])
+        spots_ordered = Table('spots_ordered', MetaData(),
+                              Column('spot_id', Integer, primary_key=True),
+                              Column('spot_height', Numeric()),
+                              GeometryExtensionColumn('spot_location', Point(2, srid=4326)))
+        GeometryDDL(spots_ordered)
+        spots_ordered.create(session.connection())
+        cluster(session, Spot.spot_location, spots_ordered, keys=keys)
+        eq_([row[0] for row in session.execute(select([spots_ordered.c.spot_id]))],
+            sorted(pk for (key, pk) in keys))
+        eq_(session.execute(select([functions.wkt(spots_ordered.c.spot_location)],
+                                   spots_ordered.c.spot_id == keys[0][1])).scalar(),
+            session.scalar(session.query(Spot).get(keys[0][1]).spot_location.wkt))
+        spots_ordered.drop(session.connection())
+
+    def test_estimates(self):
+        from geoalchemy.query import estimated_extent, estimated_count
+        # the extent is decoded from the root node of the R*Tree, whose
+        # coordinates are single precision
+        extent = estimated_extent(session, Spot.spot_location)
+        for (estimated, exact) in zip(extent, (-89.201512910828, 42.6269904904459,
+                                               -88.3304141847134, 43.1051752038217)):
+            assert_almost_equal(estimated, exact, places=4)
+        ok_(extent[0] <= -89.201512910828 and extent[3] >= 43.1051752038217)
+        eq_(estimated_count(session, Spot.spot_location, (-90, 42, -88, 44)), 4)
+        eq_(estimated_count(session, Spot.spot_location, (-88.7, 42.9, -88.5, 43.0)), 1)
+        eq_(estimated_count(session, Road.road_geom, (-90, 42, -88, 44)),
+            session.query(Road).count())
+
     def test_dimension(self):
         l = session.query(Lake).get(1)
         r = session.query(Road).get(1)
@@ -0,0 +1,122 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_
+import random
+
+from sqlalchemy import MetaData, Table, Column, Integer, String
+from sqlalchemy.orm import mapper, sessionmaker, attributes
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+
+from geoalchemy import GeometryExtensionColumn, GeometryColumn, Polygon, WKTSpatialElement, WKBSpatialElement
+from geoalchemy.base import PersistentSpatialElement
+from geoalchemy.strtree import EnvelopeIndex, _bounds
+from geoalchemy.tests.fixtures import FakeSession, FlushedSession, box
+
+
+class District(object):
+    pass
+
+districts = Table('districts', MetaData(),
+                  Column('district_id', Integer, primary_key=True),
+                  Column('district_name', String),
+                  GeometryExtensionColumn('district_geom', Polygon(2, srid=4326)))
+mapper(District, districts, properties={'district_geom': GeometryColumn(districts.c.district_geom)})
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and a[1] <= b[3] and a[2] >= b[0] and a[3] >= b[1]
+
+
+class TestEnvelopeIndex(TestCase):
+
+    def setUp(self):
+        rnd = random.Random(1)
+        self.boxes = {}
+        for i in xrange(1, 501):
+            x, y = rnd.uniform(-180, 170), rnd.uniform(-90, 80)
+            self.boxes[i] = (x, y, x + rnd.uniform(0, 10), y + rnd.uniform(0, 10))
+        rows = [(i, box(*b)) for (i, b) in self.boxes.items()] + [(501, None)]
+        self.session = FakeSession(MySQLDialect(), rows)
+        self.index = EnvelopeIndex(District.district_geom, capacity=8)
+        self.index.load(self.session, batch_size=100)
+
+    def _expected(self, bounds):
+        return sorted(key for (key, b) in self.boxes.items() if _intersects(b, bounds))
+
+    def test_load(self):
+        eq_(str(self.session.queries[0]),
+            'SELECT districts.district_id, AsBinary(Envelope(districts.district_geom)) AS wkb_1 '
+            '\nFROM districts')
+        eq_(len(self.index), 500)
+        # leaves, 2 node levels and the root level
+        eq_([len(level) / 4 for level in self.index._levels], [500, 63, 8])
+
+    def test_search(self):
+        rnd = random.Random(2)
+        for i in xrange(50):
+            x, y = rnd.uniform(-180, 180), rnd.uniform(-90, 90)
+            bounds = (x, y, x + rnd.uniform(0, 30), y + rnd.uniform(0, 30))
+            eq_(sorted(self.index.search(bounds)), self._expected(bounds))
+        eq_(sorted(self.index.search((0, 0))), self._expected((0, 0, 0, 0)))
+        eq_(sorted(self.index.search('POINT(5 5)')), self._expected((5, 5, 5, 5)))
+
+    def test_persistent_bounds(self):
+        # the cached bounds of loaded geometries are used
+        element = PersistentSpatialElement(WKBSpatialElement(box(1, 2, 3, 4)))
+        eq_(_bounds(element), (1, 2, 3, 4))
+        eq_(element.__dict__['_bounds'], (1, 2, 3, 4))
+
+    def test_update(self):
+        self.index.update(1, (500, 500, 501, 501))
+        self.index.remove(2)
+        self.index.update(600, (502, 502, 503, 503))
+        eq_(sorted(self.index.search((499, 499, 510, 510))), [1, 600])
+        ok_(2 not in self.index.search(self.boxes[2]))
+        ok_(1 not in self.index.search(self.boxes[1]))
+        eq_(len(self.index), 500)
+        eq_(len(self.index._added), 2)
+
+        # the tree is rebuilt when there are too many changes
+        for key in xrange(10, 60):
+            self.index.remove(key)
+        ok_(len(self.index._keys) < 500)
+        eq_(len(self.index), 450)
+        eq_(sorted(self.index.search((499, 499, 510, 510))), [1, 600])
+
+    def test_query(self):
+        query = self.index.query(sessionmaker()(), self.boxes[1])
+        ok_('districts.district_id IN (' in str(query.statement.compile(dialect=MySQLDialect())))
+        query = self.index.query(sessionmaker()(), (1000, 1000))
+        eq_(str(query.whereclause), '1 = 0')
+
+    def test_flush(self):
+        district = District()
+        district.district_id = 700
+        district.district_geom = WKTSpatialElement('POLYGON((0 0,0 1,1 1,1 0,0 0))', 4326)
+        unchanged = District()
+        unchanged.district_id = 1
+        attributes.set_committed_value(unchanged, 'district_geom', None)
+        deleted = District()
+        deleted.district_id = 2
+        session = FlushedSession(new=[district], dirty=[unchanged], deleted=[deleted])
+        self.index.after_flush(session, None)
+        ok_(700 not in self.index.search((0.5, 0.5)))
+        self.index.after_commit(session)
+        ok_(700 in self.index.search((0.5, 0.5)))
+        ok_(1 in self.index.search(self.boxes[1]))
+        ok_(2 not in self.index.search(self.boxes[2]))
+
+        # rolled back changes are ignored
+        session = FlushedSession(deleted=[district])
+        self.index.after_flush(session, None)
+        self.index.after_rollback(session)
+        self.index.after_commit(session)
+        ok_(700 in self.index.search((0.5, 0.5)))
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
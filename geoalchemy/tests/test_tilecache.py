@@ -0,0 +1,120 @@
+from unittest import TestCase
+from nose.tools import eq_, ok_
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from sqlalchemy.orm import attributes
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+
+from geoalchemy import WKTSpatialElement
+from geoalchemy.tilecache import TileCache, _tile_range
+from geoalchemy.mvt import tile_bounds
+from geoalchemy.utils import to_wkb
+from geoalchemy.tests.fixtures import ScalarSession, FlushedSession, Lake
+
+
+class TestTileCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'lakes.mbtiles')
+        self.cache = TileCache(self.path, Lake.lake_geom, properties=[Lake.lake_name], maxzoom=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _tiles(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute("SELECT zoom_level, tile_column, tile_row FROM tiles "
+                                      "ORDER BY zoom_level, tile_column, tile_row").fetchall()
+        finally:
+            connection.close()
+
+    def test_metadata(self):
+        connection = sqlite3.connect(self.path)
+        metadata = dict(connection.execute("SELECT name, value FROM metadata").fetchall())
+        connection.close()
+        eq_(metadata['name'], 'lakes')
+        eq_(metadata['format'], 'pbf')
+        eq_(metadata['maxzoom'], '4')
+        ok_('"lake_name": "String"' in metadata['json'])
+
+    def test_tile(self):
+        wkb = to_wkb({"type": "Polygon", "coordinates": [[[-100, 10], [-100, 50], [-60, 50], [-60, 10],
+                                                          [-100, 10]]]})
+        session = ScalarSession(MySQLDialect(), [(wkb, u'Lake')])
+        data = self.cache.tile(session, 2, 0, 1)
+        eq_(len(session.queries), 1)
+        ok_('Lake' in data)
+        # the tile row is flipped (TMS)
+        eq_(self._tiles(), [(2, 0, 2)])
+        eq_(self.cache.tile(session, 2, 0, 1), data)
+        eq_(len(session.queries), 1)
+        # tiles above maxzoom are not cached
+        self.cache.tile(session, 5, 0, 1)
+        eq_(len(session.queries), 2)
+        eq_(self._tiles(), [(2, 0, 2)])
+
+    def test_tile_range(self):
+        eq_(_tile_range(0, tile_bounds(0, 0, 0), 0), (0, 0, 0, 0))
+        bounds = tile_bounds(3, 2, 5)
+        eq_(_tile_range(3, bounds, -0.01), (2, 5, 2, 5))
+        eq_(_tile_range(3, bounds, 0.01), (1, 4, 3, 6))
+
+    def test_invalidate(self):
+        for z, x, y in [(0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1), (5, 0, 0)]:
+            self.cache.put(z, x, y, 'tile')
+        self.cache.invalidate(tile_bounds(2, 3, 3))
+        eq_(self._tiles(), [(1, 0, 1), (1, 1, 1), (5, 0, 31)])
+        self.cache.invalidate()
+        eq_(self._tiles(), [])
+
+    def test_flush(self):
+        self.cache.put(1, 0, 0, 'tile')
+        self.cache.put(1, 1, 1, 'tile')
+        self.cache.put(1, 0, 1, 'tile')
+
+        lake = Lake()
+        lake.lake_geom = WKTSpatialElement('POLYGON((-10 -10,-10 -5,-5 -5,-5 -10,-10 -10))', 4326)
+        session = FlushedSession(new=[lake])
+        self.cache.after_flush(session, None)
+        # the tiles are removed on commit
+        eq_(len(self._tiles()), 3)
+        self.cache.after_commit(session)
+        eq_(self._tiles(), [(1, 0, 1), (1, 1, 0)])
+
+        # the old and the new geometry of an updated lake
+        self.cache.put(1, 1, 0, 'tile')
+        lake = Lake()
+        attributes.set_committed_value(lake, 'lake_geom',
+                                       WKTSpatialElement('POINT(100 -50)', 4326))
+        lake.lake_geom = WKTSpatialElement('POINT(-100 50)', 4326)
+        session = FlushedSession(dirty=[lake])
+        self.cache.after_flush(session, None)
+        self.cache.after_commit(session)
+        eq_(self._tiles(), [(1, 1, 1)])
+
+        # rolled back changes are ignored
+        session = FlushedSession(deleted=[lake])
+        self.cache.after_flush(session, None)
+        self.cache.after_rollback(session)
+        self.cache.after_commit(session)
+        eq_(self._tiles(), [(1, 1, 1)])
+
+        # geometries that are not loaded remove all tiles
+        session = FlushedSession(deleted=[Lake()])
+        self.cache.after_flush(session, None)
+        self.cache.after_commit(session)
+        eq_(self._tiles(), [])
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -0,0 +1,86 @@
+from unittest import TestCase
+from binascii import hexlify, unhexlify
+from nose.tools import eq_, ok_, raises
+
+from geoalchemy.twkb import to_twkb, from_twkb, encode, decode
+from geoalchemy.base import WKTSpatialElement, WKBSpatialElement
+from geoalchemy.utils import from_wkb, to_wkb
+
+
+class TestTWKB(TestCase):
+
+    def test_to_twkb(self):
+        # examples of the TWKB specification
+        eq_(hexlify(to_twkb({"type": "Point", "coordinates": [1.0, 2.0]})), '01000204')
+        eq_(hexlify(to_twkb({"type": "LineString", "coordinates": [[1.0, 1.0], [5.0, 5.0]]})),
+            '02000202020808')
+
+    def test_from_twkb(self):
+        eq_(from_twkb(unhexlify('02000202020808')),
+            {"type": "LineString", "coordinates": [[1.0, 1.0], [5.0, 5.0]]})
+
+    def test_precision(self):
+        geom = {"type": "Point", "coordinates": [1.234567, -2.345678]}
+        eq_(from_twkb(to_twkb(geom, 2)), {"type": "Point", "coordinates": [1.23, -2.35]})
+        eq_(from_twkb(to_twkb(geom, 5)), {"type": "Point", "coordinates": [1.23457, -2.34568]})
+        eq_(from_twkb(to_twkb({"type": "Point", "coordinates": [123456.0, 7.0]}, -3)),
+            {"type": "Point", "coordinates": [123000.0, 0.0]})
+
+    @raises(Exception)
+    def test_precision_range(self):
+        to_twkb({"type": "Point", "coordinates": [1.0, 2.0]}, 8)
+
+    @raises(Exception)
+    def test_z_precision_range(self):
+        to_twkb({"type": "Point", "coordinates": [1.0, 2.0, 3.0]}, 2, -1)
+
+    @raises(Exception)
+    def test_m_values(self):
+        to_twkb({"type": "LineString", "coordinates": [[1.0, 2.0, 3.0, 4.0], [3.0, 4.0, 5.0, 6.0]]})
+
+    @raises(Exception)
+    def test_decode_m_values(self):
+        # ST_AsTWKB('POINT M(1 2 1.5)', 0, 0, 2)
+        from_twkb('\x01\x08\x42\x02\x04\xac\x02')
+
+    @raises(Exception)
+    def test_decode_zm_values(self):
+        # ST_AsTWKB('POINT ZM(1 2 3 4)')
+        from_twkb('\x01\x08\x03\x02\x04\x06\x08')
+
+    def test_decode_z_values(self):
+        # ST_AsTWKB('POINT Z(1 2 3.5)', 0, 1)
+        eq_(from_twkb('\x01\x08\x05\x02\x04\x46'), {"type": "Point", "coordinates": [1.0, 2.0, 3.5]})
+
+    def test_roundtrip(self):
+        geometries = [
+            {"type": "LineString", "coordinates": [[1.25, 2.5, 3.0], [-3.5, 4.0, 5.25]]},
+            {"type": "Polygon", "coordinates": [[[0.0, 0.0], [1.5, 0.0], [1.0, 1.0], [0.0, 0.0]],
+                                                [[0.25, 0.25], [0.5, 0.25], [0.5, 0.5], [0.25, 0.25]]]},
+            {"type": "MultiPoint", "coordinates": [[1.0, 2.0], [3.0, 4.0]]},
+            {"type": "MultiLineString", "coordinates": [[[1.0, 2.0], [3.0, 4.0]], [[-5.0, 6.0], [7.0, -8.0]]]},
+            {"type": "MultiPolygon", "coordinates": [[[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]],
+                                                     [[[5.0, 5.0], [6.0, 5.0], [6.0, 6.0], [5.0, 5.0]]]]},
+            {"type": "GeometryCollection", "geometries": [{"type": "Point", "coordinates": [1.0, 2.0]},
+                                                          {"type": "LineString", "coordinates": [[1.0, 2.0], [3.0, 4.0]]}]}]
+        for geom in geometries:
+            eq_(from_twkb(to_twkb(geom, 2, 2)), geom)
+            eq_(from_twkb(to_twkb(geom, 2, 2, bbox=True, size=True)), geom)
+
+    def test_encode_decode(self):
+        wkt = WKTSpatialElement('LINESTRING(-88.5 42.25,-88.75 42.5)')
+        element = decode(encode(wkt, precision=2), srid=4326)
+        ok_(isinstance(element, WKBSpatialElement))
+        eq_(element.srid, 4326)
+        eq_(from_wkb(element.geom_wkb), {"type": "LineString", "coordinates": [[-88.5, 42.25], [-88.75, 42.5]]})
+        wkb = WKBSpatialElement(buffer(to_wkb({"type": "Point", "coordinates": [1.0, 2.0]})))
+        eq_(hexlify(encode(wkb)), '01000204')
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
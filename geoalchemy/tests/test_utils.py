@@ -0,0 +1,200 @@
+from unittest import TestCase
+from binascii import hexlify, unhexlify
+from nose.tools import eq_, ok_, raises
+
+from geoalchemy.utils import split_ewkb, make_ewkb, ewkb_srid, split_ewkt, make_ewkt,\
+    from_wkb, to_wkb, from_wkt, to_wkt, round_coordinates, wkb_bounds, geometry_bounds, \
+    as_geometry, geometry_components
+from geoalchemy.base import PersistentSpatialElement, WKBSpatialElement, WKTSpatialElement
+from geoalchemy.functions import functions
+
+
+class TestEWKB(TestCase):
+
+    # POINT(1 2) with SRID 4326, as returned by PostGIS
+    point_ewkb = '0101000020E6100000000000000000F03F0000000000000040'
+    point_wkb = '0101000000000000000000F03F0000000000000040'
+
+    def test_split_ewkb_hex(self):
+        wkb, srid = split_ewkb(self.point_ewkb)
+        eq_(srid, 4326)
+        eq_(hexlify(wkb).upper(), self.point_wkb)
+        ok_(isinstance(wkb, buffer))
+
+    def test_split_ewkb_binary(self):
+        wkb, srid = split_ewkb(buffer(unhexlify(self.point_ewkb)))
+        eq_(srid, 4326)
+        eq_(hexlify(wkb).upper(), self.point_wkb)
+
+    def test_split_ewkb_big_endian(self):
+        wkb, srid = split_ewkb('0020000001000010E63FF00000000000004000000000000000')
+        eq_(srid, 4326)
+        eq_(hexlify(wkb).upper(), '00000000013FF00000000000004000000000000000')
+
+    def test_split_ewkb_without_srid(self):
+        wkb, srid = split_ewkb(self.point_wkb)
+        eq_(srid, None)
+        eq_(hexlify(wkb).upper(), self.point_wkb)
+
+    def test_make_ewkb(self):
+        ewkb = make_ewkb(unhexlify(self.point_wkb), 4326)
+        eq_(hexlify(ewkb).upper(), self.point_ewkb)
+
+    def test_ewkb_srid(self):
+        eq_(ewkb_srid(self.point_ewkb), 4326)
+        eq_(ewkb_srid(unhexlify(self.point_ewkb)), 4326)
+        eq_(ewkb_srid(unhexlify(self.point_wkb)), None)
+
+
+class TestEWKT(TestCase):
+
+    def test_split_ewkt(self):
+        eq_(split_ewkt('SRID=4326;POINT(1 2)'), ('POINT(1 2)', 4326))
+        eq_(split_ewkt('srid=2249; POINT(1 2)'), ('POINT(1 2)', 2249))
+        eq_(split_ewkt('POINT(1 2)'), ('POINT(1 2)', None))
+
+    def test_make_ewkt(self):
+        eq_(make_ewkt('POINT(1 2)', 4326), 'SRID=4326;POINT(1 2)')
+
+
+class TestWKB(TestCase):
+
+    def test_from_wkb(self):
+        eq_(from_wkb(unhexlify('0101000000000000000000F03F0000000000000040')),
+            {"type": "Point", "coordinates": [1.0, 2.0]})
+        eq_(from_wkb('0101000020E6100000000000000000F03F0000000000000040'),
+            {"type": "Point", "coordinates": [1.0, 2.0]})
+        # big endian, ISO Z
+        eq_(from_wkb(unhexlify('00000003E93FF000000000000040000000000000004008000000000000')),
+            {"type": "Point", "coordinates": [1.0, 2.0, 3.0]})
+
+    def test_roundtrip(self):
+        geometries = [
+            {"type": "LineString", "coordinates": [[1.0, 2.0], [3.0, 4.0]]},
+            {"type": "Polygon", "coordinates": [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]]},
+            {"type": "MultiPoint", "coordinates": [[1.0, 2.0], [3.0, 4.0]]},
+            {"type": "MultiLineString", "coordinates": [[[1.0, 2.0], [3.0, 4.0]], [[5.0, 6.0], [7.0, 8.0]]]},
+            {"type": "MultiPolygon", "coordinates": [[[[0.0, 0.0, 1.0], [1.0, 0.0, 1.0], [1.0, 1.0, 1.0], [0.0, 0.0, 1.0]]]]},
+            {"type": "GeometryCollection", "geometries": [{"type": "Point", "coordinates": [1.0, 2.0]}]}]
+        for geom in geometries:
+            eq_(from_wkb(to_wkb(geom)), geom)
+
+    def test_dimensions(self):
+        line = {"type": "LineString", "coordinates": [[1.0, 2.0, 3.0, 4.0], [3.0, 4.0, 5.0, 6.0]]}
+        eq_(hexlify(to_wkb(line))[2:10], 'ba0b0000')
+        eq_(from_wkb(to_wkb(line)), line)
+        measured = {"type": "MultiPoint", "coordinates": [[1.0, 2.0, 3.0]], "measured": True}
+        eq_(hexlify(to_wkb(measured))[2:10], 'd4070000')
+        eq_(from_wkb(to_wkb(measured)), measured)
+        eq_(from_wkb(to_wkb(from_wkt('POINT M (1 2 3)'))),
+            {"type": "Point", "coordinates": [1.0, 2.0, 3.0], "measured": True})
+        eq_(from_wkb(to_wkb(from_wkt('POINTZ(1 2 3)'))), {"type": "Point", "coordinates": [1.0, 2.0, 3.0]})
+
+    def test_empty_point(self):
+        eq_(hexlify(to_wkb({"type": "Point", "coordinates": []})),
+            '0101000000000000000000f87f000000000000f87f')
+        eq_(from_wkb(to_wkb(from_wkt('POINT EMPTY'))), {"type": "Point", "coordinates": []})
+
+    @raises(Exception)
+    def test_too_many_ordinates(self):
+        to_wkb({"type": "Point", "coordinates": [1.0, 2.0, 3.0, 4.0, 5.0]})
+
+
+class TestWKT(TestCase):
+
+    def test_from_wkt_numbers(self):
+        eq_(from_wkt('POINT(1. 2.)'), {"type": "Point", "coordinates": [1.0, 2.0]})
+        eq_(from_wkt('POINT(.5 2)'), {"type": "Point", "coordinates": [0.5, 2.0]})
+        eq_(from_wkt('POINT(+1 -2E-1)'), {"type": "Point", "coordinates": [1.0, -0.2]})
+        eq_(from_wkt('LINESTRING(1e3 .25, -.5 +7.)'),
+            {"type": "LineString", "coordinates": [[1000.0, 0.25], [-0.5, 7.0]]})
+
+    @raises(Exception)
+    def test_from_wkt_invalid(self):
+        from_wkt('POINT(1 x)')
+
+    def test_from_wkt(self):
+        eq_(from_wkt('POINT(1 2)'), {"type": "Point", "coordinates": [1.0, 2.0]})
+        eq_(from_wkt('point z (1 2 3)'), {"type": "Point", "coordinates": [1.0, 2.0, 3.0]})
+        eq_(from_wkt('MULTIPOINT((1 2),(3 4))'), {"type": "MultiPoint", "coordinates": [[1.0, 2.0], [3.0, 4.0]]})
+        eq_(from_wkt('MULTIPOLYGON(((0 0,1 0,1 1,0 0)),((5 5,6 5,6 6,5 5)))'),
+            {"type": "MultiPolygon", "coordinates": [[[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]],
+                                                     [[[5.0, 5.0], [6.0, 5.0], [6.0, 6.0], [5.0, 5.0]]]]})
+        eq_(from_wkt('GEOMETRYCOLLECTION(POINT(1 2),LINESTRING EMPTY)'),
+            {"type": "GeometryCollection", "geometries": [{"type": "Point", "coordinates": [1.0, 2.0]},
+                                                          {"type": "LineString", "coordinates": []}]})
+
+    def test_to_wkt_precision(self):
+        geom = {"type": "LineString", "coordinates": [[1.23456789, 2.0], [-0.0000001, 120.5]]}
+        eq_(to_wkt(geom, 3), 'LINESTRING (1.235 2,0 120.5)')
+        eq_(to_wkt(geom, -1), 'LINESTRING (0 0,0 120)')
+        eq_(to_wkt({"type": "Point", "coordinates": [1.5, 2.0]}), 'POINT(1.500000 2.000000)')
+
+    def test_round_coordinates(self):
+        eq_(round_coordinates({"type": "MultiPoint", "coordinates": [[1.23456789, 2.0], [3.0, 4.987]]}, 2),
+            {"type": "MultiPoint", "coordinates": [[1.23, 2.0], [3.0, 4.99]]})
+        eq_(round_coordinates({"type": "GeometryCollection",
+                               "geometries": [{"type": "Point", "coordinates": [1.26, 2.0]}]}, 1),
+            {"type": "GeometryCollection", "geometries": [{"type": "Point", "coordinates": [1.3, 2.0]}]})
+
+    def test_roundtrip(self):
+        for wkt in ['LINESTRING(1 2,3 4)', 'MULTIPOLYGON(((0 0,1 0,1 1,0 0)),((5 5,6 5,6 6,5 5)))']:
+            eq_(from_wkt(to_wkt(from_wkt(wkt))), from_wkt(wkt))
+
+
+class TestBounds(TestCase):
+
+    multipolygon = {"type": "MultiPolygon", "coordinates": [
+                        [[[0.0, 0.0], [1.5, 0.0], [1.0, 1.0], [0.0, 0.0]]],
+                        [[[5.0, -5.0], [1.0, 0.0], [1.0, 1.0], [5.0, -5.0]]]]}
+
+    def test_wkb_bounds(self):
+        eq_(wkb_bounds(to_wkb(self.multipolygon)), (0.0, -5.0, 5.0, 1.0))
+        eq_(wkb_bounds(to_wkb({"type": "Point", "coordinates": [1.0, 2.0]})), (1.0, 2.0, 1.0, 2.0))
+        eq_(wkb_bounds(to_wkb({"type": "LineString", "coordinates": [[1.0, 2.0, 9.0], [-3.0, 4.0, 8.0]]})),
+            (-3.0, 2.0, 1.0, 4.0))
+        eq_(wkb_bounds(to_wkb({"type": "MultiPoint", "coordinates": []})), None)
+
+    def test_geometry_bounds(self):
+        eq_(geometry_bounds(self.multipolygon), (0.0, -5.0, 5.0, 1.0))
+        eq_(geometry_bounds({"type": "GeometryCollection", "geometries": [
+                {"type": "Point", "coordinates": [1.0, 2.0]},
+                {"type": "LineString", "coordinates": [[1.0, 2.0], [-3.0, 4.0]]}]}),
+            (-3.0, 2.0, 1.0, 4.0))
+
+    def test_persistent_bounds(self):
+        element = PersistentSpatialElement(WKBSpatialElement(buffer(to_wkb(self.multipolygon))))
+        eq_(element.bounds, (0.0, -5.0, 5.0, 1.0))
+        ok_(element.bounds is element.bounds)
+        element = PersistentSpatialElement(WKTSpatialElement('POLYGON((0 0,1 0,1 3,0 0))'))
+        eq_(element.bounds, (0.0, 0.0, 1.0, 3.0))
+
+    def test_as_geometry(self):
+        point = {"type": "Point", "coordinates": [1.0, 2.0]}
+        ok_(as_geometry(point) is point)
+        eq_(as_geometry(' POINT(1 2)'), point)
+        eq_(as_geometry(to_wkb(point)), point)
+        eq_(as_geometry(buffer(to_wkb(point))), point)
+        eq_(as_geometry(WKTSpatialElement('POINT(1 2)')), point)
+        eq_(as_geometry(PersistentSpatialElement(WKBSpatialElement(buffer(to_wkb(point))))), point)
+
+    @raises(NotImplementedError)
+    def test_as_geometry_unknown(self):
+        as_geometry(functions.buffer(WKTSpatialElement('POINT(1 2)'), 1))
+
+    def test_geometry_components(self):
+        eq_(list(geometry_components(self.multipolygon)),
+            [("Polygon", coords) for coords in self.multipolygon["coordinates"]])
+        eq_(list(geometry_components({"type": "GeometryCollection", "geometries": [
+                {"type": "Point", "coordinates": []},
+                {"type": "MultiPoint", "coordinates": [[1.0, 2.0]]}]})),
+            [("Point", [1.0, 2.0])])
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -0,0 +1,81 @@
+from unittest import TestCase
+from nose.tools import eq_, raises
+from nose.plugins.skip import SkipTest
+
+try:
+    import numpy
+except ImportError:
+    raise SkipTest("NumPy is not installed")
+
+from geoalchemy import WKTSpatialElement, WKBSpatialElement
+from geoalchemy.base import PersistentSpatialElement
+from geoalchemy.vectorized import gcontains, within, intersects, containing, bounds, \
+    bbox_intersects
+from geoalchemy.utils import to_wkb
+
+_square = {"type": "Polygon", "coordinates": [[[0, 0], [0, 4], [4, 4], [4, 0], [0, 0]],
+                                              [[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]]]}
+_points = numpy.array([[3, 3], [1.5, 1.5], [0, 2], [5, 5], [2, 1.5], [-1, 2], [3, 0.5]])
+
+
+class TestVectorized(TestCase):
+
+    def test_gcontains(self):
+        eq_(list(gcontains(_square, _points)), [True, False, False, False, False, False, True])
+        eq_(list(within(_points, _square)), [True, False, False, False, False, False, True])
+        eq_(list(intersects(_square, _points)), [True, False, True, False, True, False, True])
+
+    def test_geometries(self):
+        element = WKTSpatialElement('MULTIPOLYGON(((0 0,0 1,1 1,0 0)),((5 5,5 6,6 6,6 5,5 5)))')
+        points = [WKTSpatialElement('POINT(0.2 0.8)'), WKTSpatialElement('POINT(0.8 0.2)'),
+                  WKTSpatialElement('POINT(5.5 5.5)')]
+        eq_(list(gcontains(element, points)), [True, False, True])
+        eq_(list(gcontains(buffer(to_wkb(_square)), [(3, 3), (9, 9)])), [True, False])
+        eq_(list(gcontains(_square, [])), [])
+
+    @raises(Exception)
+    def test_not_a_polygon(self):
+        gcontains('LINESTRING(0 0,1 1)', _points)
+
+    def test_chunks(self):
+        from geoalchemy import vectorized
+        chunk = vectorized._CHUNK
+        vectorized._CHUNK = 3
+        try:
+            eq_(list(gcontains(_square, _points)), [True, False, False, False, False, False, True])
+        finally:
+            vectorized._CHUNK = chunk
+
+    def test_containing(self):
+        polygons = [_square, 'POLYGON((2 2,2 6,6 6,6 2,2 2))', 'POLYGON EMPTY',
+                    'POLYGON((1 1,1 2,2 2,2 1,1 1))']
+        eq_(list(containing(polygons, _points)), [0, 3, -1, 1, -1, -1, 0])
+
+        rnd = numpy.random.RandomState(1)
+        points = rnd.uniform(-1, 7, (1000, 2))
+        result = containing(polygons, points)
+        expected = numpy.where(gcontains(polygons[0], points), 0,
+                               numpy.where(gcontains(polygons[1], points), 1,
+                                           numpy.where(gcontains(polygons[3], points), 3, -1)))
+        eq_(list(result), list(expected))
+
+    def test_bbox_intersects(self):
+        boxes = bounds([_square, 'POINT(10 10)', None, 'LINESTRING(3 -1,5 -2)'])
+        eq_(boxes.shape, (4, 4))
+        eq_(list(boxes[1]), [10, 10, 10, 10])
+        # the cached bounds of loaded geometries are used
+        element = PersistentSpatialElement(WKBSpatialElement(buffer(to_wkb(_square))))
+        eq_(list(bounds([element])[0]), [0, 0, 4, 4])
+        eq_(element.__dict__['_bounds'], (0, 0, 4, 4))
+        eq_(list(bbox_intersects(boxes, (3, -1, 10, 3))), [True, False, False, True])
+        eq_(bbox_intersects(boxes, [(3, -1, 10, 3), (20, 20, 30, 30)]).tolist(),
+            [[True, False], [False, False], [False, False], [True, False]])
+
+
+if __name__ == '__main__':
+    import sys
+    import nose
+
+    sys.argv.append(__name__)
+    result = nose.run()
+    sys.exit(int(not result))
@@ -0,0 +1,273 @@
+u"""
+:mod:`geoalchemy.tilecache` -- Vector tile cache
+================================================
+
+:class:`TileCache` stores the vector tiles of a mapped geometry column
+(see :mod:`geoalchemy.mvt`) in an `MBTiles
+<https://github.com/mapbox/mbtiles-spec>`_ file, so that a tile is only
+created once::
+
+    >>> from geoalchemy.tilecache import TileCache
+    >>> cache = TileCache('lakes.mbtiles', Lake.lake_geom, properties=[Lake.lake_name])
+    >>> cache.listen(Session)
+    >>> data = cache.tile(session, 6, 16, 23)
+
+Each cache holds one layer, whose name defaults to the table name of the
+column; use one file per layer. Tiles are written gzip-compressed (as expected
+by MBTiles readers), :meth:`TileCache.tile` returns the uncompressed tile.
+
+Once registered with :meth:`TileCache.listen` (or, with SQLAlchemy 0.6,
+:meth:`TileCache.extension`), the cached tiles that intersect the bounding
+box of an inserted, updated or deleted row are removed when the session is
+committed. The bounding box is computed from the geometry value in Python;
+if the geometry is not known in Python (e.g. it was not loaded, or it was set
+to a database function), all tiles of the layer are removed.
+"""
+import gzip
+import json
+import sqlite3
+from contextlib import closing
+from cStringIO import StringIO
+from math import floor
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.orm import attributes
+from sqlalchemy.orm.interfaces import SessionExtension
+
+from geoalchemy import mvt
+from geoalchemy.base import WKTSpatialElement
+from geoalchemy.functions import functions
+from geoalchemy.utils import element_geometry, geometry_bounds, from_wkb, to_wkt
+
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS metadata (name text, value text)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)",
+    "CREATE TABLE IF NOT EXISTS tiles (zoom_level integer, tile_column integer, "
+    "tile_row integer, tile_data blob)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)"
+]
+
+
+def _gzip(data):
+    out = StringIO()
+    with closing(gzip.GzipFile(fileobj=out, mode='wb')) as f:
+        f.write(data)
+    return out.getvalue()
+
+def _gunzip(data):
+    with closing(gzip.GzipFile(fileobj=StringIO(data), mode='rb')) as f:
+        return f.read()
+
+def _tile_range(z, bounds, margin):
+    """Returns the range ``(minx, miny, maxx, maxy)`` of the tiles of zoom
+    level ``z`` that intersect the Web Mercator bounds, extended by
+    ``margin`` (a fraction of the tile size).
+    """
+    count = 2 ** z
+    size = 2 * mvt._ORIGIN / count
+    margin = margin * size
+
+    def clamp(value):
+        return max(0, min(count - 1, int(floor(value))))
+
+    return (clamp((bounds[0] - margin + mvt._ORIGIN) / size),
+            clamp((mvt._ORIGIN - bounds[3] - margin) / size),
+            clamp((bounds[2] + margin + mvt._ORIGIN) / size),
+            clamp((mvt._ORIGIN - bounds[1] + margin) / size))
+
+
+class TileCache(object):
+    """Caches the vector tiles of the mapped geometry attribute ``column``
+    (e.g. ``Lake.lake_geom``) in the MBTiles file ``path``, which is created
+    if it does not exist.
+
+    ``properties``, ``layer``, ``extent`` and ``buffer`` are passed to
+    :func:`geoalchemy.mvt.tile`. Only tiles of the zoom levels ``minzoom``
+    to ``maxzoom`` are cached, other tiles are created for each call.
+    """
+
+    def __init__(self, path, column, properties=(), layer=None, minzoom=0, maxzoom=14,
+                 extent=4096, buffer=64):
+        self.path = path
+        self.column = column
+        self.class_ = column.class_
+        self.key = column.key
+        self.properties = properties
+        geometry_column = column.property.columns[0]
+        self.srid = geometry_column.type.srid
+        self.layer = layer or geometry_column.table.name
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+        self.extent = extent
+        self.buffer = buffer
+        self._pending = WeakKeyDictionary()
+
+        with closing(self._connect()) as connection:
+            with connection:
+                for statement in _SCHEMA:
+                    connection.execute(statement)
+                for name, value in self._metadata():
+                    connection.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                                       (name, value))
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def _metadata(self):
+        fields = dict((_property_key(p), 'String') for p in self.properties)
+        return [('name', self.layer), ('format', 'pbf'),
+                ('minzoom', str(self.minzoom)), ('maxzoom', str(self.maxzoom)),
+                ('json', json.dumps({"vector_layers": [{"id": self.layer, "fields": fields,
+                                                        "minzoom": self.minzoom,
+                                                        "maxzoom": self.maxzoom}]}))]
+
+    def _cached(self, z):
+        return self.minzoom <= z <= self.maxzoom
+
+    def get(self, z, x, y):
+        """Returns the cached tile ``z/x/y``, or ``None`` if it is not cached."""
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND "
+                                     "tile_column = ? AND tile_row = ?",
+                                     (z, x, 2 ** z - 1 - y)).fetchone()
+        if row is None:
+            return None
+        return _gunzip(str(row[0]))
+
+    def put(self, z, x, y, data):
+        """Stores the tile ``z/x/y``."""
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, "
+                                   "tile_data) VALUES (?, ?, ?, ?)",
+                                   (z, x, 2 ** z - 1 - y, sqlite3.Binary(_gzip(data))))
+
+    def tile(self, session, z, x, y):
+        """Returns the tile ``z/x/y`` from the cache, the tile is created with
+        :func:`geoalchemy.mvt.tile` and stored if it is not cached yet.
+        """
+        if not self._cached(z):
+            return self._create(session, z, x, y)
+        data = self.get(z, x, y)
+        if data is None:
+            data = self._create(session, z, x, y)
+            self.put(z, x, y, data)
+        return data
+
+    def _create(self, session, z, x, y):
+        return mvt.tile(session, self.column, z, x, y, properties=self.properties,
+                        layer=self.layer, extent=self.extent, buffer=self.buffer)
+
+    def invalidate(self, bounds=None):
+        """Removes the cached tiles that intersect the Web Mercator bounds
+        ``(minx, miny, maxx, maxy)`` (taking the tile buffer into account),
+        all tiles if ``bounds`` is ``None``.
+        """
+        with closing(self._connect()) as connection:
+            with connection:
+                if bounds is None:
+                    connection.execute("DELETE FROM tiles")
+                    return
+                for z in xrange(self.minzoom, self.maxzoom + 1):
+                    minx, miny, maxx, maxy = _tile_range(z, bounds, float(self.buffer) / self.extent)
+                    connection.execute("DELETE FROM tiles WHERE zoom_level = ? AND "
+                                       "tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+                                       (z, minx, maxx, 2 ** z - 1 - maxy, 2 ** z - 1 - miny))
+
+    def _mercator_bounds(self, session, bounds):
+        """Converts bounds in the coordinate system of the column into Web
+        Mercator bounds.
+        """
+        if self.srid in mvt._MERCATOR_SRIDS:
+            return bounds
+        if self.srid == 4326:
+            return mvt._mercator(*bounds[:2]) + mvt._mercator(*bounds[2:])
+        minx, miny, maxx, maxy = bounds
+        envelope = WKTSpatialElement(to_wkt({"type": "Polygon", "coordinates": [
+            [[minx, miny], [minx, maxy], [maxx, maxy], [maxx, miny], [minx, miny]]]}), self.srid)
+        wkb = session.scalar(functions.wkb(functions.transform(envelope, 3857)))
+        if wkb is None:
+            return None
+        return geometry_bounds(from_wkb(wkb))
+
+    def _changed_bounds(self, session, instance):
+        """Returns the Web Mercator bounds of the old and new geometry of a
+        changed instance, ``[None]`` if a geometry is not known in Python.
+        """
+        history = attributes.get_history(instance, self.key,
+                                         passive=attributes.PASSIVE_NO_INITIALIZE)
+        values = list(history.added or ()) + list(history.unchanged or ())
+        if not values:
+            # the current geometry is not loaded
+            return [None]
+        values.extend(history.deleted or ())
+
+        result = []
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, basestring):
+                value = WKTSpatialElement(value)
+            geom = element_geometry(value)
+            if geom is None:
+                return [None]
+            bounds = geometry_bounds(geom)
+            if bounds is not None:
+                result.append(self._mercator_bounds(session, bounds))
+        return result
+
+    # session hooks
+
+    def after_flush(self, session, flush_context):
+        pending = self._pending.setdefault(session, [])
+        for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(instance, self.class_):
+                pending.extend(self._changed_bounds(session, instance))
+
+    def after_commit(self, session):
+        pending = self._pending.pop(session, [])
+        if None in pending:
+            self.invalidate()
+        else:
+            for bounds in pending:
+                self.invalidate(bounds)
+
+    def after_rollback(self, session):
+        self._pending.pop(session, None)
+
+    def listen(self, target):
+        """Registers the invalidation hooks on ``target``, a session, a
+        ``sessionmaker()`` or the ``Session`` class (SQLAlchemy 0.7).
+        """
+        from sqlalchemy import event
+        event.listen(target, 'after_flush', self.after_flush)
+        event.listen(target, 'after_commit', self.after_commit)
+        event.listen(target, 'after_rollback', self.after_rollback)
+
+    def extension(self):
+        """Returns a ``SessionExtension`` with the invalidation hooks, e.g.
+        for ``sessionmaker(extension=cache.extension())``.
+        """
+        return _TileCacheExtension(self)
+
+
+class _TileCacheExtension(SessionExtension):
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def after_flush(self, session, flush_context):
+        self.cache.after_flush(session, flush_context)
+
+    def after_commit(self, session):
+        self.cache.after_commit(session)
+
+    def after_rollback(self, session):
+        self.cache.after_rollback(session)
+
+
+def _property_key(column):
+    if hasattr(column, '__clause_element__'):
+        column = column.__clause_element__()
+    return column.key
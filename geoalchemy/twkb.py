@@ -0,0 +1,325 @@
+u"""
+:mod:`geoalchemy.twkb` -- Tiny Well-Known-Binary
+================================================
+
+This module encodes and decodes geometries in the `TWKB
+<https://github.com/TWKB/Specification>`_ format. TWKB stores coordinates
+as integers, quantised to a given number of decimal digits (``precision``) and
+delta-encoded as variable length integers. For typical line and polygon data
+TWKB values are several times smaller than WKB values.
+
+Geometries can be encoded in Python::
+
+    >>> from geoalchemy import twkb
+    >>> data = twkb.encode(road.road_geom, precision=5)
+    >>> twkb.decode(data, srid=4326)
+    <WKBSpatialElement at 0x...>
+
+or, with PostGIS 2.2 and newer, by the database::
+
+    >>> data = session.scalar(road.road_geom.twkb(5))
+
+Only geometries with X/Y or X/Y/Z coordinates are supported (values with
+M coordinates are rejected by the encoder and the decoder), the optional
+ID lists of multi-geometries are not written and skipped when read.
+"""
+
+from geoalchemy.utils import element_geometry, to_wkb
+
+_twkb_types = {"Point": 1, "LineString": 2, "Polygon": 3, "MultiPoint": 4,
+               "MultiLineString": 5, "MultiPolygon": 6, "GeometryCollection": 7}
+_twkb_type_names = dict((v, k) for (k, v) in _twkb_types.iteritems())
+
+# metadata flags
+_BBOX = 0x01
+_SIZE = 0x02
+_IDLIST = 0x04
+_EXTENDED_DIMENSIONS = 0x08
+_EMPTY = 0x10
+
+
+def _zigzag(value):
+    return (value << 1) if value >= 0 else ((-value) << 1) - 1
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+class _Encoder(object):
+    """Writes the coordinates of one (non-collection) geometry, keeping the
+    last coordinate for the delta encoding and the quantised bounds.
+    """
+
+    def __init__(self, factors):
+        self.factors = factors
+        self.last = [0] * len(factors)
+        self.mins = None
+        self.maxs = None
+        self.out = bytearray()
+
+    def write_points(self, points, with_count=True):
+        out = self.out
+        factors = self.factors
+        last = self.last
+        dimensions = len(factors)
+        if with_count:
+            _write_varint(out, len(points))
+        if not points:
+            return
+        if self.mins is None:
+            self.mins = [int(round(points[0][d] * factors[d])) for d in xrange(dimensions)]
+            self.maxs = list(self.mins)
+        mins = self.mins
+        maxs = self.maxs
+        for point in points:
+            for d in xrange(dimensions):
+                value = int(round(point[d] * factors[d]))
+                _write_varint(out, _zigzag(value - last[d]))
+                last[d] = value
+                if value < mins[d]:
+                    mins[d] = value
+                elif value > maxs[d]:
+                    maxs[d] = value
+
+    def write(self, geom_type, coords):
+        if geom_type == "Point":
+            self.write_points([coords], with_count=False)
+        elif geom_type in ("LineString", "MultiPoint"):
+            self.write_points(coords)
+        elif geom_type in ("Polygon", "MultiLineString"):
+            _write_varint(self.out, len(coords))
+            for ring in coords:
+                self.write_points(ring)
+        elif geom_type == "MultiPolygon":
+            _write_varint(self.out, len(coords))
+            for polygon in coords:
+                _write_varint(self.out, len(polygon))
+                for ring in polygon:
+                    self.write_points(ring)
+
+
+def _dimensions(geom):
+    if geom["type"] == "GeometryCollection":
+        for part in geom["geometries"]:
+            dimensions = _dimensions(part)
+            if dimensions:
+                return dimensions
+        return 0
+    coords = geom["coordinates"]
+    depth = {"Point": 0, "LineString": 1, "MultiPoint": 1, "Polygon": 2,
+             "MultiLineString": 2, "MultiPolygon": 3}[geom["type"]]
+    for i in xrange(depth):
+        if not coords:
+            return 0
+        coords = coords[0]
+    return len(coords)
+
+def _encode(geom, precision, z_precision, bbox, size):
+    geom_type = geom["type"]
+    if geom_type not in _twkb_types:
+        raise Exception("Couldn't create TWKB from geometry of type %s" % geom_type)
+
+    dimensions = _dimensions(geom)
+    if dimensions > 3 or geom.get("measured"):
+        raise Exception("Couldn't create TWKB from a geometry with M values, only X, Y and Z "
+                        "are supported")
+    factors = [10.0 ** precision] * 2 + [10.0 ** z_precision] * (dimensions - 2)
+    metadata = 0
+    body = bytearray()
+
+    if dimensions == 0:
+        metadata |= _EMPTY
+    elif geom_type == "GeometryCollection":
+        parts = geom["geometries"]
+        _write_varint(body, len(parts))
+        for part in parts:
+            body += _encode(part, precision, z_precision, bbox, size)
+        bbox = False
+    else:
+        encoder = _Encoder(factors)
+        encoder.write(geom_type, geom["coordinates"])
+        body = encoder.out
+        if bbox and encoder.mins is not None:
+            bounds = bytearray()
+            for d in xrange(dimensions):
+                _write_varint(bounds, _zigzag(encoder.mins[d]))
+                _write_varint(bounds, _zigzag(encoder.maxs[d] - encoder.mins[d]))
+            body = bounds + body
+            metadata |= _BBOX
+
+    out = bytearray()
+    out.append(_twkb_types[geom_type] | (_zigzag(precision) << 4))
+    if dimensions > 2:
+        metadata |= _EXTENDED_DIMENSIONS
+    if size:
+        metadata |= _SIZE
+    out.append(metadata)
+    if dimensions > 2:
+        out.append(0x01 | ((z_precision & 0x07) << 2))
+    if size:
+        _write_varint(out, len(body))
+    out += body
+    return out
+
+def to_twkb(geom, precision=0, z_precision=0, bbox=False, size=False):
+    """Converts a GeoJSON-like geometry to TWKB.
+
+    ``precision`` is the number of decimal digits kept for X and Y
+    (negative values round to tens, hundreds, ..), ``z_precision`` the
+    number of digits for Z. If ``bbox`` is set, the bounding box is written
+    into the header, ``size`` adds the size of the geometry body.
+
+    TWKB stores ``precision`` from -8 to 7 and ``z_precision`` from 0 to 7,
+    geometries with M values are not supported.
+    """
+    if not -8 <= precision <= 7:
+        raise Exception("The TWKB precision has to be between -8 and 7, not %s" % precision)
+    if not 0 <= z_precision <= 7:
+        raise Exception("The TWKB Z precision has to be between 0 and 7, not %s" % z_precision)
+    return str(_encode(geom, precision, z_precision, bbox, size))
+
+
+class _Decoder(object):
+
+    def __init__(self, data, pos, factors):
+        self.data = data
+        self.pos = pos
+        self.factors = factors
+        self.last = [0] * len(factors)
+
+    def read_count(self):
+        count, self.pos = _read_varint(self.data, self.pos)
+        return count
+
+    def read_points(self, count):
+        data = self.data
+        pos = self.pos
+        factors = self.factors
+        last = self.last
+        dimensions = len(factors)
+        points = []
+        for i in xrange(count):
+            point = []
+            for d in xrange(dimensions):
+                # inlined _read_varint() followed by the zigzag decoding
+                value = 0
+                shift = 0
+                while True:
+                    byte = data[pos]
+                    pos += 1
+                    value |= (byte & 0x7f) << shift
+                    if not byte & 0x80:
+                        break
+                    shift += 7
+                last[d] += (value >> 1) ^ -(value & 1)
+                point.append(last[d] / factors[d])
+            points.append(point)
+        self.pos = pos
+        return points
+
+    def read(self, geom_type):
+        if geom_type == 1:
+            return self.read_points(1)[0]
+        elif geom_type == 2:
+            return self.read_points(self.read_count())
+        elif geom_type == 3:
+            return [self.read_points(self.read_count()) for i in xrange(self.read_count())]
+
+def _decode(data, pos):
+    geom_type = data[pos] & 0x0f
+    precision = data[pos] >> 4
+    precision = (precision >> 1) ^ -(precision & 1)
+    metadata = data[pos + 1]
+    pos += 2
+
+    if geom_type not in _twkb_type_names:
+        raise Exception("Unsupported TWKB geometry type %s" % geom_type)
+
+    dimensions = 2
+    z_precision = 0
+    if metadata & _EXTENDED_DIMENSIONS:
+        extended = data[pos]
+        pos += 1
+        if extended & 0x01:
+            dimensions += 1
+            z_precision = (extended >> 2) & 0x07
+        if extended & 0x02:
+            # a Z value and an M value can not be told apart in the GeoJSON-like
+            # coordinates, which would return the M value as Z value
+            raise Exception("Couldn't read TWKB with M values, only X, Y and Z "
+                            "are supported")
+    if metadata & _SIZE:
+        size, pos = _read_varint(data, pos)
+    if metadata & _BBOX:
+        for i in xrange(2 * dimensions):
+            value, pos = _read_varint(data, pos)
+
+    name = _twkb_type_names[geom_type]
+    if metadata & _EMPTY:
+        if geom_type == 7:
+            return {"type": name, "geometries": []}, pos
+        return {"type": name, "coordinates": []}, pos
+
+    if geom_type == 7:
+        count, pos = _read_varint(data, pos)
+        if metadata & _IDLIST:
+            for i in xrange(count):
+                value, pos = _read_varint(data, pos)
+        parts = []
+        for i in xrange(count):
+            part, pos = _decode(data, pos)
+            parts.append(part)
+        return {"type": name, "geometries": parts}, pos
+
+    factors = [10.0 ** precision] * 2 + [10.0 ** z_precision] * (dimensions - 2)
+    decoder = _Decoder(data, pos, factors)
+    if geom_type >= 4:
+        count = decoder.read_count()
+        if metadata & _IDLIST:
+            for i in xrange(count):
+                decoder.read_count()
+        coords = _read_parts(decoder, geom_type, count)
+    else:
+        coords = decoder.read(geom_type)
+    return {"type": name, "coordinates": coords}, decoder.pos
+
+def _read_parts(decoder, geom_type, count):
+    if geom_type == 4:
+        return decoder.read_points(count)
+    elif geom_type == 5:
+        return [decoder.read_points(decoder.read_count()) for i in xrange(count)]
+    return [[decoder.read_points(decoder.read_count()) for j in xrange(decoder.read_count())]
+            for i in xrange(count)]
+
+def from_twkb(twkb):
+    """Converts a TWKB value to a GeoJSON-like geometry."""
+    return _decode(bytearray(twkb), 0)[0]
+
+
+def encode(element, precision=0, z_precision=0, bbox=False, size=False):
+    """Encodes a spatial element (e.g. a geometry loaded from the database, or
+    a :class:`~geoalchemy.base.WKTSpatialElement`) as TWKB, see :func:`to_twkb`.
+    """
+    geom = element_geometry(element)
+    if geom is None:
+        raise Exception("The geometry of %r is not available in Python" % (element, ))
+    return to_twkb(geom, precision, z_precision, bbox, size)
+
+def decode(twkb, srid=None):
+    """Decodes a TWKB value into a :class:`~geoalchemy.base.WKBSpatialElement`."""
+    from geoalchemy.base import WKBSpatialElement
+    return WKBSpatialElement(buffer(to_wkb(from_twkb(twkb))), srid)
@@ -1,54 +1,116 @@
 # These functions are shamelessly stolen from FeatureServer
 import re
+import struct
+import binascii
 
-def from_wkt (geom):
-    """wkt helper: converts from WKT to a GeoJSON-like geometry."""
-    wkt_linestring_match = re.compile(r'\(([^()]+)\)')
-    re_space             = re.compile(r"\s+")
+_wkt_types = {"POINT": "Point", "LINESTRING": "LineString", "POLYGON": "Polygon",
+              "MULTIPOINT": "MultiPoint", "MULTILINESTRING": "MultiLineString",
+              "MULTIPOLYGON": "MultiPolygon", "GEOMETRYCOLLECTION": "GeometryCollection"}
+_wkt_header = re.compile(r'\s*([A-Za-z]+)\s*(ZM|Z|M)?\s*(EMPTY)?', re.I)
+_wkt_token = re.compile(r'[(),]|[^\s(),]+')
 
-    coords = []
-    for line in wkt_linestring_match.findall(geom):
-        rings = [[]]
-        for pair in line.split(","):
+def _wkt_coordinates(body):
+    """Turns the coordinate part of a WKT geometry into nested lists:
+    "((0 0,1 0),(..))" -> [[[0.0, 0.0], [1.0, 0.0]], [..]]. The ordinates are
+    converted with ``float()``, so that e.g. ``1.``, ``.5`` and ``+1`` are read.
+    """
+    stack = [[]]
+    coordinate = []
+    for token in _wkt_token.findall(body):
+        if token == "(":
+            stack.append([])
+        elif token in (")", ","):
+            if coordinate:
+                stack[-1].append(coordinate)
+                coordinate = []
+            if token == ")":
+                if len(stack) == 1:
+                    raise Exception("Unbalanced parentheses in WKT %s" % body)
+                nested = stack.pop()
+                stack[-1].append(nested)
+        else:
+            try:
+                coordinate.append(float(token))
+            except ValueError:
+                raise Exception("Invalid coordinate '%s' in WKT %s" % (token, body))
+    if len(stack) != 1 or coordinate or len(stack[0]) != 1:
+        raise Exception("Invalid WKT coordinates %s" % body)
+    return stack[0][0]
 
-            if not pair.strip():
-                rings.append([])
-                continue
-            rings[-1].append(map(float, re.split(re_space, pair.strip())))
+def _wkt_parts(body):
+    """Splits the body of a GEOMETRYCOLLECTION at its top-level commas."""
+    parts = []
+    depth = 0
+    start = 1
+    for i, char in enumerate(body):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 1:
+            parts.append(body[start:i])
+            start = i + 1
+    parts.append(body[start:body.rindex(")")])
+    return parts
 
-        coords.append(rings[0])
+def from_wkt (geom):
+    """wkt helper: converts from WKT to a GeoJSON-like geometry. Geometries
+    with M values (e.g. ``POINT M (1 2 3)``) have the key ``"measured"``.
+    """
+    match = _wkt_header.match(geom)
+    if match is None:
+        raise Exception("Unsupported geometry type %s" % geom[:geom.find("(")].strip())
+    name, tag = match.group(1).upper(), (match.group(2) or '').upper()
+    for suffix in ('ZM', 'Z', 'M'):
+        # e.g. POINTZ(1 2 3)
+        if name not in _wkt_types and not tag and name.endswith(suffix):
+            name, tag = name[:-len(suffix)], suffix
+    if name not in _wkt_types:
+        raise Exception("Unsupported geometry type %s" % geom[:geom.find("(")].strip())
+    geomtype = _wkt_types[name]
+    body = geom[match.end():].strip()
 
-    if geom.startswith("MULTIPOINT"):
-        geomtype = "MultiPoint"
-        coords = coords[0]
-    elif geom.startswith("POINT"):
-        geomtype = "Point"
-        coords = coords[0][0]
-
-    elif geom.startswith("MULTILINESTRING"):
-        geomtype = "MultiLineString"
-    elif geom.startswith("LINESTRING"):
-        geomtype = "LineString"
-        coords = coords[0]
+    if geomtype == "GeometryCollection":
+        parts = [] if match.group(3) else [from_wkt(part) for part in _wkt_parts(body)]
+        return {"type": geomtype, "geometries": parts}
 
-    elif geom.startswith("MULTIPOLYGON"):
-        geomtype = "MultiPolygon"
-    elif geom.startswith("POLYGON"):
-        geomtype = "Polygon"
+    if match.group(3):
+        coords = []
     else:
-        geomtype = geom[:geom.index("(")]
-        raise Exception("Unsupported geometry type %s" % geomtype)
+        coords = _wkt_coordinates(body)
+        if geomtype == "Point":
+            coords = coords[0]
+        elif geomtype == "MultiPoint" and coords and isinstance(coords[0][0], list):
+            # MULTIPOINT((1 2),(3 4))
+            coords = [point[0] for point in coords]
 
+    if tag == 'M':
+        return {"type": geomtype, "coordinates": coords, "measured": True}
     return {"type": geomtype, "coordinates": coords}
 
 
 
-def to_wkt (geom):
-    """Converts a GeoJSON-like geometry to WKT.""" 
+def _format_ordinate(value, precision):
+    """Formats a number with at most `precision` decimal digits, without
+    trailing zeros."""
+    text = "%.*f" % (max(precision, 0), round(value, precision))
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+def to_wkt (geom, precision=None):
+    """Converts a GeoJSON-like geometry to WKT.
+    
+    By default the coordinates are written with ``%f``. If `precision` is 
+    given, the coordinates are rounded to `precision` decimal digits and 
+    written in the shortest form, e.g. ``POINT(1.5 2)``.
+    """ 
 
     def coords_to_wkt (coords):
-        format_str = " ".join(("%f",) * len(coords[0]))
-        return ",".join([format_str % tuple(c) for c in coords])
+        if precision is None:
+            format_str = " ".join(("%f",) * len(coords[0]))
+            return ",".join([format_str % tuple(c) for c in coords])
+        return ",".join([" ".join([_format_ordinate(v, precision) for v in c]) for c in coords])
 
     coords = geom["coordinates"]
     if geom["type"] == "Point":
@@ -71,10 +133,349 @@ def to_wkt (geom):
     elif geom["type"] == "MultiPolygon":
         poly_str = []
         for coord_list in coords:
-            poly_str.append( "((" + ",".join( coords_to_wkt((ring,))  for ring in coord_list) + "))" )
+            poly_str.append( "((" + "),(".join( coords_to_wkt(ring)  for ring in coord_list) + "))" )
         return "MultiPolygon(%s)" % ", ".join(poly_str)
 
 
     else:
         raise Exception("Couldn't create WKT from geometry of type %s (%s). Only Point, Line, Polygon are supported." % (geom['type'], geom))
 
+
+def round_coordinates(geom, precision):
+    """Returns a copy of a GeoJSON-like geometry with all coordinates rounded
+    to `precision` decimal digits (i.e. snapped to a grid of size
+    ``10 ** -precision``)."""
+
+    def round_coords(coords):
+        if coords and isinstance(coords[0], (list, tuple)):
+            return [round_coords(c) for c in coords]
+        return [round(v, precision) for v in coords]
+
+    rounded = dict(geom)
+    if geom["type"] == "GeometryCollection":
+        rounded["geometries"] = [round_coordinates(g, precision) for g in geom["geometries"]]
+    else:
+        rounded["coordinates"] = round_coords(geom["coordinates"])
+    return rounded
+
+
+# EWKB/EWKT helpers
+
+EWKB_SRID_FLAG = 0x20000000
+
+def unhexlify_ewkb(ewkb):
+    """Returns the binary form of a (possibly hex-encoded) EWKB value. PostGIS
+    returns hex-encoded EWKB when a geometry column is selected without conversion.
+    """
+    if ewkb[:1] not in ('\x00', '\x01'):
+        return buffer(binascii.unhexlify(ewkb))
+    return ewkb
+
+def ewkb_srid(ewkb):
+    """Returns the SRID embedded in an EWKB value, or ``None`` if the value is
+    plain WKB. Only the header of the value is read.
+    """
+    header = unhexlify_ewkb(ewkb[:18])
+    if len(header) < 9:
+        return None
+
+    byte_order = '<' if header[:1] == '\x01' else '>'
+    (geom_type,) = struct.unpack_from(byte_order + 'I', header, 1)
+    if not geom_type & EWKB_SRID_FLAG:
+        return None
+    return struct.unpack_from(byte_order + 'I', header, 5)[0]
+
+def split_ewkb(ewkb):
+    """Splits an EWKB value into a (wkb, srid) tuple.
+
+    The value can either be binary or hex-encoded. The returned WKB is a
+    buffer, ``srid`` is ``None`` if the value does not embed a SRID.
+    """
+    ewkb = unhexlify_ewkb(ewkb)
+
+    byte_order = '<' if ewkb[:1] == '\x01' else '>'
+    (geom_type,) = struct.unpack_from(byte_order + 'I', ewkb, 1)
+    if not geom_type & EWKB_SRID_FLAG:
+        return buffer(ewkb), None
+
+    (srid,) = struct.unpack_from(byte_order + 'I', ewkb, 5)
+    wkb = ewkb[:1] + struct.pack(byte_order + 'I', geom_type & ~EWKB_SRID_FLAG) + ewkb[9:]
+    return buffer(wkb), srid
+
+def make_ewkb(wkb, srid):
+    """Embeds ``srid`` into the (plain) WKB value ``wkb`` and returns the EWKB
+    as buffer.
+    """
+    byte_order = '<' if wkb[:1] == '\x01' else '>'
+    (geom_type,) = struct.unpack_from(byte_order + 'I', wkb, 1)
+    return buffer(wkb[:1] + struct.pack(byte_order + 'II', geom_type | EWKB_SRID_FLAG, srid) + wkb[5:])
+
+def split_ewkt(ewkt):
+    """Splits an EWKT value like ``SRID=4326;POINT(1 2)`` into a (wkt, srid)
+    tuple. ``srid`` is ``None`` if the value is plain WKT.
+    """
+    if ewkt[:5].upper() != 'SRID=':
+        return ewkt, None
+    srid, wkt = ewkt[5:].split(';', 1)
+    return wkt.lstrip(), int(srid)
+
+def make_ewkt(wkt, srid):
+    """Prefixes the WKT value ``wkt`` with ``srid``."""
+    return 'SRID=%d;%s' % (srid, wkt)
+
+
+# WKB helpers
+
+_wkb_types = {1: "Point", 2: "LineString", 3: "Polygon", 4: "MultiPoint",
+              5: "MultiLineString", 6: "MultiPolygon", 7: "GeometryCollection"}
+_wkb_type_codes = dict((v, k) for (k, v) in _wkb_types.iteritems())
+
+def _read_wkb_header(wkb, offset):
+    """Reads the byte order and type of a WKB geometry starting at ``offset``,
+    returns (byte_order, geom_type, dimensions, offset of the geometry body).
+    ISO and EWKB (PostGIS) dimension encodings are understood, an embedded SRID
+    is skipped.
+    """
+    byte_order = '<' if wkb[offset:offset + 1] == '\x01' else '>'
+    (geom_type,) = struct.unpack_from(byte_order + 'I', wkb, offset + 1)
+    offset += 5
+    dimensions = 2
+    if geom_type & 0x80000000:
+        dimensions += 1
+    if geom_type & 0x40000000:
+        dimensions += 1
+    if geom_type & EWKB_SRID_FLAG:
+        offset += 4
+    geom_type &= 0x0fffffff
+    dimensions += (0, 1, 1, 2)[geom_type // 1000]
+    return byte_order, geom_type % 1000, dimensions, offset
+
+def _read_wkb_points(wkb, offset, byte_order, dimensions):
+    (count,) = struct.unpack_from(byte_order + 'I', wkb, offset)
+    offset += 4
+    values = struct.unpack_from('%s%dd' % (byte_order, count * dimensions), wkb, offset)
+    points = [list(values[i:i + dimensions]) for i in xrange(0, count * dimensions, dimensions)]
+    return points, offset + count * dimensions * 8
+
+def _wkb_measured(wkb, offset, byte_order, dimensions):
+    """Returns True if the geometry at ``offset`` has X, Y and M ordinates."""
+    (code,) = struct.unpack_from(byte_order + 'I', wkb, offset + 1)
+    return dimensions == 3 and bool(code & 0x40000000 or (code & 0x0fffffff) // 1000 == 2)
+
+def _read_wkb(wkb, offset):
+    geom, end = _read_wkb_geometry(wkb, offset)
+    byte_order = '<' if wkb[offset:offset + 1] == '\x01' else '>'
+    if "coordinates" in geom and _wkb_measured(wkb, offset, byte_order,
+                                               _read_wkb_header(wkb, offset)[2]):
+        geom["measured"] = True
+    return geom, end
+
+def _read_wkb_geometry(wkb, offset):
+    byte_order, geom_type, dimensions, offset = _read_wkb_header(wkb, offset)
+    if geom_type == 1:
+        values = struct.unpack_from('%s%dd' % (byte_order, dimensions), wkb, offset)
+        if all(value != value for value in values):
+            # POINT EMPTY is written with NaN ordinates
+            values = []
+        return {"type": "Point", "coordinates": list(values)}, offset + dimensions * 8
+    elif geom_type == 2:
+        coords, offset = _read_wkb_points(wkb, offset, byte_order, dimensions)
+        return {"type": "LineString", "coordinates": coords}, offset
+    elif geom_type == 3:
+        (count,) = struct.unpack_from(byte_order + 'I', wkb, offset)
+        offset += 4
+        rings = []
+        for i in xrange(count):
+            ring, offset = _read_wkb_points(wkb, offset, byte_order, dimensions)
+            rings.append(ring)
+        return {"type": "Polygon", "coordinates": rings}, offset
+    elif geom_type in _wkb_types:
+        (count,) = struct.unpack_from(byte_order + 'I', wkb, offset)
+        offset += 4
+        parts = []
+        for i in xrange(count):
+            part, offset = _read_wkb(wkb, offset)
+            parts.append(part)
+        if geom_type == 7:
+            return {"type": "GeometryCollection", "geometries": parts}, offset
+        return {"type": _wkb_types[geom_type],
+                "coordinates": [part["coordinates"] for part in parts]}, offset
+    raise Exception("Unsupported WKB geometry type %s" % geom_type)
+
+def from_wkb(wkb):
+    """Converts a WKB (or EWKB) value to a GeoJSON-like geometry."""
+    return _read_wkb(unhexlify_ewkb(wkb), 0)[0]
+
+def _write_wkb_points(points):
+    values = [value for point in points for value in point]
+    return struct.pack('<I%dd' % len(values), len(points), *values)
+
+def to_wkb(geom):
+    """Converts a GeoJSON-like geometry to (little endian) WKB. Geometries
+    with three ordinates are written as ISO WKB with Z values, or with M
+    values if the geometry has the key ``"measured"`` (see :func:`from_wkt`),
+    geometries with four ordinates with Z and M values. An empty point is
+    written with NaN ordinates.
+    """
+    geom_type = geom["type"]
+    if geom_type not in _wkb_type_codes:
+        raise Exception("Couldn't create WKB from geometry of type %s" % geom_type)
+
+    if geom_type == "GeometryCollection":
+        parts = geom["geometries"]
+        return struct.pack('<BII', 1, 7, len(parts)) + \
+            "".join(to_wkb(part) for part in parts)
+
+    coords = geom["coordinates"]
+    measured = geom.get("measured", False)
+    dimensions = len(_first_coordinate(geom_type, coords) or (0, 0))
+    if dimensions not in (2, 3, 4):
+        raise Exception("Couldn't create WKB from geometry with %d ordinates" % dimensions)
+    if dimensions == 3:
+        code = _wkb_type_codes[geom_type] + (2000 if measured else 1000)
+    else:
+        code = _wkb_type_codes[geom_type] + (3000 if dimensions == 4 else 0)
+    header = struct.pack('<BI', 1, code)
+    if geom_type == "Point":
+        if not coords:
+            # the quiet NaN written by PostGIS and GEOS
+            return header + struct.pack('<2Q', 0x7ff8000000000000, 0x7ff8000000000000)
+        return header + struct.pack('<%dd' % len(coords), *coords)
+    elif geom_type == "LineString":
+        return header + _write_wkb_points(coords)
+    elif geom_type == "Polygon":
+        return header + struct.pack('<I', len(coords)) + \
+            "".join(_write_wkb_points(ring) for ring in coords)
+    part_type = geom_type[5:]
+    return header + struct.pack('<I', len(coords)) + \
+        "".join(to_wkb(dict({"type": part_type, "coordinates": part},
+                            **({"measured": True} if measured else {}))) for part in coords)
+
+def _first_coordinate(geom_type, coords):
+    """Returns the first coordinate of a geometry, used to find out the
+    number of dimensions.
+    """
+    depth = {"Point": 0, "LineString": 1, "MultiPoint": 1, "Polygon": 2,
+             "MultiLineString": 2, "MultiPolygon": 3}[geom_type]
+    for i in xrange(depth):
+        if not coords:
+            return None
+        coords = coords[0]
+    return coords
+
+def _wkb_bounds(wkb, offset, bounds):
+    byte_order, geom_type, dimensions, offset = _read_wkb_header(wkb, offset)
+    if geom_type == 1:
+        x, y = struct.unpack_from(byte_order + 'dd', wkb, offset)
+        if x == x:
+            # POINT EMPTY is written as NaN coordinates
+            bounds.append((x, y, x, y))
+        return offset + dimensions * 8
+
+    if geom_type == 2:
+        rings = 1
+    else:
+        (count,) = struct.unpack_from(byte_order + 'I', wkb, offset)
+        offset += 4
+        if geom_type == 3:
+            rings = count
+        else:
+            for i in xrange(count):
+                offset = _wkb_bounds(wkb, offset, bounds)
+            return offset
+
+    for i in xrange(rings):
+        (points,) = struct.unpack_from(byte_order + 'I', wkb, offset)
+        offset += 4
+        if points:
+            values = struct.unpack_from('%s%dd' % (byte_order, points * dimensions), wkb, offset)
+            xs = values[0::dimensions]
+            ys = values[1::dimensions]
+            bounds.append((min(xs), min(ys), max(xs), max(ys)))
+            offset += points * dimensions * 8
+    return offset
+
+def wkb_bounds(wkb):
+    """Returns the bounding box (minx, miny, maxx, maxy) of a WKB (or EWKB)
+    value, or ``None`` for empty geometries. The value is scanned once, without
+    building coordinate lists.
+    """
+    bounds = []
+    _wkb_bounds(unhexlify_ewkb(wkb), 0, bounds)
+    return _merge_bounds(bounds)
+
+def geometry_bounds(geom):
+    """Returns the bounding box (minx, miny, maxx, maxy) of a GeoJSON-like
+    geometry, or ``None`` for empty geometries.
+    """
+    if geom["type"] == "GeometryCollection":
+        return _merge_bounds([b for b in (geometry_bounds(part) for part in geom["geometries"])
+                              if b is not None])
+    coords = geom["coordinates"]
+    if geom["type"] == "Point":
+        return (coords[0], coords[1], coords[0], coords[1]) if coords else None
+    depth = {"LineString": 0, "MultiPoint": 0, "Polygon": 1,
+             "MultiLineString": 1, "MultiPolygon": 2}[geom["type"]]
+    for i in xrange(depth):
+        coords = [point for part in coords for point in part]
+    if not coords:
+        return None
+    xs = [point[0] for point in coords]
+    ys = [point[1] for point in coords]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def element_geometry(element):
+    """Returns the GeoJSON-like geometry of a spatial element whose WKB or WKT
+    value is known in Python (e.g. a WKTSpatialElement or a geometry loaded
+    from the database), or ``None`` if the geometry is only known to the
+    database.
+    """
+    wkb = getattr(element, 'geom_wkb', None)
+    if wkb is not None:
+        return from_wkb(wkb)
+    wkt = getattr(element, 'geom_wkt', None)
+    if wkt is not None:
+        return from_wkt(wkt)
+    return None
+
+def as_geometry(value):
+    """Returns the GeoJSON-like geometry of a value, which may be a GeoJSON-like
+    dictionary, a WKT or WKB value, or a spatial element whose WKB or WKT value
+    is known in Python. Raises ``NotImplementedError`` if the geometry is only
+    known to the database.
+    """
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, buffer):
+        return from_wkb(value)
+    if isinstance(value, basestring):
+        if value.lstrip()[:1].isalpha():
+            return from_wkt(value)
+        return from_wkb(value)
+    geom = element_geometry(value)
+    if geom is None:
+        raise NotImplementedError("The geometry of %r is not known in Python" % (value, ))
+    return geom
+
+def geometry_components(geom):
+    """Yields the single geometries (Point, LineString, Polygon) of a GeoJSON-like
+    geometry as (type, coordinates) tuples, leaving out empty geometries.
+    """
+    geom_type = geom["type"]
+    if geom_type == "GeometryCollection":
+        for part in geom["geometries"]:
+            for component in geometry_components(part):
+                yield component
+    elif geom_type.startswith("Multi"):
+        for coords in geom["coordinates"]:
+            yield geom_type[5:], coords
+    elif geom["coordinates"]:
+        yield geom_type, geom["coordinates"]
+
+def _merge_bounds(bounds):
+    if not bounds:
+        return None
+    if len(bounds) == 1:
+        return bounds[0]
+    return (min(b[0] for b in bounds), min(b[1] for b in bounds),
+            max(b[2] for b in bounds), max(b[3] for b in bounds))
@@ -0,0 +1,184 @@
+u"""
+:mod:`geoalchemy.vectorized` -- Vectorized spatial predicates
+=============================================================
+
+This module evaluates spatial predicates between polygons and large arrays
+of points, or between bounding boxes, in Python with `NumPy
+<http://www.numpy.org/>`_ (which has to be installed). It is the local
+counterpart of ``functions.gcontains``, ``functions.within`` and
+``functions.intersects`` for geometries that are already loaded, e.g. to
+geocode many points against a layer without a query per point::
+
+    >>> from geoalchemy import vectorized
+    >>> points = numpy.array([[-88.7, 43.1], [-88.1, 42.6]])
+    >>> vectorized.gcontains(lake.lake_geom, points)
+    array([ True, False], dtype=bool)
+    >>> lakes = session.query(Lake).all()
+    >>> vectorized.containing([l.lake_geom for l in lakes], points)
+    array([ 3, -1])
+
+Geometries can be given as geometry elements (e.g. loaded attributes), WKT,
+WKB or GeoJSON-like dictionaries, points also as an array of shape
+``(n, 2)`` (further columns are ignored). Polygons are tested with the
+even-odd rule, so they are expected to be valid (holes inside the exterior
+ring, non-overlapping parts of multi-polygons). Points on the boundary of a
+polygon are not contained in it (as in the databases), but intersect it.
+All computations are planar.
+"""
+import numpy
+
+from geoalchemy.base import PersistentSpatialElement
+from geoalchemy.utils import as_geometry, geometry_bounds, geometry_components
+
+# number of (edge, point) pairs that are tested at once
+_CHUNK = 1 << 20
+
+
+def _points(points):
+    """Returns the points as an array of shape ``(n, 2)``."""
+    if not isinstance(points, numpy.ndarray):
+        points = list(points)
+        if points and not isinstance(points[0], (tuple, list)):
+            points = [as_geometry(p)["coordinates"] for p in points]
+    points = numpy.asarray(points, dtype=float)
+    if points.size == 0:
+        return points.reshape((0, 2))
+    return points[:, :2]
+
+def _edges(polygon):
+    """Returns the edges of all rings of a (multi-)polygon as four column
+    vectors ``x1, y1, x2, y2``, and its bounding box.
+    """
+    geom = as_geometry(polygon)
+    rings = []
+    for (geom_type, coords) in geometry_components(geom):
+        if geom_type != "Polygon":
+            raise Exception("Expected a polygon, got a %s" % geom["type"])
+        for ring in coords:
+            ring = numpy.asarray(ring, dtype=float)[:, :2]
+            if (ring[0] != ring[-1]).any():
+                ring = numpy.vstack((ring, ring[:1]))
+            rings.append(numpy.hstack((ring[:-1], ring[1:])))
+    if not rings:
+        return None, None
+    edges = numpy.vstack(rings)
+    return [edges[:, i:i + 1] for i in xrange(4)], geometry_bounds(geom)
+
+def _locate(edges, x, y):
+    """Returns two boolean arrays: whether the points are inside the rings
+    (even-odd rule) and whether they are on an edge.
+    """
+    x1, y1, x2, y2 = edges
+    inside = numpy.zeros(len(x), dtype=bool)
+    boundary = numpy.zeros(len(x), dtype=bool)
+    chunk = max(1, _CHUNK // len(x1))
+    for start in xrange(0, len(x), chunk):
+        px = x[start:start + chunk]
+        py = y[start:start + chunk]
+        crosses = (y1 > py) != (y2 > py)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # horizontal edges do not cross, their intersection is not used
+            cross_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            left = px < cross_x
+        inside[start:start + chunk] = numpy.logical_xor.reduce(crosses & left, axis=0)
+        on_edge = ((x2 - x1) * (py - y1) == (y2 - y1) * (px - x1)) & \
+            (numpy.minimum(x1, x2) <= px) & (px <= numpy.maximum(x1, x2)) & \
+            (numpy.minimum(y1, y2) <= py) & (py <= numpy.maximum(y1, y2))
+        boundary[start:start + chunk] = on_edge.any(axis=0)
+    return inside, boundary
+
+def _relate(polygon, points):
+    points = _points(points)
+    inside = numpy.zeros(len(points), dtype=bool)
+    boundary = numpy.zeros(len(points), dtype=bool)
+    edges, bounds = _edges(polygon)
+    if edges is None:
+        return inside, boundary
+    minx, miny, maxx, maxy = bounds
+    candidates = numpy.flatnonzero((points[:, 0] >= minx) & (points[:, 0] <= maxx) &
+                                   (points[:, 1] >= miny) & (points[:, 1] <= maxy))
+    inside[candidates], boundary[candidates] = _locate(edges, points[candidates, 0],
+                                                       points[candidates, 1])
+    return inside, boundary
+
+def gcontains(polygon, points):
+    """Returns a boolean array, whether the (multi-)polygon contains each of
+    the points (points on the boundary are not contained).
+    """
+    inside, boundary = _relate(polygon, points)
+    return inside & ~boundary
+
+def within(points, polygon):
+    """Returns a boolean array, whether each of the points is within the
+    (multi-)polygon.
+    """
+    return gcontains(polygon, points)
+
+def intersects(polygon, points):
+    """Returns a boolean array, whether the (multi-)polygon intersects each of
+    the points, i.e. whether the points are inside or on the boundary.
+    """
+    inside, boundary = _relate(polygon, points)
+    return inside | boundary
+
+def containing(polygons, points):
+    """Returns, for each point, the index of the first polygon of
+    ``polygons`` that contains it, or ``-1``.
+
+    The points are sorted once by their x coordinate, so that only those in
+    the bounding box of a polygon are tested against its edges.
+    """
+    points = _points(points)
+    order = numpy.argsort(points[:, 0], kind='mergesort')
+    xs = points[order, 0]
+    ys = points[order, 1]
+    result = numpy.empty(len(points), dtype=numpy.intp)
+    result.fill(-1)
+    for (index, polygon) in enumerate(polygons):
+        edges, bounds = _edges(polygon)
+        if edges is None:
+            continue
+        minx, miny, maxx, maxy = bounds
+        start = numpy.searchsorted(xs, minx, 'left')
+        end = numpy.searchsorted(xs, maxx, 'right')
+        candidates = start + numpy.flatnonzero((ys[start:end] >= miny) & (ys[start:end] <= maxy))
+        candidates = candidates[result[order[candidates]] < 0]
+        if len(candidates) == 0:
+            continue
+        inside, boundary = _locate(edges, xs[candidates], ys[candidates])
+        result[order[candidates[inside & ~boundary]]] = index
+    return result
+
+def bounds(geometries):
+    """Returns the bounding boxes ``(minx, miny, maxx, maxy)`` of the
+    geometries as an array of shape ``(n, 4)``, with NaN for empty
+    geometries.
+    """
+    result = numpy.empty((len(geometries), 4))
+    result.fill(numpy.nan)
+    for (i, geometry) in enumerate(geometries):
+        if geometry is None:
+            continue
+        if isinstance(geometry, PersistentSpatialElement):
+            # loaded geometries cache their bounds
+            b = geometry.bounds
+        else:
+            b = geometry_bounds(as_geometry(geometry))
+        if b is not None:
+            result[i] = b
+    return result
+
+def bbox_intersects(boxes, other):
+    """Tests whether the bounding boxes ``boxes`` (an array of shape
+    ``(n, 4)``, see :func:`bounds`) intersect ``other``: a single box, for
+    which an array of shape ``(n, )`` is returned, or an array of shape
+    ``(m, 4)``, for which an ``(n, m)`` matrix is returned.
+    """
+    boxes = numpy.asarray(boxes, dtype=float)
+    other = numpy.asarray(other, dtype=float)
+    if other.ndim == 2:
+        boxes = boxes[:, numpy.newaxis, :]
+    with numpy.errstate(invalid='ignore'):
+        # empty (NaN) boxes do not intersect
+        return (boxes[..., 0] <= other[..., 2]) & (boxes[..., 2] >= other[..., 0]) & \
+            (boxes[..., 1] <= other[..., 3]) & (boxes[..., 3] >= other[..., 1])